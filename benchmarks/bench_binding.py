@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""Microbenchmark of the bam path rewriting (-b/--binding).
+
+Runs a million paths through Path_Rewriter and, for comparison, through the
+uncompiled update_dir used before. The paths are drawn from a pool of unique
+bam files, as the same bam files are listed again and again across groups.
+
+    python benchmarks/bench_binding.py --paths 1000000 --unique 20000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from igv_snapshot_maker.binding import Path_Rewriter
+from igv_snapshot_maker.igv_snapshot_maker import update_dir
+
+RULES = [
+    ('Mac', '^/DCEG', '/Volumes/ifs/DCEG'),
+    ('Mac', '^/data', '/Volumes'),
+    ('Mac', '^/data/DCEG_pRCC_SV', '/Volumes/DCEG_pRCC_SV'),
+    ('Mac', '^/mnt/nfs/gigantor/ifs/DCEG', '/Volumes/ifs/DCEG'),
+    ('Mac', '^/scratch', '/Volumes/scratch'),
+]
+
+ROOTS = [
+    '/DCEG/Projects/Exome/SequencingData/BAM_reformatted/BAM_recalibrated/CMMMed',
+    '/data/DCEG_pRCC_SV/EAGLE_Kidney_BAM',
+    '/data/other_project/bam',
+    '/mnt/nfs/gigantor/ifs/DCEG/CGF/Bioinformatics',
+    '/home/user/bam',
+]
+
+
+def make_paths(n, unique, seed=1):
+    rng = random.Random(seed)
+    pool = ['%s/SAMPLE_%06d.bam' % (rng.choice(ROOTS), k) for k in range(unique)]
+    return([rng.choice(pool) for k in range(n)])
+
+
+def bench(label, func, paths):
+    t0 = time.perf_counter()
+    for p in paths:
+        func(p)
+    elapsed = time.perf_counter() - t0
+    print("%-40s %8.3f s %12.0f paths/s" % (label, elapsed, len(paths) / elapsed))
+    return(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark of the bam path rewriting")
+    parser.add_argument("--paths", default=1000000, type=int, help="Number of paths to rewrite, Defaults to 1000000")
+    parser.add_argument("--unique", default=20000, type=int, help="Number of unique paths, Defaults to 20000")
+    parser.add_argument("--baseline", default=100000, type=int, help="Number of paths for the update_dir baseline (0 to skip), Defaults to 100000")
+    args = parser.parse_args()
+
+    paths = make_paths(args.paths, args.unique)
+    print("%d paths (%d unique), %d rules" % (len(paths), args.unique, len(RULES)))
+
+    bench("Path_Rewriter (literal prefixes)", Path_Rewriter(RULES).rewrite, paths)
+    bench("Path_Rewriter (regex)", Path_Rewriter(RULES, regex=True).rewrite, paths)
+
+    cold = Path_Rewriter(RULES)
+    bench("Path_Rewriter (no memo, unique paths)", lambda p: (cold.cache.clear(), cold.rewrite(p)), paths[:args.unique])
+
+    if args.baseline > 0:
+        # update_dir only takes one rule
+        target_os, orig_prefix, new_prefix = RULES[1]
+        bench("update_dir (1 rule, baseline)", lambda p: update_dir(p, target_os, orig_prefix, new_prefix), paths[:args.baseline])
+
+    return(0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
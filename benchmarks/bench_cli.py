@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""End-to-end benchmark of the igv_snapshot_maker command line.
+
+For each input size, a synthetic input shaped like files/pRCC_SV.yaml is
+written (see synthetic_input.py) and the CLI is run on it with the mock IGV
+as the --igv command: it parses the batch scripts and writes placeholder
+PNGs, so the whole generation path runs without Java or Xvfb. The wall time,
+throughput, peak RSS of the CLI process and the number of files written are
+reported for each size.
+
+    python benchmarks/bench_cli.py --sizes 1000 10000 100000 --bams 4 -j 4
+    python benchmarks/bench_cli.py --sizes 1000000 --norun --json bench.json
+
+Extra CLI options are passed after --, e.g. -- --sort-loci --no-snapshot-scripts
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, os.pardir)
+sys.path.insert(0, HERE)
+
+from synthetic_input import write_input
+
+MOCK_IGV = "%s -m igv_snapshot_maker.mock_igv" % sys.executable
+
+
+def count_files(output_dir):
+    """Number of files in the output directory, per extension"""
+    counts = {}
+    for root, dirs, files in os.walk(output_dir):
+        for fn in files:
+            ext = os.path.splitext(fn)[1] or fn
+            counts[ext] = counts.get(ext, 0) + 1
+    return(counts)
+
+
+def run_cli(input_fn, output_dir, work_dir, jobs=1, engine="batch", norun=False, extra=()):
+    """Run the CLI in a child process
+
+    Returns:
+        tuple: exit code, wall time (s), peak RSS of the CLI process (MB)
+    """
+    cmd = [sys.executable, "-m", "igv_snapshot_maker.cli", "-i", input_fn, "-o", output_dir,
+           "--igv", MOCK_IGV, "--no-xvfb", "-j", str(jobs), "--engine", engine]
+    if norun:
+        cmd.append("--norun")
+    cmd.extend(extra)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.abspath(ROOT) + os.pathsep + env.get('PYTHONPATH', '')
+    t0 = time.perf_counter()
+    process = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=subprocess.DEVNULL)
+    # wait4 gives the resource usage of this process only, not of the mock IGV processes it starts
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - t0
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    return(process.returncode, elapsed, usage.ru_maxrss / 1024.0) # ru_maxrss is in KB on Linux
+
+
+def bench(size, args, work_dir):
+    input_fn = os.path.join(work_dir, "synthetic_%d.yaml" % size)
+    t0 = time.perf_counter()
+    groups = write_input(input_fn, size, bams_per_group=args.bams, per_group=args.per_group)
+    gen_s = time.perf_counter() - t0
+
+    output_dir = os.path.join(work_dir, "out_%d" % size)
+    rc, elapsed, rss = run_cli(input_fn, output_dir, work_dir, jobs=args.jobs, engine=args.engine,
+                               norun=args.norun, extra=args.extra)
+    counts = count_files(output_dir)
+    return({
+        'snapshots': size,
+        'groups': groups,
+        'bams_per_group': args.bams,
+        'input_mb': round(os.path.getsize(input_fn) / 1e6, 1),
+        'input_s': round(gen_s, 2),
+        'returncode': rc,
+        'elapsed_s': round(elapsed, 2),
+        'snapshots_per_s': round(size / elapsed, 1),
+        'peak_rss_mb': round(rss, 1),
+        'bat_files': counts.get('.bat', 0),
+        'png_files': counts.get('.png', 0),
+        'files': sum(counts.values()),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of igv_snapshot_maker with a mock IGV")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000], help="Numbers of snapshots, Defaults to 1000 10000")
+    parser.add_argument("--bams", default=4, type=int, help="Bam files per group, Defaults to 4")
+    parser.add_argument("--per-group", default=40, type=int, dest='per_group', help="Snapshots per group, Defaults to 40")
+    parser.add_argument("-j", "--jobs", default=1, type=int, help="IGV workers (-j of the CLI), Defaults to 1")
+    parser.add_argument("--engine", default='batch', choices=['batch', 'port'], help="IGV engine of the CLI, Defaults to batch")
+    parser.add_argument("-n", "--norun", action='store_true', help="Only generate the batch scripts (--norun of the CLI)")
+    parser.add_argument("-w", "--work-dir", dest='work_dir', help="Keep the inputs and outputs in this directory, Defaults to a temporary directory")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("extra", nargs="*", help="Extra options of the CLI, after --")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="bench_cli_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    header = ['snapshots', 'groups', 'returncode', 'elapsed_s', 'snapshots_per_s', 'peak_rss_mb', 'bat_files', 'png_files', 'files']
+    print("\t".join(header))
+    results = []
+    try:
+        for size in args.sizes:
+            r = bench(size, args, work_dir)
+            results.append(r)
+            print("\t".join(str(r[k]) for k in header))
+            sys.stdout.flush()
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json is not None:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=1)
+    return(0 if all(r['returncode'] == 0 for r in results) else 1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""Write a synthetic snapshot YAML file shaped like files/pRCC_SV.yaml.
+
+Each group has its own bam files and its snapshots come in SV breakpoint
+pairs (_BP1/_BP2), half of them intra- and half inter-chromosomal, with a
+100bp window and ext 200 as in the pRCC SV input. The output is written line
+by line, so a million snapshots do not need to fit in memory.
+
+    python benchmarks/synthetic_input.py -n 100000 --bams 4 --per-group 40 -o sv_100k.yaml
+"""
+import sys
+import random
+import argparse
+
+CHROMS = [str(k) for k in range(1, 23)] + ['X']
+BAM_ROOT = '/data/DCEG_pRCC_SV/EAGLE_Kidney_BAM'
+
+
+def iter_lines(snapshots, bams_per_group=4, per_group=40, seed=1):
+    """The lines of the synthetic YAML file
+
+    Args:
+        snapshots (int): total number of snapshots
+        bams_per_group (int, optional): bam files of each group. Defaults to 4.
+        per_group (int, optional): snapshots of each group. Defaults to 40.
+        seed (int, optional): random seed. Defaults to 1.
+    """
+    rng = random.Random(seed)
+    yield "---"
+    n = 0
+    g = 0
+    while n < snapshots:
+        g += 1
+        group = "RCC_%06d_T01" % g
+        yield "-"
+        yield "  bam_files:"
+        for b in range(bams_per_group):
+            yield "    - %s/GPK%06d_%04d.bam" % (BAM_ROOT, g, 401 + b)
+        yield "  name: %s" % group
+        yield "  snapshots:"
+
+        k = 0
+        while k < per_group and n < snapshots:
+            sv = k // 2 + 1
+            kind = "INTRA" if sv % 2 == 0 else "INTER"
+            chr1 = rng.choice(CHROMS)
+            chr2 = chr1 if kind == "INTRA" else rng.choice(CHROMS)
+            pos1 = rng.randint(1000000, 150000000)
+            pos2 = pos1 + rng.randint(1000, 5000000) if kind == "INTRA" else rng.randint(1000000, 150000000)
+            for bp, chr, pos in ((1, chr1, pos1), (2, chr2, pos2)):
+                if k >= per_group or n >= snapshots:
+                    break
+                yield "    -"
+                yield "      chr: '%s'" % chr
+                yield "      ext: 200"
+                yield "      name: %s_%s_SV%05d_BP%d" % (group, kind, sv, bp)
+                yield "      start: %d" % pos
+                yield "      stop: %d" % (pos + 101)
+                k += 1
+                n += 1
+
+
+def write_input(fn, snapshots, bams_per_group=4, per_group=40, seed=1):
+    """Write the synthetic YAML file, and return the number of groups"""
+    groups = 0
+    with open(fn, "w") as out:
+        for line in iter_lines(snapshots, bams_per_group=bams_per_group, per_group=per_group, seed=seed):
+            if line == "-":
+                groups += 1
+            out.write(line + "\n")
+    return(groups)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic snapshot YAML file shaped like pRCC_SV.yaml")
+    parser.add_argument("-n", "--snapshots", default=1000, type=int, help="Number of snapshots, Defaults to 1000")
+    parser.add_argument("--bams", default=4, type=int, help="Bam files per group, Defaults to 4")
+    parser.add_argument("--per-group", default=40, type=int, dest='per_group', help="Snapshots per group, Defaults to 40")
+    parser.add_argument("--seed", default=1, type=int, help="Random seed, Defaults to 1")
+    parser.add_argument("-o", "--output", default="synthetic.yaml", help="Output YAML file, Defaults to synthetic.yaml")
+    args = parser.parse_args()
+
+    groups = write_input(args.output, args.snapshots, bams_per_group=args.bams, per_group=args.per_group, seed=args.seed)
+    print("Wrote %d snapshots in %d groups to %s" % (args.snapshots, groups, args.output))
+    return(0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""Streaming readers of the caller tables, yielding the groups of the YAML input.
+
+Each reader yields the same records as iter_groups(): dictionaries with the
+name, bam_files and snapshots of a group, one group at a time, so the batch
+scripts are written while the tables are still being read. They replace the
+Perl scripts in files/ and the intermediate YAML file they wrote:
+
++ mocca: parse_mocca_meerkat.pl, the SVs called by Meerkat in the MoCCA-SV output
++ mocca-nonmeerkat: parse_mocca_nonmeerkat.pl, the SVs called by 3 other callers
++ mie: prepare_mie.pl, the Mendelian inheritance errors of a trio
++ bed and vcf: the regions or variants of a file, with the bam files given
+"""
+import os
+import re
+import csv
+import gzip
+import logging
+
+from .loader import iter_groups
+from .igv_snapshot_maker import MAX_WINDOW
+
+INPUT_FORMATS = ['yaml', 'mocca', 'mocca-nonmeerkat', 'mie', 'bed', 'vcf']
+
+# columns of the MoCCA-SV tables:
+# chrom, start, end, svaba, delly, manta, gridss, meerkat, caller_count, original caller output
+_MOCCA_INTRA = list(range(0, 9)) + [27]
+_MOCCA_INTER = list(range(0, 3)) + list(range(6, 13))
+_CALLERS = ['svaba', 'delly', 'manta', 'gridss']
+
+
+def open_text(fn):
+    """Open a text file, gzipped or not"""
+    if fn.endswith(".gz"):
+        return(gzip.open(fn, "rt"))
+    return(open(fn, "r"))
+
+
+def new_snapshot(name, chr, start, stop, ext=None):
+    rv = {'name': name, 'chr': chr, 'start': int(start), 'stop': int(stop)}
+    if ext is not None:
+        rv['ext'] = int(ext)
+    return(rv)
+
+
+def read_tn_samples(tn_fn, bam_dir):
+    """Read the tumor/normal input of MoCCA-SV, one line per sample: <sample> <tumor bam> <normal bam>
+
+    Returns:
+        list: (subject, bam files) in the order of the file; the bam files are
+        sorted as the normal, T01, and the other tissues
+    """
+    subjects = []
+    tissues = {}
+    with open(tn_fn, "r") as fin:
+        for line in fin:
+            words = line.split()
+            if len(words) < 3:
+                continue
+            m = re.match(r'^(.+)_([^_]+)$', words[0])
+            if m is None:
+                logging.warning("Skip the sample %s: no tissue suffix" % words[0])
+                continue
+            subj_id, tissue_id = m.groups()
+            if subj_id not in tissues:
+                subjects.append(subj_id)
+                tissues[subj_id] = {}
+            tissues[subj_id]['normal'] = words[2]
+            tissues[subj_id][tissue_id] = words[1]
+
+    def rank(tissue):
+        if 'normal' in tissue:
+            return((0, tissue))
+        if 'T01' in tissue:
+            return((1, tissue))
+        return((1000, tissue))
+
+    return([(s, [os.path.join(bam_dir, tissues[s][t]) for t in sorted(tissues[s], key=rank)]) for s in subjects])
+
+
+def _keep_meerkat(calls):
+    return(calls['meerkat'] == "orig")
+
+
+def _keep_nonmeerkat(calls):
+    if calls['meerkat'] != '0' or sum(1 for c in _CALLERS if calls[c] != '0') < 3:
+        return(False)
+    # the redundant SVs: gridss > svaba > manta > delly
+    return(re.search(r'[1-9].*orig', "_".join(calls[c] for c in ['gridss', 'svaba', 'manta', 'delly'])) is None)
+
+
+def parse_mocca(sam_id, is_intra, fn, meerkat=True):
+    """The snapshots of the SVs in a MoCCA-SV table, two breakpoints per SV
+
+    Args:
+        sam_id (str): the sample
+        is_intra (bool): intrachromosomal (True) or interchromosomal (False) SVs
+        fn (str): the MoCCA-SV table
+        meerkat (bool, optional): keep the SVs called by Meerkat (True) or by 3 of the other callers (False)
+
+    Returns:
+        list: the snapshots
+    """
+    keep = _keep_meerkat if meerkat else _keep_nonmeerkat
+    ext, overview_ext = (200, 500) if meerkat else (500, 800)
+    indice = _MOCCA_INTRA if is_intra else _MOCCA_INTER
+
+    snapshots = []
+    with open_text(fn) as fin:
+        fin.readline() # the header
+        for row_id, line in enumerate(fin, 1):
+            items = line.rstrip("\n").split("\t")
+            if len(items) <= indice[-1]:
+                continue
+            chrom, start, end, svaba, delly, manta, gridss, meerkat_call, caller_count, orig = [items[k] for k in indice]
+            calls = {'svaba': svaba, 'delly': delly, 'manta': manta, 'gridss': gridss, 'meerkat': meerkat_call}
+            if not keep(calls):
+                continue
+
+            sv_id = "%s_%s_SV%05d" % (sam_id, "INTRA" if is_intra else "INTER", row_id)
+            start, end = int(start), int(end)
+            overview = None
+            if is_intra:
+                length = end - start + 1 # MoCCA-SV uses 1-based coordinates
+                ext2 = max(overview_ext, int(length / 6.0))
+                if not meerkat and length + 2 * ext2 <= MAX_WINDOW:
+                    overview = new_snapshot(sv_id + "_overview", chrom, start, end, ext2)
+                chrom2, start2, end2 = chrom, end, end
+                end = start
+            else:
+                chrom2, start2, end2 = items[3:6]
+
+            snapshots.append(new_snapshot(sv_id + "_BP1", chrom, start, end, ext))
+            snapshots.append(new_snapshot(sv_id + "_BP2", chrom2, start2, end2, ext))
+            if overview is not None:
+                snapshots.append(overview)
+    return(snapshots)
+
+
+def iter_mocca(mocca_dir, tn_fn, bam_dir, meerkat=True):
+    """The groups of the MoCCA-SV output: one per subject, for its T01 sample
+
+    Args:
+        mocca_dir (str): the compare_and_annotate folder of MoCCA-SV
+        tn_fn (str): the tumor/normal input file of MoCCA-SV
+        bam_dir (str): the folder of the bam files
+        meerkat (bool, optional): the SVs called by Meerkat, or else by 3 of the other callers. Defaults to True.
+    """
+    for subj_id, bam_files in read_tn_samples(tn_fn, bam_dir):
+        sam_id = subj_id + "_T01"
+        snapshots = []
+        for is_intra, prefix in ((False, "interchromosomal_SVs_"), (True, "intrachromosomal_SVs_")):
+            fn = os.path.join(mocca_dir, prefix + sam_id)
+            if not os.path.isfile(fn):
+                logging.warning("No MoCCA-SV output for %s: %s" % (sam_id, fn))
+                continue
+            snapshots.extend(parse_mocca(sam_id, is_intra, fn, meerkat=meerkat))
+
+        if len(snapshots) > 0:
+            yield {'name': sam_id, 'bam_files': bam_files, 'snapshots': snapshots}
+
+
+def iter_mie(mie_fn, manifest_fn, bam_dir):
+    """The groups of a table of Mendelian inheritance errors, one per family
+
+    The bam files are those of the father, the mother and the child, named
+    after their LIMSSample_ID in the trio manifest. A new group starts when
+    the FAMILY column changes. The families with a member missing from the
+    trio manifest are skipped with a warning.
+
+    Args:
+        mie_fn (str): the MIE table (CHROM, POS, FAMILY, ...)
+        manifest_fn (str): the trio manifest (PI_Subject_ID, LIMSSample_ID, ...)
+        bam_dir (str): the folder of the bam files
+    """
+    with open(manifest_fn, "r") as fin:
+        samples = dict((r['PI_Subject_ID'], r['LIMSSample_ID']) for r in csv.DictReader(fin, delimiter="\t"))
+
+    cid = None   # the current family
+    group = None # its group, None if it is skipped
+    with open_text(mie_fn) as fin:
+        for row_id, r in enumerate(csv.DictReader(fin, delimiter="\t"), 1):
+            if r['FAMILY'] != cid:
+                if group is not None:
+                    yield group
+                cid = r['FAMILY']
+                fam = cid[:5]
+                members = (fam + "fa", fam + "mo", cid)
+                missing = [s for s in members if s not in samples]
+                if len(missing) > 0:
+                    logging.warning("Skip the family %s: %s not in the trio manifest %s" % (cid, ", ".join(missing), manifest_fn))
+                    group = None
+                else:
+                    group = {'name': cid, 'bam_files': [os.path.join(bam_dir, samples[s] + ".bam") for s in members], 'snapshots': []}
+            if group is not None:
+                group['snapshots'].append(new_snapshot("%s_MIE_%05d" % (cid, row_id), r['CHROM'], r['POS'], r['POS']))
+    if group is not None:
+        yield group
+
+
+def _group_name(fn, group_name):
+    if group_name is not None:
+        return(group_name)
+    name = os.path.basename(fn)
+    for ext in (".gz", ".bed", ".vcf"):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return(name)
+
+
+def iter_bed(bed_fn, bam_files, group_name=None):
+    """The regions of a BED file, as a single group
+
+    The BED coordinates are 0-based and half-open; the snapshots are 1-based.
+    The snapshots are named after the 4th column, or else numbered, and are
+    extended by -e like the snapshots without ext.
+    """
+    name = _group_name(bed_fn, group_name)
+    snapshots = []
+    with open_text(bed_fn) as fin:
+        for line in fin:
+            if line.startswith(("#", "track", "browser")) or line.strip() == "":
+                continue
+            words = line.rstrip("\n").split("\t")
+            sp_name = words[3] if len(words) > 3 and words[3] != "" else "%s_%05d" % (name, len(snapshots) + 1)
+            snapshots.append(new_snapshot(sp_name, words[0], int(words[1]) + 1, words[2]))
+    yield {'name': name, 'bam_files': list(bam_files), 'snapshots': snapshots}
+
+
+def iter_vcf(vcf_fn, bam_files, group_name=None):
+    """The variants of a VCF file, as a single group
+
+    A variant spans its reference allele, or up to INFO/END for the structural
+    variants. The snapshots are named after the ID column, or else numbered.
+    """
+    name = _group_name(vcf_fn, group_name)
+    snapshots = []
+    with open_text(vcf_fn) as fin:
+        for line in fin:
+            if line.startswith("#"):
+                continue
+            words = line.rstrip("\n").split("\t")
+            if len(words) < 5:
+                continue
+            chr, pos, vid, ref = words[0], int(words[1]), words[2], words[3]
+            stop = pos + max(len(ref), 1) - 1
+            if len(words) > 7:
+                m = re.search(r'(?:^|;)END=(\d+)', words[7])
+                if m is not None:
+                    stop = int(m.group(1))
+            sp_name = vid if vid not in (".", "") else "%s_%05d" % (name, len(snapshots) + 1)
+            snapshots.append(new_snapshot(sp_name, chr, pos, stop))
+    yield {'name': name, 'bam_files': list(bam_files), 'snapshots': snapshots}
+
+
+def iter_input(input_fn, input_format="yaml", samples=None, bam_dir="", bam_files=(), group_name=None):
+    """The groups of an input, in any of the INPUT_FORMATS
+
+    Args:
+        input_fn (str): the YAML file, the MoCCA-SV output folder, the MIE table, or the BED/VCF file
+        input_format (str, optional): one of INPUT_FORMATS. Defaults to "yaml".
+        samples (str, optional): the tumor/normal input of MoCCA-SV, or the trio manifest of the MIE
+        bam_dir (str, optional): the folder of the bam files of mocca and mie
+        bam_files (list, optional): the bam files of bed and vcf
+        group_name (str, optional): the group of bed and vcf. Defaults to the file name.
+    """
+    if input_format == "yaml":
+        return(iter_groups(input_fn))
+    if input_format in ("mocca", "mocca-nonmeerkat", "mie") and samples is None:
+        raise ValueError("The %s input needs the samples file" % input_format)
+    if input_format in ("bed", "vcf") and len(bam_files) == 0:
+        raise ValueError("The %s input needs the bam files" % input_format)
+
+    if input_format == "mocca":
+        return(iter_mocca(input_fn, samples, bam_dir, meerkat=True))
+    if input_format == "mocca-nonmeerkat":
+        return(iter_mocca(input_fn, samples, bam_dir, meerkat=False))
+    if input_format == "mie":
+        return(iter_mie(input_fn, samples, bam_dir))
+    if input_format == "bed":
+        return(iter_bed(input_fn, bam_files, group_name=group_name))
+    if input_format == "vcf":
+        return(iter_vcf(input_fn, bam_files, group_name=group_name))
+    raise ValueError("Unknown input format: %s" % input_format)
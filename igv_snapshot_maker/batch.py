@@ -0,0 +1,295 @@
+"""Intermediate representation of the IGV batch scripts of a group."""
+import os
+import logging
+
+from .igv_snapshot_maker import mkdir_p
+
+
+def write_batch_file(bat_name, commands):
+    """Write a batch script in a single buffered write
+
+    Args:
+        bat_name (str): batch script file name
+        commands (list): the batch commands, one per line
+    """
+    with open(bat_name, "w") as bat:
+        bat.write("\n".join(commands) + "\n")
+    return(bat_name)
+
+
+class Snapshot_Locus:
+    """One goto (and snapshot) step of the master batch script"""
+
+    def __init__(self, sp, aliases=(), snapshot=True):
+        """Constructor
+
+        Args:
+            sp (dict): the snapshot shown in the IGV window (name, chr, start, stop, ext)
+            aliases (list, optional): other snapshots shown in the same window, marked as regions
+            snapshot (bool, optional): take the snapshot after the goto. Defaults to True.
+        """
+        self.snapshot = sp
+        self.aliases = list(aliases)
+        self.take_snapshot = snapshot
+
+    @property
+    def name(self):
+        return(self.snapshot['name'])
+
+
+class Group_Script:
+    """The batch scripts of one group, built once and rendered to every flavour
+
+    A group is made of a header (new, genome), the bam loads with the track
+    setting, the regions of interest and the goto/snapshot steps of the
+    master script. The three flavours written by igv_snapshot_maker are
+    rendered from it:
+
+    + <group>.bat: the master script taking the snapshots at the server
+    + <group>_ROIs.bat: the regions of interest for the local review
+    + <snapshot>.bat: one script per snapshot for the local review (optional)
+
+    The review scripts load the bam files from `local_bam_files`, the paths
+    after the binding to the local computer.
+    """
+
+    def __init__(self, maker, name, bam_files, snapshots, local_bam_files=None):
+        """Constructor
+
+        Args:
+            maker (IGV_Snapshot_Maker): provides the genome, extension and track setting
+            name (str): name of the group
+            bam_files (list): the bam files loaded at the server
+            snapshots (list): all the snapshots of the group, in the input order
+            local_bam_files (list, optional): the bam files after the binding. Defaults to bam_files.
+        """
+        self.maker = maker
+        self.name = name
+        self.dir_name = maker.get_snapshot_dir(name)
+        self.bam_files = list(bam_files)
+        self.local_bam_files = self.bam_files if local_bam_files is None else list(local_bam_files)
+        self.snapshots = list(snapshots)
+        self.loci = []
+
+    def add_locus(self, sp, aliases=(), snapshot=True):
+        """Add a goto/snapshot step to the master script"""
+        locus = Snapshot_Locus(sp, aliases=aliases, snapshot=snapshot)
+        self.loci.append(locus)
+        return(locus)
+
+    def png_name(self, sp):
+        """The absolute path of the PNG file of a snapshot"""
+        return(os.path.join(self.dir_name, self.maker.fix_name(sp['name']) + ".png"))
+
+    @property
+    def png_files(self):
+        """The PNG files expected from the master script"""
+        return([self.png_name(l.snapshot) for l in self.loci if l.take_snapshot])
+
+    def bat_name(self, name):
+        return(os.path.join(self.dir_name, self.maker.fix_name(name) + ".bat"))
+
+    @property
+    def session_key(self):
+        """The bam files loaded by the master script: the groups with the same key can share an IGV session"""
+        return(tuple(os.path.normpath(f) for f in self.bam_files))
+
+    # Command generation
+    def header_commands(self, bam_files, review=False):
+        return(self.maker.header_commands(review=review) + self.maker.load_commands(bam_files))
+
+    def region_commands(self, sp):
+        """The regions of a snapshot: one per breakpoint of a pair (see planner.pair_breakpoints)"""
+        return([self.maker.get_region(m['name'], m['chr'], m['start'], m['stop']) for m in sp.get('mates', [sp])])
+
+    def goto_commands(self, sp):
+        """The goto and track setting of a snapshot, a split screen for the pairs and split windows (see planner)"""
+        loci = sp.get('mates') or sp.get('flanks')
+        if loci is not None:
+            goto = self.maker.get_multi_goto([(m['chr'], m['start'], m['stop'], m.get('ext')) for m in loci])
+        else:
+            goto = self.maker.get_goto(sp['chr'], sp['start'], sp['stop'], sp.get('ext'))
+        if sp.get('policy') == 'coverage':
+            return([goto] + self.maker.wide_track_commands())
+        return([goto] + self.maker.track_commands())
+
+    @property
+    def policies(self):
+        """The PNG files of the master script rendered with a policy for the wide windows"""
+        return(dict((self.png_name(l.snapshot), l.snapshot['policy']) for l in self.loci if 'policy' in l.snapshot))
+
+    def locus_commands(self, locus):
+        commands = []
+        for sp in locus.aliases:
+            commands.extend(self.region_commands(sp))
+        commands.extend(self.region_commands(locus.snapshot))
+        commands.extend(self.goto_commands(locus.snapshot))
+        if locus.take_snapshot:
+            commands.append("snapshot %s" % (self.maker.fix_name(locus.name) + ".png"))
+        return(commands)
+
+    def body_commands(self, loci=None):
+        """The snapshot directory and the goto/snapshot steps, without the header
+
+        Args:
+            loci (list, optional): the loci to render. Defaults to all the loci of the master script.
+        """
+        if loci is None:
+            loci = self.loci
+        commands = ["snapshotDirectory %s" % self.dir_name]
+        for locus in loci:
+            commands.extend(self.locus_commands(locus))
+        return(commands)
+
+    def master_commands(self, loci=None):
+        return(self.header_commands(self.bam_files) + self.body_commands(loci) + ["exit"])
+
+    def roi_commands(self):
+        commands = self.header_commands(self.local_bam_files, review=True) + ["snapshotDirectory %s" % self.dir_name]
+        for sp in self.snapshots:
+            commands.extend(self.region_commands(sp))
+        return(commands)
+
+    def snapshot_commands(self, sp):
+        commands = self.header_commands(self.local_bam_files, review=True) + ["snapshotDirectory %s" % self.dir_name]
+        return(commands + self.region_commands(sp) + self.goto_commands(sp))
+
+    def panel_scripts(self, panels):
+        """Split the bam files of the group into panel shards (see Panel_Script)
+
+        Args:
+            panels (int): the number of panels
+
+        Returns:
+            list: one Panel_Script per panel
+        """
+        return([Panel_Script(self, k + 1, start, stop) for k, (start, stop) in enumerate(split_bam_files(self.bam_files, panels))])
+
+    def write(self, rois=True, snapshot_scripts=True):
+        """Write the batch scripts of the group
+
+        Args:
+            rois (bool, optional): write <group>_ROIs.bat. Defaults to True.
+            snapshot_scripts (bool, optional): write one script per snapshot. Defaults to True.
+
+        Returns:
+            str: the master batch script file name
+        """
+        mkdir_p(self.dir_name)
+        master_bat_fn = write_batch_file(self.bat_name(self.name), self.maker.optimize_commands(self.master_commands()))
+        if rois:
+            write_batch_file(self.bat_name(self.name + '_ROIs'), self.roi_commands())
+        if snapshot_scripts:
+            for sp in self.snapshots:
+                write_batch_file(self.bat_name(sp['name']), self.snapshot_commands(sp))
+        logging.info("Generated the batch scripts of %s: %d loci, %d snapshots" % (self.name, len(self.loci), len(self.snapshots)))
+        return(master_bat_fn)
+
+
+def split_bam_files(bam_files, panels):
+    """Split the bam files into consecutive, balanced panel shards, in the input order
+
+    Args:
+        bam_files (list): the bam files of a group
+        panels (int): the number of shards, at most one per bam file
+
+    Returns:
+        list: the (start, stop) slice of each shard
+    """
+    panels = max(1, min(panels, len(bam_files)))
+    size, extra = divmod(len(bam_files), panels)
+    rv = []
+    start = 0
+    for k in range(panels):
+        stop = start + size + (1 if k < extra else 0)
+        rv.append((start, stop))
+        start = stop
+    return(rv)
+
+
+class Panel_Script(Group_Script):
+    """A panel shard of a group: a slice of its bam files, rendered at every locus of the group
+
+    The panel shares the loci of its group and writes its PNG files to the
+    panels/<k> folder of the group, where they wait to be stitched into the
+    snapshots of the group (see panels.Panel_Join).
+    """
+
+    def __init__(self, group, index, start, stop):
+        """Constructor
+
+        Args:
+            group (Group_Script): the group, with its loci
+            index (int): the number of the panel, from 1
+            start (int): the first bam file of the panel
+            stop (int): one past the last bam file of the panel
+        """
+        Group_Script.__init__(self, group.maker, group.name, group.bam_files[start:stop], group.snapshots,
+                              local_bam_files=group.local_bam_files[start:stop])
+        self.group = group
+        self.index = index
+        self.dir_name = os.path.join(group.dir_name, "panels", str(index))
+        self.loci = group.loci
+
+    def write(self, rois=False, snapshot_scripts=False):
+        """Write the master script of the panel (the review scripts are the ones of the group)"""
+        mkdir_p(self.dir_name)
+        return(write_batch_file(self.bat_name(self.name), self.maker.optimize_commands(self.master_commands())))
+
+
+def session_commands(scripts):
+    """Commands rendering several groups loading the same bam files in one IGV session
+
+    The header and the bam loading come from the first group; each group then
+    switches the snapshot directory, so the PNG files land in the same
+    folders as if the groups were rendered in separate sessions.
+
+    Args:
+        scripts (list): Group_Script objects with the same bam files (see Group_Script.session_key)
+    """
+    commands = scripts[0].header_commands(scripts[0].bam_files)
+    for script in scripts:
+        commands.extend(script.body_commands())
+    return(scripts[0].maker.optimize_commands(commands + ["exit"]))
+
+
+class Retry_Script:
+    """Write the batch scripts retrying the snapshots missing after a kill or crash
+
+    The retry script of attempt N is written next to the original batch
+    script, as <script>_retryN.bat. It loads the bam files again and only
+    visits the loci whose PNG file is missing.
+    """
+
+    def __init__(self, bat_name, scripts):
+        """Constructor
+
+        Args:
+            bat_name (str): the original batch script
+            scripts (list): Group_Script objects rendered by the original batch script
+        """
+        self.bat_name = bat_name
+        self.scripts = list(scripts)
+
+    def __call__(self, missing, attempt):
+        """Write the retry script
+
+        Args:
+            missing (list): the PNG files missing
+            attempt (int): the number of the retry
+
+        Returns:
+            str: the retry script file name, or None if no locus is missing
+        """
+        missing = set(missing)
+        commands = self.scripts[0].header_commands(self.scripts[0].bam_files)
+        loci = 0
+        for script in self.scripts:
+            todo = [l for l in script.loci if l.take_snapshot and script.png_name(l.snapshot) in missing]
+            if len(todo) > 0:
+                commands.extend(script.body_commands(todo))
+                loci += len(todo)
+        if loci == 0:
+            return(None)
+        retry_fn = "%s_retry%d.bat" % (os.path.splitext(self.bat_name)[0], attempt)
+        return(write_batch_file(retry_fn, self.scripts[0].maker.optimize_commands(commands + ["exit"])))
@@ -0,0 +1,136 @@
+"""Rewrite the bam paths for the mount points of the target computer."""
+import re
+import logging
+from pathlib import Path, PureWindowsPath
+
+
+# Characters making an original prefix a regular expression rather than a literal prefix
+_REGEX_CHARS = re.compile(r'[.*+?{}\[\]()|\\$^]')
+
+
+def format_path(path, target_os):
+    """Format a rewritten path for the target OS, as update_dir does"""
+    if target_os == "Mac":
+        return(str(Path(path)))
+    return(str(PureWindowsPath(Path(path))))
+
+
+class Binding_Rule:
+    """One rewriting rule: replace orig_prefix by new_prefix, then format the path for target_os"""
+
+    def __init__(self, target_os, orig_prefix, new_prefix, regex=False):
+        """Constructor
+
+        Without regex, an original prefix written as an anchored regular
+        expression without any other special character (e.g. '^/data', as in
+        the documentation of -b) is matched as the literal prefix '/data'.
+
+        Args:
+            target_os (str): Mac or Win
+            orig_prefix (str): the original path prefix
+            new_prefix (str): the new path prefix, with the escapes of re.sub
+            regex (bool, optional): match orig_prefix as a regular expression. Defaults to False.
+        """
+        self.target_os = target_os
+        self.regex = None
+        self.prefix = None
+        self.replacement = None
+
+        literal = orig_prefix[1:] if orig_prefix.startswith('^') else orig_prefix
+        if not regex and _REGEX_CHARS.search(literal) is None:
+            try:
+                # expand the escapes of the replacement as re.sub would ('T:\\\\' => 'T:\\')
+                self.replacement = re.sub('^', new_prefix, '')
+                self.prefix = literal
+            except re.error:
+                pass # group references: keep the regular expression
+
+        if self.prefix is None:
+            self.regex = re.compile(orig_prefix)
+            self.replacement = new_prefix
+
+    def __repr__(self):
+        if self.regex is not None:
+            return("Binding_Rule(%s, re:%s => %s)" % (self.target_os, self.regex.pattern, self.replacement))
+        return("Binding_Rule(%s, %s => %s)" % (self.target_os, self.prefix, self.replacement))
+
+
+class Path_Rewriter:
+    """Rewrite paths with many prefix rules, memoized per unique path
+
+    The literal rules are indexed by prefix length: a path is matched by
+    looking up its own prefixes of each indexed length in a dictionary, from
+    the longest to the shortest, so the cost does not grow with the number of
+    rules and the longest matching prefix wins. The regular expression rules
+    are tried afterwards, in the order they were given. As with update_dir,
+    a path matching no rule is still formatted for the target OS (the one of
+    the first rule).
+    """
+
+    def __init__(self, rules=(), regex=False):
+        """Constructor
+
+        Args:
+            rules (list, optional): (target_os, orig_prefix, new_prefix) of each rule
+            regex (bool, optional): match all the original prefixes as regular expressions. Defaults to False.
+        """
+        self.literal = {}  # prefix length => {prefix: rule}
+        self.lengths = []  # the indexed prefix lengths, longest first
+        self.regex_rules = []
+        self.target_os = None
+        self.cache = {}
+
+        for target_os, orig_prefix, new_prefix in rules:
+            self.add_rule(Binding_Rule(target_os, orig_prefix, new_prefix, regex=regex))
+
+    def __len__(self):
+        return(sum(len(r) for r in self.literal.values()) + len(self.regex_rules))
+
+    def add_rule(self, rule):
+        if self.target_os is None:
+            self.target_os = rule.target_os
+        if rule.regex is not None:
+            self.regex_rules.append(rule)
+        else:
+            self.literal.setdefault(len(rule.prefix), {}).setdefault(rule.prefix, rule)
+            self.lengths = sorted(self.literal, reverse=True)
+        self.cache.clear()
+        logging.debug("Add the path rule %r" % rule)
+
+    def match(self, path):
+        """The first rule matching a path, or None"""
+        for n in self.lengths:
+            rule = self.literal[n].get(path[:n])
+            if rule is not None:
+                return(rule)
+        for rule in self.regex_rules:
+            if rule.regex.search(path) is not None:
+                return(rule)
+        return(None)
+
+    def rewrite(self, path):
+        """Rewrite one path
+
+        Args:
+            path (str): the original path
+
+        Returns:
+            str: the path at the target computer
+        """
+        rv = self.cache.get(path)
+        if rv is not None:
+            return(rv)
+
+        rule = self.match(path)
+        if rule is None:
+            rv = path if self.target_os is None else format_path(path, self.target_os)
+        elif rule.regex is not None:
+            rv = format_path(rule.regex.sub(rule.replacement, path), rule.target_os)
+        else:
+            rv = format_path(rule.replacement + path[len(rule.prefix):], rule.target_os)
+
+        self.cache[path] = rv
+        return(rv)
+
+    def rewrite_all(self, paths):
+        return([self.rewrite(p) for p in paths])
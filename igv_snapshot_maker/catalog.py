@@ -0,0 +1,202 @@
+"""SQLite catalog of the snapshots of an output directory, with a binned interval index."""
+import os
+import re
+import json
+import sqlite3
+import threading
+
+from .planner import get_window
+from .preflight import reg2bin, reg2bins
+
+CATALOG_NAME = "snapshot_catalog.sqlite"
+
+# the bins of the BAI format cover positions up to 2^29
+MAX_POSITION = (1 << 29) - 1
+
+QUERY_FIELDS = ['group', 'snapshot', 'chr', 'start', 'stop', 'window', 'status', 'png_size', 'render_s', 'png', 'bam_files']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    grp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    chr TEXT,
+    start INTEGER,
+    stop INTEGER,
+    bam_files TEXT,
+    png TEXT,
+    png_size INTEGER,
+    render_s REAL,
+    status TEXT,
+    UNIQUE (grp, name)
+);
+CREATE TABLE IF NOT EXISTS windows (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    contig TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL,
+    bin INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS windows_bin ON windows (contig, bin);
+CREATE INDEX IF NOT EXISTS windows_snapshot ON windows (snapshot_id);
+CREATE INDEX IF NOT EXISTS snapshots_png ON snapshots (png);
+"""
+
+
+def contig_name(chr):
+    """The chromosome name without the chr prefix, so chr8 and 8 are found alike"""
+    return(re.sub('^chr', '', str(chr), flags=re.IGNORECASE))
+
+
+def parse_region(text):
+    """Parse a region, e.g. chr8:33500000-33800000, 8:33,500,000-33,800,000, chr8:33.5-33.8Mb or chr8
+
+    The positions are 1-based and inclusive, with an optional k/kb/M/Mb unit.
+
+    Returns:
+        tuple: (chr, start, stop); start and stop are None for a whole chromosome
+    """
+    m = re.match(r'^([^:\s]+)(?::([\d.,]+)(?:\s*[-–]\s*([\d.,]+))?\s*([kKmM][bB]?)?)?$', text.strip())
+    if m is None:
+        raise ValueError("Not a region: %s" % text)
+    chr, start, stop, unit = m.groups()
+    if start is None:
+        return((chr, None, None))
+    scale = {'k': 1000, 'm': 1000000}.get((unit or " ")[0].lower(), 1)
+    start = int(round(float(start.replace(",", "")) * scale))
+    stop = start if stop is None else int(round(float(stop.replace(",", "")) * scale))
+    if stop < start:
+        raise ValueError("The region ends before it starts: %s" % text)
+    return((chr, start, stop))
+
+
+class Snapshot_Catalog:
+    """The snapshots of an output directory in a SQLite database
+
+    One row per snapshot (and per coalesced snapshot, sharing the PNG file of
+    the snapshot rendered in its place), with the windows shown in IGV: two
+    windows for the split-screen snapshots. The windows are indexed by their
+    BAI bin, as in the UCSC binning scheme, so the snapshots overlapping a
+    region are found by looking up a handful of bins.
+
+    The catalog is kept across runs: the snapshots are replaced by name, and
+    the ones up to date (--resume) keep their row.
+    """
+
+    def __init__(self, output_dir, db_name=None):
+        """Constructor
+
+        Args:
+            output_dir (str): the output directory (or the folder of a shard)
+            db_name (str, optional): the database file. Defaults to snapshot_catalog.sqlite in output_dir.
+        """
+        self.fn = db_name or os.path.join(output_dir, CATALOG_NAME)
+        self.db = sqlite3.connect(self.fn, check_same_thread=False)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def add(self, group_name, sp, windows, bam_files, png_name, status=None):
+        """Add or replace one snapshot
+
+        Args:
+            group_name (str): the group
+            sp (dict): the snapshot (name, chr, start, stop)
+            windows (list): (chr, start, stop) of the windows shown by IGV
+            bam_files (list): the bam files of the group
+            png_name (str): the PNG file showing the snapshot
+            status (str, optional): e.g. planned, rendered or failed. Defaults to None.
+        """
+        with self.lock:
+            self.db.execute("DELETE FROM snapshots WHERE grp = ? AND name = ?", (str(group_name), str(sp['name'])))
+            cur = self.db.execute("INSERT INTO snapshots (grp, name, chr, start, stop, bam_files, png, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (str(group_name), str(sp['name']), str(sp['chr']), sp['start'], sp['stop'], json.dumps(list(bam_files)), png_name, status))
+            rows = []
+            for chr, start, stop in windows:
+                start, stop = max(start, 1), min(max(stop, start), MAX_POSITION)
+                rows.append((cur.lastrowid, contig_name(chr), start, stop, reg2bin(start - 1, stop)))
+            self.db.executemany("INSERT INTO windows (snapshot_id, contig, start, stop, bin) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def add_planned(self, script, snapshot, aliases=(), status='planned'):
+        """Add a planned snapshot of a group, with the snapshots coalesced into it"""
+        png_name = script.png_name(snapshot)
+        for sp in [snapshot] + list(aliases):
+            loci = sp.get('mates') or sp.get('flanks') or [sp]
+            self.add(script.name, sp, [get_window(m, script.maker.ext) for m in loci], script.bam_files, png_name, status=status)
+
+    def add_script(self, script, status='planned'):
+        """Add the snapshots of the master script of a group, with the coalesced ones"""
+        for locus in script.loci:
+            self.add_planned(script, locus.snapshot, locus.aliases, status=status)
+
+    def update_results(self, results):
+        """Record the status, PNG size and render time of the rendered snapshots
+
+        Args:
+            results (list): result dictionaries returned by IGV_Worker_Pool.wait()
+        """
+        rows = [(row['status'], row['png_size'], row['total_s'], row['png']) for r in results for row in r.get('snapshots', [])]
+        with self.lock:
+            self.db.executemany("UPDATE snapshots SET status = ?, png_size = ?, render_s = ? WHERE png = ?", rows)
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def query(self, chr, start=None, stop=None, group_name=None):
+        """The snapshots whose window overlaps a region
+
+        Args:
+            chr (str): the chromosome, with or without the chr prefix
+            start (int, optional): 1-based start of the region. Defaults to the whole chromosome.
+            stop (int, optional): 1-based end of the region. Defaults to start.
+            group_name (str, optional): only the snapshots of this group
+
+        Returns:
+            list: one dictionary per snapshot and overlapping window, with the QUERY_FIELDS
+        """
+        sql = ("SELECT s.grp, s.name, s.chr, s.start, s.stop, w.contig, w.start, w.stop, s.status, s.png_size, s.render_s, s.png, s.bam_files"
+               " FROM windows w JOIN snapshots s ON s.id = w.snapshot_id WHERE w.contig = ?")
+        params = [contig_name(chr)]
+        if start is not None:
+            stop = start if stop is None else stop
+            bins = reg2bins(max(start, 1) - 1, min(max(stop, start), MAX_POSITION))
+            sql += " AND w.bin IN (%s) AND w.start <= ? AND w.stop >= ?" % ",".join(str(b) for b in bins)
+            params.extend([stop, start])
+        if group_name is not None:
+            sql += " AND s.grp = ?"
+            params.append(group_name)
+        sql += " ORDER BY w.start, s.grp, s.name"
+
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        rv = []
+        for g, name, c, s, e, contig, ws, we, status, size, render_s, png, bams in rows:
+            rv.append(dict(zip(QUERY_FIELDS, [g, name, c, s, e, "%s:%d-%d" % (contig, ws, we), status, size, render_s, png, json.loads(bams)])))
+        return(rv)
+
+    def merge(self, other_fn):
+        """Add the snapshots of another catalog, e.g. of a shard, replacing the ones with the same name
+
+        Returns:
+            int: the number of snapshots added
+        """
+        other = sqlite3.connect(other_fn)
+        n = 0
+        try:
+            for row in other.execute("SELECT id, grp, name, chr, start, stop, bam_files, png, png_size, render_s, status FROM snapshots"):
+                windows = other.execute("SELECT contig, start, stop, bin FROM windows WHERE snapshot_id = ?", (row[0],)).fetchall()
+                with self.lock:
+                    self.db.execute("DELETE FROM snapshots WHERE grp = ? AND name = ?", row[1:3])
+                    cur = self.db.execute("INSERT INTO snapshots (grp, name, chr, start, stop, bam_files, png, png_size, render_s, status)"
+                                          " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row[1:])
+                    self.db.executemany("INSERT INTO windows (snapshot_id, contig, start, stop, bin) VALUES (?, ?, ?, ?, ?)",
+                                        [(cur.lastrowid,) + tuple(w) for w in windows])
+                n += 1
+        finally:
+            other.close()
+        return(n)
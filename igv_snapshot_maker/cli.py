@@ -1,13 +1,40 @@
 """Console script for igv_snapshot_maker."""
 import os
 import sys
+import json
+import time
 import logging
 import argparse
 import warnings
 import yaml
+import shlex
+import signal
+import threading
+import atexit
 import pathlib
+from collections import OrderedDict
 
 from igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.runner import IGV_Worker_Pool, write_summary
+from igv_snapshot_maker.report import write_run_report
+from igv_snapshot_maker.catalog import CATALOG_NAME, QUERY_FIELDS, Snapshot_Catalog, parse_region
+from igv_snapshot_maker.memory import Memory_Admission
+from igv_snapshot_maker.genome_cache import DEFAULT_CACHE_DIR, Genome_Cache
+from igv_snapshot_maker.snapshot_cache import DEFAULT_CACHE_SIZE, Snapshot_Cache, detach_png
+from igv_snapshot_maker.postprocess import HAS_PILLOW, PNG_Postprocessor, write_postprocess_report
+from igv_snapshot_maker.igv_port import IGV_Session, IGV_Session_Pool, DEFAULT_PORT
+from igv_snapshot_maker.service import SOCKET_NAME, Snapshot_Service
+from igv_snapshot_maker.adapters import INPUT_FORMATS, iter_input
+from igv_snapshot_maker.manifest import Snapshot_Manifest, snapshot_digest
+from igv_snapshot_maker.igv_snapshot_maker import mkdir_p, MAX_WINDOW, WIDE_POLICIES
+from igv_snapshot_maker.binding import Path_Rewriter
+from igv_snapshot_maker.preflight import BAM_Preflight
+from igv_snapshot_maker.panels import Panel_Join
+from igv_snapshot_maker.optimizer import Script_Optimizer
+from igv_snapshot_maker.batch import Group_Script, Retry_Script, write_batch_file, session_commands
+from igv_snapshot_maker.planner import limit_windows, pair_breakpoints, plan_snapshots, write_snapshot_map
+from igv_snapshot_maker.display import Display_Pool, MAX_SCREEN
+from igv_snapshot_maker.shard import LOG_NAME, SHARD_DIR, Shard_Filter, parse_shard, shard_dir, plan_shards, write_plan, write_job_array, merge_shards
 
 '''
 Ref: https://github.com/stevekm/IGV-snapshot-automator/blob/master/make_IGV_snapshots.py
@@ -42,13 +69,73 @@ IGV_snapshot_maker.py v%s: Genenerate IGV snapshots
 THIS_DIR = os.getcwd()
 default_output_dir = os.path.join(THIS_DIR, "IGV_Snapshots")
 
-def parse_args():
+def add_input_format_args(parser):
+    """The options of the input formats, shared by the subcommands"""
+    parser.add_argument("--input-format", default='yaml', choices=INPUT_FORMATS, dest='input_format', help="Format of the input: yaml, or read the caller output directly: 'mocca' (-i the compare_and_annotate folder of MoCCA-SV, the SVs called by Meerkat), 'mocca-nonmeerkat' (the SVs called by 3 other callers), 'mie' (-i the MIE table), 'bed' or 'vcf'. Defaults to yaml")
+    parser.add_argument("--samples", type=str, required=False, metavar='samples file', help="The tumor/normal input file of MoCCA-SV (mocca), or the trio manifest (mie)")
+    parser.add_argument("--bam-dir", default="", type=str, dest='bam_dir', required=False, metavar='bam folder', help="The folder of the bam files named in the samples file (mocca, mie)")
+    parser.add_argument("--bam", action='append', dest='bam_files', required=False, metavar='bam file', help="A bam file to load for the regions of a BED or VCF input; repeat --bam for several bam files")
+    parser.add_argument("--group-name", type=str, dest='group_name', required=False, metavar='name', help="The group of a BED or VCF input, Defaults to the file name")
+
+
+def check_input_format_args(parser, args):
+    if args.input_format in ('mocca', 'mocca-nonmeerkat', 'mie') and args.samples is None:
+        parser.error("--input-format %s needs --samples" % args.input_format)
+    if args.input_format in ('bed', 'vcf') and not args.bam_files:
+        parser.error("--input-format %s needs at least one --bam" % args.input_format)
+
+
+def input_format_options(args):
+    """The input format options of args, as command-line arguments"""
+    rv = ["--input-format", args.input_format]
+    if args.samples is not None:
+        rv += ["--samples", os.path.abspath(args.samples)]
+    if args.bam_dir:
+        rv += ["--bam-dir", args.bam_dir]
+    for f in args.bam_files or []:
+        rv += ["--bam", f]
+    if args.group_name is not None:
+        rv += ["--group-name", args.group_name]
+    return(rv)
+
+
+def read_groups(args):
+    """The groups of the input, read one at a time"""
+    return(iter_input(args.input, args.input_format, samples=args.samples, bam_dir=args.bam_dir,
+                      bam_files=args.bam_files or [], group_name=args.group_name))
+
+
+def parse_args(argv=None):
     """
-    Pull the command line parameters
+    Pull the command line parameters: the subcommand, render by default, and its options
     """
     
     parser = argparse.ArgumentParser(prog="IGV_snapshot_maker", description=USAGE,
+                                     epilog="The options of the render command can also be given without its name:\n  IGV_snapshot_maker -i input.yaml -o output_dir",
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    add_render_parser(subparsers)
+    add_plan_parser(subparsers)
+    add_merge_parser(subparsers)
+    add_query_parser(subparsers)
+    add_genome_parser(subparsers)
+    add_cache_parser(subparsers)
+    add_serve_parser(subparsers)
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if len(argv) > 0 and argv[0] not in subparsers.choices and argv[0] not in ("-h", "--help"):
+        argv = ["render"] + argv
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("a command is required: %s" % ", ".join(subparsers.choices))
+    if args.check is not None:
+        args.check(subparsers.choices[args.command], args)
+    return(args)
+
+
+def add_render_parser(subparsers):
+    parser = subparsers.add_parser("render", description=USAGE, formatter_class=argparse.RawDescriptionHelpFormatter,
+                                   help="Write the batch scripts of the snapshots and render them with IGV (the default command)")
 
     parser.add_argument("-o", "--output", default=default_output_dir, type=str, required=False, metavar = 'output directory', help="Output directory for snapshots")
                         
@@ -56,24 +143,197 @@ def parse_args():
 
     parser.add_argument("-g", default = 'hg19', type = str, dest = 'genome', metavar = 'genome', help="Name of the reference genome, Defaults to hg19")
 
+    parser.add_argument("--genome-cache", type=str, dest='genome_cache', required=False, metavar='cache directory', help="Load the genome (-g) from this local cache, where it is staged on the first run, rather than from the IGV genome server; see the genome subcommand. Defaults to no cache")
+
+    parser.add_argument("--genome-source", type=str, dest='genome_source', required=False, metavar='JSON/.genome file or URL', help="The genome definition to stage into --genome-cache, Defaults to the definition of -g on the IGV genome server")
+
     # parser.add_argument("-f", default = 'Mac', type = str, dest = 'filesystem', metavar = 'filesystem', help="The target operating system (Mac or Windows) to run IGV, Defaults to Mac.")
 
     parser.add_argument("--igv", default = 'igv', type = str, dest = 'igv_cmd',  help="The command to run IGV (at CCAD)")
 
-    parser.add_argument("-m", "--mem", default = "4000", type = str, dest = 'igv_mem', required=False, metavar = 'IGV memory (MB)', help="Amount of memory to allocate to IGV, in Megabytes (MB)")
+    parser.add_argument("--no-xvfb", action='store_false', dest='xvfb', required=False, help="Run the IGV command directly rather than under xvfb-run, e.g. on a desktop with a display or with a stub IGV for benchmarks")
+
+    parser.add_argument("--xvfb-pool", action='store_true', dest='xvfb_pool', required=False, help="Start one long-lived Xvfb display per IGV worker (-j) rather than running xvfb-run for every group. The screen of each display is sized from the bam files of the group")
+
+    parser.add_argument("-m", "--mem", default = 4000, type = int, dest = 'igv_mem', required=False, metavar = 'IGV memory (MB)', help="Largest amount of memory to allocate to IGV, in Megabytes (MB): the Java heap of each group is sized from its bam files and windows, up to this, Defaults to 4000")
+
+    parser.add_argument("--no-mem-check", action='store_false', dest='mem_check', required=False, help="Start the IGV workers (-j) without waiting for the free memory of the node to fit their Java heap")
+
+    parser.add_argument("-i", "--input", type = str,  required=True, metavar = 'Input file', help="Input file in YAML format, or in the format of --input-format")
 
-    parser.add_argument("-i", "--input", type = str,  required=True, metavar = 'Input file', help="Input file in YAML format")
+    add_input_format_args(parser)
 
     parser.add_argument("-n", "--norun", action='store_true',  required=False, help="Do not run the batch script")
 
-    parser.add_argument('-b', '--binding', nargs=3, metavar=('Target OS[Mac/Win]', 'original_prefix', 'new_prefix'), required=False, help='Replace the original path prefix with new path prefix after binding at the target OS.')
+    parser.add_argument("-j", "--jobs", default=1, type=int, required=False, metavar='N', help="Number of IGV/Xvfb workers to run concurrently, Defaults to 1")
+
+    parser.add_argument("--engine", default='batch', choices=['batch', 'port'], help="How to drive IGV: 'batch' launches 'igv -b' for every group, 'port' keeps persistent IGV instances and sends the commands over the batch port. Defaults to batch")
+
+    parser.add_argument("--timeout", default=None, type=float, required=False, metavar='seconds', help="Kill IGV when a batch script runs longer than this, Defaults to no limit")
+
+    parser.add_argument("--snapshot-timeout", default=None, type=float, dest='snapshot_timeout', required=False, metavar='seconds', help="Kill IGV when no snapshot was written for this long, Defaults to no limit")
+
+    parser.add_argument("--retries", default=2, type=int, required=False, metavar='N', help="Retry the snapshots missing after IGV was killed or crashed up to N times, then quarantine them. Defaults to 2")
+
+    parser.add_argument("--recompress", action='store_true', required=False, help="Recompress the PNG files losslessly while IGV renders the next snapshots")
+
+    parser.add_argument("--webp", action='store_true', required=False, help="Also write a lossless WebP copy of each PNG file (needs Pillow)")
+
+    parser.add_argument("--thumbnails", type=int, default=None, required=False, metavar='width', help="Write a thumbnail of this width for each PNG file, in the thumbnails folder of the group (needs Pillow)")
+
+    parser.add_argument("--contact-sheet", action='store_true', dest='contact_sheet', required=False, help="Write the contact sheet of each group, with all its snapshots, in the thumbnails folder (needs Pillow)")
+
+    parser.add_argument("--post-jobs", type=int, default=None, dest='post_jobs', required=False, metavar='N', help="Number of processes post-processing the PNG files, Defaults to the number of CPUs")
+
+    parser.add_argument("--port", default=DEFAULT_PORT, type=int, dest='igv_port', metavar='port', help="Batch port of the first persistent IGV instance (--engine port), Defaults to %d" % DEFAULT_PORT)
+
+    parser.add_argument("--no-snapshot-scripts", action='store_false', dest='snapshot_scripts', required=False, help="Do not write the batch script of each individual snapshot")
+
+    parser.add_argument("--preflight", choices=BAM_Preflight.MODES, required=False, help="Check the bam files, their indexes and the alignments in each snapshot window before writing the batch scripts: 'report' only writes the preflight reports, 'flag' also drops the missing or unindexed bam files, 'drop' also drops the snapshots without alignments")
+
+    parser.add_argument("--sort-loci", action='store_true', dest='sort_loci', required=False, help="Render the snapshots of each group in genomic order rather than in the input order")
+
+    parser.add_argument("--coalesce", action='store_true', required=False, help="Render once the snapshots whose window is identical to, or contained in, the window of another snapshot (implies --sort-loci)")
+
+    parser.add_argument("--pair-breakpoints", action='store_true', dest='pair_breakpoints', required=False, help="Render the two breakpoints of each SV (<SV>_BP1 and <SV>_BP2, or snapshots naming each other in a mate field) side by side in a single snapshot named after the SV")
+
+    parser.add_argument("--max-window", type=int, dest='max_window', required=False, metavar='bp', help="Visibility limit: the snapshot windows larger than this (e.g. %d, beyond which IGV does not show the alignments) are rendered with --wide-policy, Defaults to no limit" % MAX_WINDOW)
+
+    parser.add_argument("--wide-policy", choices=WIDE_POLICIES, dest='wide_policy', required=False, help="How to render the windows over --max-window: 'split' shows the two ends of the window side by side, 'coverage' the whole window with a cheap track setting (no sort), 'skip' leaves them out. Defaults to coverage")
+
+    parser.add_argument("--snapshot-cache", type=str, dest='snapshot_cache', required=False, metavar='cache directory', help="Link the snapshots already rendered with the same bam files, region and settings, in any output directory, from this cache rather than rendering them again, and add the rendered snapshots to it; see the cache subcommand. Defaults to no cache")
+
+    parser.add_argument("--snapshot-cache-size", type=int, default=DEFAULT_CACHE_SIZE, dest='snapshot_cache_size', required=False, metavar='MB', help="Evict the least recently used snapshots once the snapshot cache is over this size, Defaults to %d" % DEFAULT_CACHE_SIZE)
+
+    parser.add_argument("--panel-shards", type=int, default=1, dest='panel_shards', required=False, metavar='K', help="Split the bam files of each group into K panels rendered in parallel by separate IGV workers (-j) at the same loci, and stitch the panels of each snapshot vertically into one PNG file, Defaults to 1 (no split)")
+
+    parser.add_argument("--optimize-scripts", action='store_true', dest='optimize_scripts', required=False, help="Drop the commands of the batch scripts rendered by IGV which do not change its state: the track setting repeated after every goto (but the sort at the locus), the sort before the first goto, and the repeated regions. The commands removed are counted in script_optimizer.tsv")
+
+    parser.add_argument("--merge-sessions", action='store_true', dest='merge_sessions', required=False, help="Render the groups with identical bam files in a single IGV session (the groups are rendered once the whole input is read)")
+
+    parser.add_argument("-r", "--resume", action='store_true', required=False, help="Only render the snapshots that are missing or out of date in the output directory")
+
+    parser.add_argument('-b', '--binding', nargs=3, action='append', metavar=('Target OS[Mac/Win]', 'original_prefix', 'new_prefix'), required=False, help='Replace the original path prefix with new path prefix after binding at the target OS. Repeat -b for several mount points; the longest matching prefix wins.')
+
+    parser.add_argument('--binding-regex', action='store_true', dest='binding_regex', required=False, help='Match the original prefixes of -b as regular expressions rather than literal prefixes')
 
     # Add new -c to have an additional channel for the IGV setting
     # It should have a lower priority compared to the IGV setting from the command-line arguments.
     parser.add_argument("-c", "--config", type = str,  required=False, metavar = 'config YAML file', help="IGV setting in YAML format")
 
-    args = parser.parse_args()
-    return(args)
+    parser.add_argument("--shard", type=str, required=False, metavar='i/N', help="Only render the groups of shard i out of N (1 <= i <= N), e.g. the task of a job array. The reports and the log go to the shards folder of the output directory")
+
+    parser.add_argument("--shard-plan", type=str, dest='shard_plan', required=False, metavar='plan file', help="The shard_plan.tsv written by the plan subcommand, Defaults to planning the shards again from the input")
+
+    parser.set_defaults(main=render_main, check=check_render_args)
+    return(parser)
+
+
+def check_render_args(parser, args):
+    check_input_format_args(parser, args)
+    if (args.webp or args.thumbnails or args.contact_sheet) and not HAS_PILLOW:
+        parser.error("--webp, --thumbnails and --contact-sheet need Pillow (pip install Pillow)")
+    if args.shard is not None:
+        try:
+            parse_shard(args.shard)
+        except ValueError as exc:
+            parser.error(str(exc))
+
+
+def add_plan_parser(subparsers):
+    parser = subparsers.add_parser("plan", description="Split the groups of the input into N shards of balanced cost, and write the job array manifest",
+                                   epilog="The options after -- are added to the command of every shard, e.g. -- -g hg38 -c IGV_config.yaml",
+                                   help="Split the input into the shards of a job array")
+    parser.add_argument("-i", "--input", type=str, required=True, metavar='Input file', help="Input file in YAML format, or in the format of --input-format")
+    add_input_format_args(parser)
+    parser.add_argument("-o", "--output", default=default_output_dir, type=str, required=False, metavar='output directory', help="Output directory for snapshots")
+    parser.add_argument("-N", "--shards", type=int, required=True, metavar='N', help="Number of shards")
+    parser.add_argument("options", nargs="*", help="Options of the command of each shard")
+    parser.set_defaults(main=plan_main, check=check_input_format_args)
+    return(parser)
+
+
+def add_merge_parser(subparsers):
+    parser = subparsers.add_parser("merge", description="Merge the logs and reports of the shards into the output directory",
+                                   help="Merge the logs and reports of the shards")
+    parser.add_argument("-o", "--output", default=default_output_dir, type=str, required=False, metavar='output directory', help="Output directory for snapshots")
+    parser.set_defaults(main=merge_main, check=None)
+    return(parser)
+
+
+def add_genome_parser(subparsers):
+    parser = subparsers.add_parser("genome", description="Stage the genomes into a local cache, for compute nodes without access to the IGV genome server, and check the cache",
+                                   help="Stage, verify or list the genomes of the genome cache")
+    parser.add_argument("action", choices=['stage', 'verify', 'list'], help="'stage' downloads or copies the genomes into the cache, 'verify' checks the sizes and SHA-256 digests of their files, 'list' prints the cached genomes")
+    parser.add_argument("genomes", nargs="*", metavar='genome', help="Genome IDs, e.g. hg19 hg38. Defaults to all the cached genomes (verify)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR, type=str, required=False, metavar='cache directory', help="The genome cache, Defaults to %s" % DEFAULT_CACHE_DIR)
+    parser.add_argument("--source", type=str, required=False, metavar='JSON/.genome file or URL', help="The genome definition to stage (a single genome), Defaults to the definition of the genome on the IGV genome server")
+    parser.set_defaults(main=genome_main, check=check_genome_args)
+    return(parser)
+
+
+def check_genome_args(parser, args):
+    if args.action == 'stage' and len(args.genomes) == 0:
+        parser.error("stage needs at least one genome")
+    if args.source is not None and len(args.genomes) != 1:
+        parser.error("--source stages a single genome")
+
+
+def add_serve_parser(subparsers):
+    parser = subparsers.add_parser("serve", description="Keep IGV workers running with their bam files loaded, and render the snapshot requests of a spool directory and of a Unix socket until stopped (Ctrl-C or SIGTERM)",
+                                   help="Render the snapshot requests of a spool directory and a Unix socket")
+    parser.add_argument("--spool", type=str, required=True, metavar='spool directory', help="The requests (JSON files) dropped into <spool>/incoming are rendered, and their completion records written to <spool>/done")
+    parser.add_argument("--socket", type=str, dest='socket_name', required=False, metavar='socket file', help="The Unix socket taking one JSON request per line and answering its completion record, Defaults to serve.sock in the spool directory")
+    parser.add_argument("--no-socket", action='store_false', dest='socket', required=False, help="Only take the requests of the spool directory")
+    parser.add_argument("-o", "--output", default=default_output_dir, type=str, required=False, metavar='output directory', help="Output directory for snapshots")
+    parser.add_argument("-e", "--extend", default=100, type=int, required=False, metavar='Extend +/- N bp', help="Extend N (N=100 by default) base pairs in two directions in IGV window")
+    parser.add_argument("-g", default='hg19', type=str, dest='genome', metavar='genome', help="Name of the reference genome, Defaults to hg19")
+    parser.add_argument("--genome-cache", type=str, dest='genome_cache', required=False, metavar='cache directory', help="Load the genome (-g) from this local cache, Defaults to no cache")
+    parser.add_argument("--genome-source", type=str, dest='genome_source', required=False, metavar='JSON/.genome file or URL', help="The genome definition to stage into --genome-cache, Defaults to the IGV genome server")
+    parser.add_argument("-c", "--config", type=str, required=False, metavar='config YAML file', help="IGV setting in YAML format")
+    parser.add_argument("--igv", default='igv', type=str, dest='igv_cmd', help="The command to run IGV")
+    parser.add_argument("--no-xvfb", action='store_false', dest='xvfb', required=False, help="Run IGV directly rather than under xvfb-run")
+    parser.add_argument("-j", "--jobs", default=1, type=int, required=False, metavar='N', help="Number of warm IGV workers, Defaults to 1")
+    parser.add_argument("--port", default=DEFAULT_PORT, type=int, dest='igv_port', metavar='port', help="Batch port of the first IGV worker, Defaults to %d" % DEFAULT_PORT)
+    parser.add_argument("-m", "--mem", default=4000, type=int, dest='igv_mem', required=False, metavar='IGV memory (MB)', help="Java heap of each IGV worker (MB), Defaults to 4000")
+    parser.add_argument("--optimize-scripts", action='store_true', dest='optimize_scripts', required=False, help="Drop the commands of the batch scripts which do not change the state of IGV")
+    parser.add_argument("--poll", default=0.2, type=float, required=False, metavar='seconds', help="Seconds between two scans of the spool directory, Defaults to 0.2")
+    parser.set_defaults(main=serve_main, check=check_serve_args)
+    return(parser)
+
+
+def check_serve_args(parser, args):
+    if args.socket and args.socket_name is None:
+        args.socket_name = os.path.join(os.path.abspath(args.spool), SOCKET_NAME)
+
+
+
+def add_cache_parser(subparsers):
+    parser = subparsers.add_parser("cache", description="Print the size, hits and evictions of the snapshot cache",
+                                   help="Print the statistics of the snapshot cache")
+    parser.add_argument("action", choices=['stats'], help="'stats' prints the statistics of the cache")
+    parser.add_argument("--cache", type=str, required=True, metavar='cache directory', help="The snapshot cache (--snapshot-cache)")
+    parser.add_argument("--max-size", type=int, dest='max_size', required=False, metavar='MB', help="First evict the least recently used snapshots down to this size")
+    parser.set_defaults(main=cache_main, check=None)
+    return(parser)
+
+
+def add_query_parser(subparsers):
+    parser = subparsers.add_parser("query", description="List the snapshots whose window overlaps the regions, from the catalog of the output directory",
+                                   help="List the snapshots overlapping regions")
+    parser.add_argument("regions", nargs="+", metavar='region', help="e.g. chr8:33500000-33800000, chr8:33.5-33.8Mb or chr8")
+    parser.add_argument("-o", "--output", default=default_output_dir, type=str, required=False, metavar='output directory', help="Output directory for snapshots")
+    parser.add_argument("--group", type=str, required=False, help="Only the snapshots of this group")
+    parser.add_argument("--json", action='store_true', required=False, help="Print one JSON record per snapshot rather than a tab-delimited table")
+    parser.set_defaults(main=query_main, check=check_query_args)
+    return(parser)
+
+
+def check_query_args(parser, args):
+    try:
+        args.regions = [parse_region(r) for r in args.regions]
+    except ValueError as exc:
+        parser.error(str(exc))
     
   
 
@@ -97,20 +357,224 @@ def setup_logging(debug=False, filename="my_log.txt", log_format=None):
     old_showwarning = warnings.showwarning
     warnings.showwarning = sendWarningsToLog
 
-def main():
-    """Console script for igv_snapshot_maker."""
-    args = parse_args() 
-    setup_logging(debug=True)
+def with_postprocess(post, group_name, png_files, callback):
+    """Post-process the PNG files of a group while it renders, and call back once they are processed"""
+    if post is None:
+        return(callback)
+    post.watch(group_name, png_files)
+    return(lambda result: post.finish(group_name, on_done=lambda: callback(result)))
+
+
+def with_cache(cache, maker, script, pending, callback):
+    """Add the snapshots of a group to the snapshot cache once they are rendered"""
+    if cache is None:
+        return(callback)
+    entries = [(cache.key(maker, script.bam_files, digest), png_name) for name, digest, png_name in pending]
+
+    def record(result):
+        callback(result)
+        cache.store_group(entries, since=result['started'] - 1)
+    return(record)
+
+
+def build_group_script(maker, group, args, manifest, rewriter, preflight=None, cache=None):
+    """Build the batch script IR of a group
+
+    The snapshots are planned (paired, limited to the visibility window, sorted
+    and coalesced on demand), and with
+    --resume the snapshots which are up to date are left out of the master
+    script, as are the snapshots found in the snapshot cache.
+
+    Returns:
+        tuple: the Group_Script, the plan, (name, digest, png) of the snapshots to render, the snapshots skipped over the visibility limit,
+            and the planned snapshots linked from the snapshot cache
+    """
+    if preflight is not None:
+        group = preflight.check_group(group)
+
+    local_bams = rewriter.rewrite_all(group['bam_files'])
+    script = Group_Script(maker, group['name'], group['bam_files'], group['snapshots'], local_bam_files=local_bams)
+
+    snapshots = script.snapshots
+    if args.pair_breakpoints:
+        snapshots = pair_breakpoints(snapshots)
+    snapshots, skipped = limit_windows(snapshots, maker.ext, max_window=maker.max_window, policy=maker.wide_policy)
+    plan = plan_snapshots(snapshots, maker.ext, sort=args.sort_loci, coalesce=args.coalesce)
+    pending = [] # (name, digest, png) of the snapshots rendered by the master script
+    cached = [] # linked from the snapshot cache
+    for p in plan:
+        sp = p.snapshot
+        digest = snapshot_digest(maker, script.bam_files, sp)
+        png_name = script.png_name(sp)
+        if args.resume and manifest.is_done(script.name, sp['name'], digest, png_name):
+            continue
+        if cache is not None and cache.fetch(cache.key(maker, script.bam_files, digest), png_name):
+            manifest.record(script.name, sp['name'], digest, png_name)
+            cached.append(p)
+            continue
+        detach_png(png_name)
+        # the coalesced regions are still marked in the snapshot
+        script.add_locus(sp, aliases=p.aliases)
+        pending.append((sp['name'], digest, png_name))
+
+    return(script, plan, pending, skipped, cached)
+
+
+def plan_main(args):
+    """Write the shard plan and the job array manifest"""
+    plan_dir = mkdir_p(os.path.join(os.path.abspath(args.output), SHARD_DIR), return_path=True)
+    setup_logging(debug=True, filename=os.path.join(plan_dir, "plan_log.txt"))
+
+    rows = plan_shards(read_groups(args), args.shards)
+    plan_fn = os.path.join(plan_dir, "shard_plan.tsv")
+    write_plan(plan_fn, rows)
+
+    command = "igv_snapshot_maker --shard {shard} --shard-plan %s -i %s -o %s" % (
+        shlex.quote(plan_fn), shlex.quote(os.path.abspath(args.input)), shlex.quote(os.path.abspath(args.output)))
+    if args.input_format != 'yaml':
+        command += " " + " ".join(shlex.quote(o) for o in input_format_options(args))
+    if len(args.options) > 0:
+        command += " " + " ".join(shlex.quote(o) for o in args.options)
+    job_fn = os.path.join(plan_dir, "job_array.tsv")
+    write_job_array(job_fn, rows, args.shards, command)
+
+    costs = [sum(r['cost'] for r in rows if r['shard'] == s) for s in range(1, args.shards + 1)]
+    print("Planned %d groups in %d shards, cost %.0f to %.0f per shard" % (len(rows), args.shards, min(costs), max(costs)))
+    print("Shard plan: %s\nJob array manifest: %s" % (plan_fn, job_fn))
+    return(0)
+
+
+def merge_main(args):
+    """Merge the logs and reports of the shards"""
+    n = merge_shards(args.output)
+    print("Merged %d shards into %s" % (n, args.output))
+    return(0 if n > 0 else 1)
+
+
+def query_main(args):
+    """Print the snapshots overlapping the regions"""
+    catalog_fn = os.path.join(args.output, CATALOG_NAME)
+    if not os.path.isfile(catalog_fn):
+        print("No snapshot catalog in %s" % args.output, file=sys.stderr)
+        return(1)
+    catalog = Snapshot_Catalog(args.output)
+    rows = []
+    for chr, start, stop in args.regions:
+        rows.extend(catalog.query(chr, start, stop, group_name=args.group))
+    catalog.close()
+
+    if args.json:
+        for row in rows:
+            print(json.dumps(row, sort_keys=True))
+    else:
+        print("\t".join(QUERY_FIELDS))
+        for row in rows:
+            print("\t".join("" if row[k] is None else ",".join(row[k]) if k == 'bam_files' else str(row[k]) for k in QUERY_FIELDS))
+    return(0)
+
+
+def genome_main(args):
+    """Stage, verify or list the genomes of the genome cache"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    cache = Genome_Cache(args.cache)
+    if args.action == 'list':
+        for manifest in cache.list():
+            size = sum(rec['size'] for rec in manifest['files'].values())
+            print("%s\t%d files\t%.1f MB\t%s\t%s" % (manifest['genome'], len(manifest['files']), size / 1e6, manifest['staged'], manifest['source']))
+        return(0)
+    if args.action == 'stage':
+        for genome in args.genomes:
+            print("%s\t%s" % (genome, cache.stage(genome, source=args.source)))
+        return(0)
+
+    failed = 0
+    for genome in args.genomes or [m['genome'] for m in cache.list()]:
+        problems = cache.verify(genome)
+        failed += len(problems) > 0
+        print("%s\t%s" % (genome, "OK" if len(problems) == 0 else "; ".join(problems)))
+    return(0 if failed == 0 else 1)
+
+
+def cache_main(args):
+    """Print the statistics of the snapshot cache"""
+    if not os.path.isdir(args.cache):
+        print("No snapshot cache in %s" % args.cache, file=sys.stderr)
+        return(1)
+    cache = Snapshot_Cache(args.cache, max_size=args.max_size)
+    if args.max_size is not None:
+        cache.evict()
+    stats = cache.stats()
+    cache.close()
+    lookups = stats['hits'] + stats['misses']
+    print("Snapshot cache:\t%s" % cache.cache_dir)
+    print("Snapshots:\t%d" % stats['entries'])
+    print("Size:\t%.1f MB" % (stats['size'] / 1e6))
+    print("Hits:\t%d of %d lookups (%.1f%%)" % (stats['hits'], lookups, 100.0 * stats['hits'] / max(lookups, 1)))
+    print("Stored:\t%d" % stats['stored'])
+    print("Evicted:\t%d (%.1f MB)" % (stats['evicted'], stats['evicted_bytes'] / 1e6))
+    if stats['entries'] > 0:
+        print("Last used:\t%s to %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stats['oldest'])),
+                                         time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stats['newest']))))
+    return(0)
+
+
+def serve_main(args):
+    """Serve the snapshot requests until stopped"""
+    mkdir_p(args.spool)
+    setup_logging(debug=True, filename=os.path.join(args.spool, "serve_log.txt"))
+    config = None
+    if args.config is not None:
+        with open(args.config, "r") as config_stream:
+            config = yaml.safe_load(config_stream)
+    maker = IGV_Snapshot_Maker(ext=args.extend, refgenome=args.genome, output_dir=args.output, igv_cmd=args.igv_cmd, config=config)
+    if args.genome_cache is not None:
+        maker.set_genome_file(Genome_Cache(args.genome_cache).ensure(args.genome, source=args.genome_source))
+    if args.optimize_scripts:
+        maker.set_optimizer(Script_Optimizer())
+    mkdir_p(args.output)
+
+    sessions = [IGV_Session(igv_cmd=args.igv_cmd, port=args.igv_port + k, xvfb=args.xvfb, heap=args.igv_mem) for k in range(args.jobs)]
+    service = Snapshot_Service(maker, sessions, args.spool, socket_name=args.socket_name if args.socket else None, poll=args.poll).start()
+    print("Serving %s%s with %d IGV workers, Ctrl-C to stop" % (
+        args.spool, "" if not args.socket else " and %s" % args.socket_name, args.jobs), flush=True)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        while not stop.is_set():
+            stop.wait(1.0)
+    except KeyboardInterrupt:
+        pass
+    service.stop()
+    return(0)
+
+
+def render_main(args):
+    """Write the batch scripts of the input, and render the snapshots"""
+
+    # the reports of a shard are kept apart, until the merge subcommand
+    report_dir = args.output
+    shard = None
+    if args.shard is not None:
+        shard, shards = parse_shard(args.shard)
+        report_dir = shard_dir(args.output, shard, shards)
+    report_dir = mkdir_p(report_dir, return_path=True)
+    setup_logging(debug=True, filename=os.path.join(report_dir, LOG_NAME))
     
     logging.info("Read %s", args.input)
 
-    target_os, orig_prefix, new_prefix=args.binding
+    # the rewritten paths are memoized across the groups
+    rewriter = Path_Rewriter(args.binding or [], regex=args.binding_regex)
 
-    with open(args.input, 'r') as stream:
-        try:
-            dat = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
+    # the groups are parsed one at a time, while the previous ones are rendering
+    dat = read_groups(args)
+    if shard is not None:
+        if args.shard_plan is not None:
+            shard_filter = Shard_Filter.from_plan(shard, shards, args.shard_plan)
+        else:
+            shard_filter = Shard_Filter.from_groups(shard, shards, read_groups(args))
+        dat = shard_filter.filter(dat)
+        logging.info("Render the shard %d/%d" % (shard, shards))
 
     # print("Extension (bp): %d" % args.extend + "\n")
     config = None
@@ -123,49 +587,177 @@ def main():
     
     
     maker = IGV_Snapshot_Maker(ext = args.extend, refgenome=args.genome , output_dir=args.output, igv_cmd=args.igv_cmd, config=config)
-    maker2 = IGV_Snapshot_Maker(ext = args.extend, refgenome=args.genome , output_dir=args.output, igv_cmd=args.igv_cmd, config=config)
-
-    # maker3 is for the curation, to replace maker2 completely
-    maker3 = IGV_Snapshot_Maker(ext = args.extend, refgenome=args.genome , output_dir=args.output, igv_cmd=args.igv_cmd, config=config)
-
-    for i in dat:
-        
-        group_name = i['name']
-        items = i['snapshots']
-        maker.reset_batch() # reset the genome file
 
-        maker.load_bams(i['bam_files'])
-        master_bat_fn = maker.create_batch_file(group_name, group_name)
-
-        maker3.reset_batch() # reset the genome file
-        maker3.load_bams(i['bam_files'], target_os=target_os, orig_prefix=orig_prefix, new_prefix=new_prefix)
-        
-        master_bat_fn3 = maker3.create_batch_file(group_name, group_name+'_ROIs')
-        
-
-        for sp in items: 
-            maker2.reset_batch()
-            maker2.load_bams(i['bam_files'], target_os=target_os, orig_prefix=orig_prefix, new_prefix=new_prefix)
-            
-
-            fn = maker2.create_batch_file(i['name'], sp['name'] )
-
-            maker.goto(sp['name'], sp['chr'], sp['start'], sp['stop'], ext=sp.get('ext'), snapshot=True)
-            maker2.goto(sp['name'], sp['chr'], sp['start'], sp['stop'], ext=sp.get('ext'), snapshot=False)
-
-            maker3.goto(sp['name'], sp['chr'], sp['start'], sp['stop'], ext=sp.get('ext'), ROI_only=True)
-
-            logging.info("Generating the script file %s\n" % fn)
-            maker2.close_batch_file(exit=False)
-
-        # run the master script
-        maker.close_batch_file(exit=True) 
-        maker3.close_batch_file(exit=False)
+    if args.genome_cache is not None:
+        # staged once, under a lock shared with the other runs and shards using the cache
+        maker.set_genome_file(Genome_Cache(args.genome_cache).ensure(args.genome, source=args.genome_source))
+        logging.info("Load the genome %s from %s" % (args.genome, maker.genome_file))
+
+    optimizer = None
+    if args.optimize_scripts:
+        optimizer = Script_Optimizer()
+        maker.set_optimizer(optimizer)
+
+    if args.max_window is not None or args.wide_policy is not None:
+        maker.set_max_window(args.max_window if args.max_window is not None else maker.max_window, policy=args.wide_policy)
+
+    if not args.xvfb:
+        maker.set_xvfb_cmd("%s -b " % args.igv_cmd)
+
+    pool = None
+    sessions = None
+    displays = None
+    post = None
+    if not args.norun:
+        if args.xvfb_pool:
+            displays = Display_Pool(size=args.jobs)
+            # the displays are stopped on exit, also when the run is killed with SIGTERM
+            atexit.register(displays.close)
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+            maker.set_display_pool(displays)
+
+        if args.recompress or args.webp or args.thumbnails or args.contact_sheet:
+            # the worker processes are started before the IGV workers
+            post = PNG_Postprocessor(jobs=args.post_jobs, recompress=args.recompress, webp=args.webp,
+                                     thumbnail_width=args.thumbnails, contact_sheet=args.contact_sheet).start()
+
+        renderer = maker
+        if args.engine == 'port':
+            display_args = {} if displays is None else {'display_pool': displays, 'screen': MAX_SCREEN}
+            # the persistent sessions render groups of any size, so they get the largest heap
+            sessions = IGV_Session_Pool(size=args.jobs, igv_cmd=args.igv_cmd, base_port=args.igv_port, xvfb=args.xvfb,
+                                        heap=args.igv_mem, **display_args)
+            renderer = sessions
+
+        heap_args = {}
+        if args.engine == 'batch':
+            heap_args['max_heap'] = args.igv_mem
+            if args.mem_check and args.jobs > 1:
+                heap_args['admission'] = Memory_Admission()
+
+        # the groups are queued as soon as their master script is written
+        # the PNG files of a group are watched once it starts rendering
+        pool = IGV_Worker_Pool(renderer, jobs=args.jobs, retries=args.retries, timeout=args.timeout, snapshot_timeout=args.snapshot_timeout,
+                               on_start=None if post is None else post.rendering, **heap_args)
+
+    mkdir_p(args.output)
+    manifest = Snapshot_Manifest(report_dir)
+    catalog = Snapshot_Catalog(report_dir)
+    cache = None
+    hits = 0
+    if args.snapshot_cache is not None:
+        cache = Snapshot_Cache(args.snapshot_cache, max_size=args.snapshot_cache_size)
+    preflight = None
+    if args.preflight is not None:
+        preflight = BAM_Preflight(report_dir, mode=args.preflight, default_ext=maker.ext)
+    snapshots = 0
+    skipped = 0
+    policies = {} # PNG file => policy of the windows over the visibility limit
+    skipped_wide = [] # (group, snapshot) left out by the policy
+    shared_bams = OrderedDict() # bam files => the groups loading them, with --merge-sessions
+    joins = [] # the groups rendered in panel shards
+
+    failed = 0
+    try:
+        for i in dat:
+            script, plan, pending, wide_skipped, cached = build_group_script(maker, i, args, manifest, rewriter, preflight=preflight, cache=cache)
+            policies.update(script.policies)
+            skipped_wide.extend((script.name, sp) for sp in wide_skipped)
+            master_bat_fn = script.write(snapshot_scripts=args.snapshot_scripts)
+            catalog.add_script(script)
+            for p in cached:
+                catalog.add_planned(script, p.snapshot, p.aliases, status='cached')
+            if cache is not None:
+                cache.commit()
+                manifest.flush()
+                hits += len(cached)
+            if args.sort_loci or args.coalesce or args.pair_breakpoints:
+                write_snapshot_map(os.path.join(script.dir_name, "snapshot_map.tsv"), plan, maker.fix_name)
+
+            snapshots += len(script.snapshots)
+            skipped += len(plan) - len(pending) - len(cached)
+            if pool is None or len(pending) == 0:
+                continue
+
+            record = lambda result, g=script.name, s=pending: manifest.record_group(g, s, since=result['started'] - 1)
+            # with post-processing, the snapshots are recorded once their PNG files are final
+            record = with_postprocess(post, script.name, script.png_files, with_cache(cache, maker, script, pending, record))
+            if args.panel_shards > 1 and len(script.bam_files) > 1:
+                # each panel is rendered by its own worker, and the panels are stitched once they are all rendered
+                panels = script.panel_scripts(args.panel_shards)
+                join = Panel_Join(script, panels, callback=record)
+                joins.append(join)
+                for panel in panels:
+                    panel_bat_fn = panel.write()
+                    pool.submit("%s.panel%d" % (script.name, panel.index), panel_bat_fn, panel.png_files, callback=join.done,
+                                retry=Retry_Script(panel_bat_fn, [panel]))
+            elif args.merge_sessions:
+                shared_bams.setdefault(script.session_key, []).append((script, record))
+            else:
+                pool.submit(script.name, master_bat_fn, script.png_files, callback=record,
+                            retry=Retry_Script(master_bat_fn, [script]))
+    except yaml.YAMLError as exc:
+        # the groups parsed before the error are still rendered
+        print(exc)
+        logging.error("Failed to parse %s: %s" % (args.input, exc))
+        failed += 1
+
+    logging.info("Generated the batch scripts of %d snapshots" % snapshots)
+    if preflight is not None:
+        preflight.close()
+
+    if len(shared_bams) > 0:
+        session_dir = mkdir_p(os.path.join(os.path.abspath(report_dir), "sessions"), return_path=True)
+        for k, jobs in enumerate(shared_bams.values()):
+            if len(jobs) == 1:
+                script, record = jobs[0]
+                master_bat_fn = script.bat_name(script.name)
+                pool.submit(script.name, master_bat_fn, script.png_files, callback=record,
+                            retry=Retry_Script(master_bat_fn, [script]))
+                continue
+            session_fn = write_batch_file(os.path.join(session_dir, "session_%04d.bat" % (k + 1)), session_commands([j[0] for j in jobs]))
+            pool.submit_session(session_fn, [(j[0].name, j[0].png_files, j[1]) for j in jobs],
+                                retry=Retry_Script(session_fn, [j[0] for j in jobs]))
+        logging.info("Rendering %d groups in %d IGV sessions" % (sum(len(j) for j in shared_bams.values()), len(shared_bams)))
+
+    if args.resume:
+        logging.info("Skipped %d snapshots that are up to date" % skipped)
+    if cache is not None:
+        logging.info("Linked %d snapshots from the snapshot cache %s" % (hits, cache.cache_dir))
+    if len(policies) > 0 or len(skipped_wide) > 0:
+        logging.info("%d snapshots over the visibility limit of %d bp (%s), %d skipped" % (
+            len(policies) + len(skipped_wide), maker.max_window, maker.wide_policy, len(skipped_wide)))
+
+    if pool is not None:
+        results = pool.wait()
+        if post is not None:
+            write_postprocess_report(post.close(), os.path.join(report_dir, "postprocess.tsv"))
+        if sessions is not None:
+            sessions.close()
+        if displays is not None:
+            displays.close()
+        failed += write_summary(results, os.path.join(report_dir, "run_summary.tsv"))
+        # the panels are summarized as IGV runs, and the stitched snapshots are reported with their group
+        results += [join.result for join in joins if join.result is not None]
+        write_run_report(results, report_dir, policies=policies, skipped=skipped_wide)
+        catalog.update_results(results)
+    catalog.close()
+    manifest.close()
+    if cache is not None:
+        cache.close()
+    if optimizer is not None:
+        # after the retry scripts
+        optimizer.write_report(os.path.join(report_dir, "script_optimizer.tsv"))
+
+    if failed > 0:
+        return(1)
+    return(0)
 
-        if not args.norun:
-            maker.call_igv(master_bat_fn)
 
-    return(0)
+def main(argv=None):
+    """Console script for igv_snapshot_maker."""
+    args = parse_args(argv)
+    return(args.main(args))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+"""A pool of long-lived Xvfb displays for the IGV workers."""
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess as sp
+
+X11_SOCKET_DIR = "/tmp/.X11-unix"
+
+# Screen geometry of the IGV window: the data panel is as wide as the screen,
+# and as tall as its tracks (up to maxPanelHeight), below the menus and ruler.
+SCREEN_WIDTH = 3200     # the width of the xvfb-run screen, so the snapshots keep their width
+SCREEN_DEPTH = 24
+WINDOW_CHROME = 400    # menus, toolbar, ruler and the gene track
+TRACK_HEIGHT = 300     # a collapsed alignment track with its coverage track
+SCREEN_STEP = 400      # the heights are rounded up, so the displays are reused
+MAX_PANEL_HEIGHT = 2000
+
+
+def screen_size(bam_files, max_panel_height=MAX_PANEL_HEIGHT, width=SCREEN_WIDTH):
+    """The screen geometry fitting the snapshots of a batch script
+
+    Args:
+        bam_files (int): the number of bam files loaded
+        max_panel_height (int, optional): the maxPanelHeight of the batch script. Defaults to 2000.
+        width (int, optional): the screen width. Defaults to 3200.
+
+    Returns:
+        str: the geometry, e.g. "3200x1200x24"
+    """
+    panel = min(max_panel_height, TRACK_HEIGHT * max(bam_files, 1))
+    height = -(-(panel + WINDOW_CHROME) // SCREEN_STEP) * SCREEN_STEP
+    return("%dx%dx%d" % (width, height, SCREEN_DEPTH))
+
+
+# large enough for any batch script with the default maxPanelHeight
+MAX_SCREEN = screen_size(MAX_PANEL_HEIGHT // TRACK_HEIGHT + 1)
+
+
+def batch_screen_size(bat_name, width=SCREEN_WIDTH):
+    """The screen geometry of a batch script, from the load and maxPanelHeight commands of its header"""
+    bams = 0
+    max_panel_height = MAX_PANEL_HEIGHT
+    with open(bat_name, "r") as bat:
+        for line in bat:
+            words = line.split()
+            if len(words) == 0:
+                continue
+            if words[0] == "load":
+                bams += 1
+            elif words[0] == "maxPanelHeight" and len(words) > 1:
+                max_panel_height = int(words[1])
+            elif words[0] in ("snapshotDirectory", "goto"):
+                break # the end of the header
+    return(screen_size(bams, max_panel_height=max_panel_height, width=width))
+
+
+def _fits(screen, wanted):
+    w1, h1 = [int(x) for x in screen.split("x")[:2]]
+    w2, h2 = [int(x) for x in wanted.split("x")[:2]]
+    return(w1 >= w2 and h1 >= h2)
+
+
+class Xvfb_Display:
+    """One Xvfb server
+
+    Xvfb picks a free display number itself (-displayfd), so several runs on
+    the same node never race for a display.
+    """
+
+    def __init__(self, screen=None, xvfb_cmd="Xvfb", socket_dir=X11_SOCKET_DIR, startup_timeout=30):
+        """Constructor
+
+        Args:
+            screen (str, optional): screen geometry. Defaults to screen_size(1).
+            xvfb_cmd (str, optional): the Xvfb executable. Defaults to "Xvfb".
+            socket_dir (str, optional): folder of the X11 sockets. Defaults to /tmp/.X11-unix.
+            startup_timeout (int, optional): seconds to wait for the display. Defaults to 30.
+        """
+        self.screen = screen or screen_size(1)
+        self.xvfb_cmd = xvfb_cmd
+        self.socket_dir = socket_dir
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.number = None
+
+    @property
+    def name(self):
+        return(":%d" % self.number)
+
+    def env(self):
+        """The environment of a process running on this display"""
+        return(dict(os.environ, DISPLAY=self.name))
+
+    def start(self):
+        rfd, wfd = os.pipe()
+        cmd = [self.xvfb_cmd, "-displayfd", str(wfd), "-screen", "0", self.screen, "-nolisten", "tcp"]
+        try:
+            self.process = sp.Popen(cmd, pass_fds=(wfd,), stdout=sp.DEVNULL, stderr=sp.DEVNULL, start_new_session=True)
+        finally:
+            os.close(wfd)
+
+        with os.fdopen(rfd, "r") as fin:
+            number = fin.readline().strip() # Xvfb writes the display number once it is ready
+        if not number.isdigit():
+            self.stop()
+            raise RuntimeError("Xvfb failed to start: %s" % " ".join(cmd))
+        self.number = int(number)
+
+        deadline = time.time() + self.startup_timeout
+        while not self.is_alive():
+            if time.time() >= deadline or self.process.poll() is not None:
+                self.stop()
+                raise RuntimeError("Xvfb display :%s is not available" % number)
+            time.sleep(0.1)
+        logging.info("Started the Xvfb display %s (%s)" % (self.name, self.screen))
+        return(self)
+
+    def is_alive(self):
+        """Health check: the server runs and listens on its socket"""
+        if self.process is None or self.process.poll() is not None:
+            return(False)
+        return(os.path.exists(os.path.join(self.socket_dir, "X%d" % self.number)))
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except sp.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+        logging.info("Stopped the Xvfb display %s" % (self.name if self.number is not None else "(not started)"))
+        self.process = None
+
+
+class Display_Pool:
+    """A fixed pool of Xvfb displays, started once and shared by the IGV workers
+
+    A worker checks out a display for one batch script with acquire() and
+    gives it back with release(). A display which failed its health check is
+    restarted; when no idle display is large enough for the screen asked
+    for, an idle display is restarted with the larger screen.
+    """
+
+    def __init__(self, size=1, screen=None, xvfb_cmd="Xvfb", socket_dir=X11_SOCKET_DIR):
+        """Constructor
+
+        Args:
+            size (int, optional): the number of displays. Defaults to 1.
+            screen (str, optional): the initial screen geometry. Defaults to screen_size(1).
+            xvfb_cmd (str, optional): the Xvfb executable. Defaults to "Xvfb".
+            socket_dir (str, optional): folder of the X11 sockets. Defaults to /tmp/.X11-unix.
+        """
+        self.displays = [Xvfb_Display(screen=screen, xvfb_cmd=xvfb_cmd, socket_dir=socket_dir) for k in range(size)]
+        self.idle = []
+        self.available = threading.Condition()
+        self.started = False
+
+    def start(self):
+        with self.available:
+            if self.started:
+                return(self)
+            for d in self.displays:
+                d.start()
+                self.idle.append(d)
+            self.started = True
+        return(self)
+
+    def acquire(self, screen=None):
+        """Check out an idle, healthy display at least as large as screen"""
+        self.start()
+        with self.available:
+            while len(self.idle) == 0:
+                self.available.wait()
+            fits = [d for d in self.idle if screen is None or _fits(d.screen, screen)]
+            display = fits[0] if len(fits) > 0 else self.idle[0]
+            self.idle.remove(display)
+
+        try:
+            if screen is not None and not _fits(display.screen, screen):
+                logging.info("Restart the Xvfb display %s with a %s screen" % (display.name, screen))
+                display.stop()
+                display.screen = screen
+                display.start()
+            elif not display.is_alive():
+                logging.warning("The Xvfb display %s failed its health check, restart it" % display.name)
+                display.stop()
+                display.start()
+        except Exception:
+            self.release(display)
+            raise
+        return(display)
+
+    def release(self, display):
+        with self.available:
+            self.idle.append(display)
+            self.available.notify()
+
+    def close(self):
+        with self.available:
+            for d in self.displays:
+                d.stop()
+            self.idle = []
+            self.started = False
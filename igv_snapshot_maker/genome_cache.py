@@ -0,0 +1,262 @@
+"""Local cache of the IGV genomes, for compute nodes without access to the genome server."""
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import posixpath
+from urllib.parse import urljoin, urlparse
+from urllib.request import urlopen
+
+# where IGV hosts the definitions of its genomes, by genome ID
+DEFAULT_GENOME_URL = "https://s3.amazonaws.com/igv.org.genomes/%s/%s.json"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".igv_snapshot_maker", "genomes")
+
+MANIFEST_NAME = "manifest.json"
+
+# the fields of a JSON genome definition (and of its tracks) pointing to a file
+GENOME_FILE_FIELDS = ['fastaURL', 'indexURL', 'compressedIndexURL', 'gziURL', 'twoBitURL', 'twoBitBptURL',
+                      'cytobandURL', 'cytobandBbURL', 'aliasURL', 'chromAliasBbURL', 'chromSizesURL']
+TRACK_FILE_FIELDS = ['url', 'indexURL']
+
+
+class File_Lock:
+    """An flock() on a lock file, shared by the readers and exclusive for the writer
+
+    The lock is held by the open file, so it is released when the process
+    dies, and it works across the processes and the nodes sharing the cache.
+    """
+
+    def __init__(self, lock_name, exclusive=True):
+        self.lock_name = lock_name
+        self.exclusive = exclusive
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = open(self.lock_name, "a")
+        fcntl.flock(self.fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return(self)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.fd.close()
+        self.fd = None
+
+
+def file_sha256(fn, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(fn, "rb") as fin:
+        for block in iter(lambda: fin.read(block_size), b""):
+            h.update(block)
+    return(h.hexdigest())
+
+
+def is_url(path):
+    return(urlparse(path).scheme in ("http", "https", "ftp", "file"))
+
+
+def fetch(source, dest_fn):
+    """Copy a local file, or download a URL, to dest_fn
+
+    Returns:
+        int: the size of the file
+    """
+    if is_url(source):
+        with urlopen(source) as fin, open(dest_fn, "wb") as out:
+            expected = fin.headers.get("Content-Length")
+            shutil.copyfileobj(fin, out, 1 << 20)
+        size = os.path.getsize(dest_fn)
+        if expected is not None and int(expected) != size:
+            raise IOError("Truncated download of %s: %d of %s bytes" % (source, size, expected))
+        return(size)
+    shutil.copyfile(source, dest_fn)
+    return(os.path.getsize(dest_fn))
+
+
+class Genome_Cache:
+    """Genomes staged once into a local folder, with their sequence, aliases and annotations
+
+    Each genome has its folder, <cache>/<genome>, with all the files of the
+    genome and a JSON genome definition pointing to them, or the .genome
+    archive of older IGV versions. manifest.json records the size and the
+    SHA-256 digest of each file, so a truncated or altered cache is found
+    before IGV uses it. A genome is staged in a temporary folder and then
+    renamed, under an exclusive lock; the readers take a shared lock, so the
+    workers and the shards sharing a cache never see a half-staged genome.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        """Constructor
+
+        Args:
+            cache_dir (str, optional): the cache folder. Defaults to ~/.igv_snapshot_maker/genomes.
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def genome_dir(self, genome):
+        return(os.path.join(self.cache_dir, genome))
+
+    def lock(self, genome, exclusive=True):
+        return(File_Lock(os.path.join(self.cache_dir, "%s.lock" % genome), exclusive=exclusive))
+
+    def read_manifest(self, genome):
+        fn = os.path.join(self.genome_dir(genome), MANIFEST_NAME)
+        if not os.path.isfile(fn):
+            return(None)
+        with open(fn, "r") as fin:
+            return(json.load(fin))
+
+    def list(self):
+        """The manifests of the genomes in the cache"""
+        rv = []
+        for genome in sorted(os.listdir(self.cache_dir)):
+            if os.path.isdir(self.genome_dir(genome)) and not genome.startswith("."):
+                manifest = self.read_manifest(genome)
+                if manifest is not None:
+                    rv.append(manifest)
+        return(rv)
+
+    def check(self, genome, full=False):
+        """Check the files of a cached genome against its manifest (without locking)
+
+        Args:
+            genome (str): the genome ID
+            full (bool, optional): also check the SHA-256 digests, not only the sizes. Defaults to False.
+
+        Returns:
+            list: the problems found, empty if the genome is intact
+        """
+        manifest = self.read_manifest(genome)
+        if manifest is None:
+            return(["%s is not in the cache" % genome])
+        problems = []
+        for name, rec in sorted(manifest['files'].items()):
+            fn = os.path.join(self.genome_dir(genome), name)
+            if not os.path.isfile(fn):
+                problems.append("%s is missing" % name)
+            elif os.path.getsize(fn) != rec['size']:
+                problems.append("%s has %d bytes rather than %d" % (name, os.path.getsize(fn), rec['size']))
+            elif full and file_sha256(fn) != rec['sha256']:
+                problems.append("%s does not match its SHA-256 digest" % name)
+        return(problems)
+
+    def verify(self, genome, full=True):
+        with self.lock(genome, exclusive=False):
+            return(self.check(genome, full=full))
+
+    def definition(self, genome):
+        """The genome definition (.json or .genome) of a cached genome"""
+        manifest = self.read_manifest(genome)
+        return(os.path.join(self.genome_dir(genome), manifest['definition']))
+
+    def resolve(self, genome, full=False):
+        """The genome definition of a cached, intact genome, None if it must be staged"""
+        with self.lock(genome, exclusive=False):
+            if len(self.check(genome, full=full)) > 0:
+                return(None)
+            return(self.definition(genome))
+
+    def ensure(self, genome, source=None, full=False):
+        """The genome definition of a genome, staged first if it is not in the cache, or damaged
+
+        Args:
+            genome (str): the genome ID, e.g. hg19
+            source (str, optional): see stage(). Defaults to the IGV genome server.
+            full (bool, optional): check the SHA-256 digests of a cached genome. Defaults to False.
+
+        Returns:
+            str: the local genome definition
+        """
+        rv = self.resolve(genome, full=full)
+        if rv is not None:
+            return(rv)
+        with self.lock(genome, exclusive=True):
+            # another worker may have staged it while this one waited for the lock
+            if len(self.check(genome, full=full)) == 0:
+                return(self.definition(genome))
+            return(self._stage(genome, source))
+
+    def stage(self, genome, source=None):
+        """Stage a genome into the cache, replacing the cached one
+
+        Args:
+            genome (str): the genome ID, e.g. hg19
+            source (str, optional): a JSON genome definition or a .genome archive, local or URL.
+                Defaults to the definition of the genome on the IGV genome server.
+
+        Returns:
+            str: the local genome definition
+        """
+        with self.lock(genome, exclusive=True):
+            return(self._stage(genome, source))
+
+    def _stage(self, genome, source):
+        if source is None:
+            source = DEFAULT_GENOME_URL % (genome, genome)
+        elif not is_url(source):
+            source = os.path.abspath(source)
+        t0 = time.time()
+        logging.info("Stage the genome %s from %s into %s" % (genome, source, self.cache_dir))
+        tmp_dir = os.path.join(self.cache_dir, ".%s.%d" % (genome, os.getpid()))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            files = {}
+
+            def add(location, base):
+                """Fetch one file of the genome, and return its local path"""
+                if not is_url(location) and not os.path.isabs(location):
+                    location = urljoin(base, location) if is_url(base) else os.path.join(os.path.dirname(base), location)
+                name = posixpath.basename(urlparse(location).path) if is_url(location) else os.path.basename(location)
+                while name in files or name in (MANIFEST_NAME, ""):
+                    name = "_" + name
+                fetch(location, os.path.join(tmp_dir, name))
+                files[name] = location
+                return(os.path.join(self.genome_dir(genome), name))
+
+            if source.endswith(".json"):
+                definition_name = "%s.json" % genome
+                definition_fn = os.path.join(tmp_dir, definition_name)
+                fetch(source, definition_fn)
+                files[definition_name] = source
+                with open(definition_fn, "r") as fin:
+                    definition = json.load(fin)
+                if definition.get('fastaURL') and not definition.get('indexURL'):
+                    definition['indexURL'] = definition['fastaURL'] + ".fai" # IGV looks for the index next to the FASTA file
+                for field in GENOME_FILE_FIELDS:
+                    if definition.get(field):
+                        definition[field] = add(definition[field], source)
+                for track in definition.get('tracks', []):
+                    for field in TRACK_FILE_FIELDS:
+                        if track.get(field):
+                            track[field] = add(track[field], source)
+                with open(definition_fn, "w") as out:
+                    json.dump(definition, out, indent=1)
+            else:
+                definition_name = os.path.basename(add(source, source))
+
+            records = {}
+            for name in os.listdir(tmp_dir):
+                fn = os.path.join(tmp_dir, name)
+                records[name] = {'size': os.path.getsize(fn), 'sha256': file_sha256(fn), 'source': files[name]}
+            with open(os.path.join(tmp_dir, MANIFEST_NAME), "w") as out:
+                json.dump({'genome': genome, 'source': source, 'definition': definition_name,
+                           'staged': time.strftime("%Y-%m-%d %H:%M:%S"), 'files': records}, out, indent=1, sort_keys=True)
+
+            # swap the staged genome in place of the old one
+            old_dir = None
+            if os.path.exists(self.genome_dir(genome)):
+                old_dir = tmp_dir + ".old"
+                os.rename(self.genome_dir(genome), old_dir)
+            os.rename(tmp_dir, self.genome_dir(genome))
+            if old_dir is not None:
+                shutil.rmtree(old_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        logging.info("Staged the genome %s: %d files in %.1f s" % (genome, len(records), time.time() - t0))
+        return(self.definition(genome))
@@ -0,0 +1,291 @@
+"""Drive long-lived IGV instances over the batch command port."""
+import os
+import time
+import queue
+import shlex
+import signal
+import socket
+import logging
+import threading
+import subprocess as sp
+
+from .memory import java_env
+
+DEFAULT_PORT = 60151
+
+
+class IGV_Port_Client:
+    """Send batch commands to IGV over its command port
+
+    IGV answers every command with one line ("OK", "echo" or an error message),
+    so the next command is only sent after the reply of the previous one.
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=600):
+        """Constructor
+
+        Args:
+            host (str, optional): host name of IGV. Defaults to "127.0.0.1".
+            port (int, optional): batch command port. Defaults to 60151.
+            timeout (int, optional): seconds to wait for a reply. Defaults to 600.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.stream = None
+
+    def connect(self, wait=0):
+        """Connect to the IGV port
+
+        Args:
+            wait (int, optional): keep retrying for up to `wait` seconds, while IGV is still starting up.
+        """
+        deadline = time.time() + wait
+        while True:
+            try:
+                self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+                break
+            except OSError:
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+        self.stream = self.sock.makefile('rwb')
+
+    def send(self, command):
+        """Send one command and wait for its reply
+
+        Args:
+            command (str): a single IGV batch command
+
+        Returns:
+            str: the reply from IGV
+        """
+        self.stream.write(command.encode('utf-8') + b"\n")
+        self.stream.flush()
+        reply = self.stream.readline()
+        if not reply:
+            raise ConnectionError("IGV closed the connection on: %s" % command)
+        return(reply.decode('utf-8', 'replace').strip())
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def read_batch_commands(bat_name):
+    """Read the commands from an IGV batch script
+
+    Blank lines and comments are dropped, so are the `exit` commands, which
+    would otherwise shut down the persistent IGV instance.
+    """
+    commands = []
+    with open(bat_name, "r") as bat:
+        for line in bat:
+            line = line.strip()
+            if line == "" or line.startswith("#") or line == "exit":
+                continue
+            commands.append(line)
+    return(commands)
+
+
+class IGV_Session:
+    """One persistent IGV instance, started once and reused for many batch scripts"""
+
+    def __init__(self, igv_cmd="igv", port=DEFAULT_PORT, host="127.0.0.1", launch=True,
+                 screen="3200x2400x24", startup_timeout=300, timeout=600, xvfb=True, display_pool=None, heap=None):
+        """Constructor
+
+        Args:
+            igv_cmd (str, optional): the command to run IGV. Defaults to "igv".
+            port (int, optional): batch command port of this instance. Defaults to 60151.
+            host (str, optional): host of the IGV instance. Defaults to "127.0.0.1".
+            launch (bool, optional): start IGV under xvfb-run. Use False to attach to a running IGV.
+            screen (str, optional): Xvfb screen geometry. Defaults to "3200x2400x24".
+            startup_timeout (int, optional): seconds to wait for the port to open. Defaults to 300.
+            timeout (int, optional): seconds to wait for the reply of a command. Defaults to 600.
+            xvfb (bool, optional): run IGV under xvfb-run, rather than on the current display. Defaults to True.
+            display_pool (Display_Pool, optional): run IGV on a display of the pool (with the screen size), rather than under xvfb-run
+            heap (int, optional): the Java heap of IGV in MB, for all the batch scripts of the session. Defaults to the heap of the igv command.
+        """
+        self.igv_cmd = igv_cmd
+        self.xvfb = xvfb
+        self.display_pool = display_pool
+        self.display = None
+        self.heap = heap
+        self.port = port
+        self.launch = launch
+        self.screen = screen
+        self.startup_timeout = startup_timeout
+        self.client = IGV_Port_Client(host=host, port=port, timeout=timeout)
+        self.process = None
+        self.genome = None
+
+    def launch_cmd(self):
+        if not self.xvfb or self.display_pool is not None:
+            return("%s --port %d" % (self.igv_cmd, self.port))
+        return('xvfb-run --auto-servernum --server-args="-screen 0 %s" %s --port %d' % (
+            self.screen, self.igv_cmd, self.port))
+
+    def start(self):
+        """Start IGV (if required) and connect to its port"""
+        if self.launch:
+            cmd = self.launch_cmd()
+            env = None
+            if self.display_pool is not None:
+                # the display is kept for the lifetime of the session
+                self.display = self.display_pool.acquire(self.screen)
+                env = self.display.env()
+                logging.info("Start the IGV session on the display %s" % self.display.name)
+            logging.info("Start the IGV session: %s" % cmd)
+            if self.heap is not None:
+                env = java_env(self.heap, env)
+            self.process = sp.Popen(shlex.split(cmd), stdout=sp.DEVNULL, stderr=sp.DEVNULL, start_new_session=True, env=env)
+
+        self.client.connect(wait=self.startup_timeout)
+        reply = self.client.send("echo")
+        if reply != "echo":
+            raise ConnectionError("Unexpected reply from IGV on port %d: %s" % (self.port, reply))
+        self.genome = None
+
+    def is_alive(self):
+        if self.client.sock is None:
+            return(False)
+        return(self.process is None or self.process.poll() is None)
+
+    def run_batch(self, bat_name, timer=None):
+        """Run the commands of a batch script in this session
+
+        Args:
+            bat_name (str): batch script file name
+            timer (Command_Timer, optional): times each command, from sending it to the reply
+
+        Returns:
+            int: 0 if IGV accepted every command, 1 otherwise
+        """
+        errors = 0
+        for command in read_batch_commands(bat_name):
+            words = command.split()
+            if words[0] == "genome" and len(words) == 2:
+                if words[1] == self.genome:
+                    continue # the genome is still loaded from the previous batch
+                self.genome = None
+
+            if timer is not None:
+                timer.start(command)
+            reply = self.client.send(command)
+            if timer is not None:
+                timer.finish()
+            if reply.upper() != "OK" and reply != "echo":
+                logging.warning("IGV (port %d) replied on '%s': %s" % (self.port, command, reply))
+                errors += 1
+            elif words[0] == "genome" and len(words) == 2:
+                self.genome = words[1]
+
+        return(0 if errors == 0 else 1)
+
+    def kill(self):
+        """Kill a hung IGV (with xvfb-run and Xvfb) and drop the connection
+
+        The pending command then fails in run_batch(), and the session is
+        restarted on its next batch script.
+        """
+        if self.process is not None and self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        if self.client.sock is not None:
+            self.client.sock.shutdown(socket.SHUT_RDWR)
+
+    def stop(self):
+        """Ask IGV to exit and release the port"""
+        if self.client.sock is not None:
+            try:
+                self.client.stream.write(b"exit\n")
+                self.client.stream.flush()
+            except OSError:
+                pass
+        self.client.close()
+
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=30)
+            except sp.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+        if self.display is not None:
+            self.display_pool.release(self.display)
+            self.display = None
+
+
+class IGV_Session_Pool:
+    """A fixed pool of persistent IGV sessions
+
+    The pool provides call_igv(), the same interface as IGV_Snapshot_Maker, so
+    it can be handed to IGV_Worker_Pool. A session is checked out for the
+    whole batch script, and restarted if IGV died while running it.
+    """
+
+    def __init__(self, size=1, igv_cmd="igv", base_port=DEFAULT_PORT, **kwargs):
+        """Constructor
+
+        Args:
+            size (int, optional): number of IGV instances. Defaults to 1.
+            igv_cmd (str, optional): the command to run IGV. Defaults to "igv".
+            base_port (int, optional): the port of the first instance, the others use the next ports.
+            kwargs: passed to IGV_Session
+        """
+        self.sessions = [IGV_Session(igv_cmd=igv_cmd, port=base_port + k, **kwargs) for k in range(size)]
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for s in self.sessions:
+                s.start()
+                self.idle.put(s)
+            self.started = True
+
+    def call_igv(self, bat_name, timer=None, watchdog=None, heap=None):
+        """Run a batch script on the next idle IGV session
+
+        Args:
+            bat_name (str): batch script file name
+            timer (Command_Timer, optional): times each command
+            watchdog (Watchdog, optional): kills the session if it hangs
+            heap (int, optional): not used, the heap of a session is set when it starts
+
+        Returns:
+            int: the status of IGV_Session.run_batch, or 1 if the session died
+        """
+        self.start()
+        session = self.idle.get()
+        try:
+            if not session.is_alive():
+                session.stop()
+                session.start()
+            if watchdog is not None:
+                watchdog.start(session.kill)
+            return(session.run_batch(bat_name, timer=timer))
+        except (OSError, ConnectionError) as exc:
+            logging.error("IGV session on port %d failed on %s: %s" % (session.port, bat_name, exc))
+            session.client.close()
+            return(1)
+        finally:
+            if watchdog is not None:
+                watchdog.stop()
+            self.idle.put(session)
+
+    def close(self):
+        with self.lock:
+            for s in self.sessions:
+                s.stop()
+            self.started = False
@@ -4,6 +4,16 @@ import logging
 from pathlib import Path, PureWindowsPath
 import re
 
+from .display import batch_screen_size
+from .memory import java_env
+
+# IGV does not show the alignments of windows larger than about 300kb
+MAX_WINDOW = 300000
+
+# What to do with a window larger than the visibility limit:
+# split: two views around its ends, coverage: the coverage with cheap track settings, skip: no snapshot
+WIDE_POLICIES = ['split', 'coverage', 'skip']
+
 def update_dir(path, target_os="Mac", orig_prefix=None, new_prefix=None):
     """Update the file path
     
@@ -44,22 +54,69 @@ def update_dir(path, target_os="Mac", orig_prefix=None, new_prefix=None):
     return str(rv)
     
 
-def subprocess_cmd(command):
+def subprocess_cmd(command, on_line=None, watchdog=None, env=None):
     '''
     Runs a terminal command with stdout piping enabled
     https://github.com/stevekm/IGV-snapshot-automator/blob/master/make_IGV_snapshots.py
+
+    The output is logged line by line while the command runs, and each line
+    is also passed to on_line (if given). With a watchdog, the command runs
+    in its own process group, so xvfb-run, Xvfb and IGV are all killed
+    together when the watchdog fires. env is the environment of the command
+    (e.g. the DISPLAY of an Xvfb server), Defaults to the current one.
     '''
     
     logging.info("Command: "+command+"\n")
     import subprocess as sp
     import shlex
+    import signal
 
-    process = sp.run(shlex.split(command),stdout=sp.PIPE, stderr=sp.STDOUT,shell=False)
-    # proc_stdout = process.communicate()[0].decode('ascii')
-
-    logging.info(process.stdout.decode('ascii'))
+    process = sp.Popen(shlex.split(command), stdout=sp.PIPE, stderr=sp.STDOUT, shell=False,
+                       start_new_session=watchdog is not None, env=env)
+    if watchdog is not None:
+        watchdog.start(lambda: os.killpg(process.pid, signal.SIGKILL))
+    try:
+        for raw in iter(process.stdout.readline, b''):
+            line = raw.decode('utf-8', 'replace').rstrip()
+            logging.info(line)
+            if on_line is not None:
+                on_line(line)
+        process.stdout.close()
+        return(process.wait())
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
     
 
+def merge_batch_files(bat_name, group_bat_names):
+    """Merge the master batch scripts of groups sharing the same bam files
+
+    The header (genome, bam loading and track setting) is taken from the first
+    script. The snapshots of every group follow, each starting from its own
+    snapshotDirectory, so the PNG files land in the same folders as if the
+    groups were rendered in separate IGV sessions.
+
+    Args:
+        bat_name (str): the merged batch script file name
+        group_bat_names (list): the master batch scripts of the groups
+
+    Returns:
+        str: the merged batch script file name
+    """
+    with open(bat_name, "w") as out:
+        for k, fn in enumerate(group_bat_names):
+            with open(fn, "r") as bat:
+                lines = bat.readlines()
+
+            pos = [j for j, line in enumerate(lines) if line.startswith("snapshotDirectory ")][0]
+            if k == 0:
+                out.writelines(lines[:pos])
+            out.writelines(line for line in lines[pos:] if line.strip() != "exit")
+        out.write("exit\n")
+
+    return(bat_name)
+
+
 def mkdir_p(path, return_path=False):
     '''
     recursively create a directory and all parent dirs in its path
@@ -116,17 +173,23 @@ class IGV_Snapshot_Maker:
             igv_cmd (str, optional): the command to run IGV. Defaults to "/Users/zhuw10/opt/miniconda3/bin/igv".
         """
         self.track_setting =  "sort base\ncollapse\n"
+        # the windows larger than max_window (None: no limit) are rendered with wide_policy
+        self.max_window = None
+        self.wide_policy = 'coverage'
+        self.wide_track_setting = "collapse\n"
 
         if config is not None:
             # Note config has lower priority here so the only setting passed is track_setting for the time being.
             self.load_config(config);
 
         self.refgenome = refgenome
+        self.genome_file = None # the local definition of refgenome, see set_genome_file()
         self.ext = ext
         self.output_dir = output_dir
-        self.batch = ""
         self.igv_cmd = igv_cmd
         self.xvfb_cmd = 'xvfb-run --auto-servernum --server-args="-screen 0 3200x2400x24" %s -b ' % igv_cmd
+        self.display_pool = None
+        self.optimizer = None # see set_optimizer()
         self.reset_batch()
 
 
@@ -135,12 +198,36 @@ class IGV_Snapshot_Maker:
             setattr(self, i, config[i])
 
     def reset_batch(self):
-        self.batch="""\
-new
-genome %s
-maxPanelHeight 2000
-""" % (self.refgenome)
-        
+        self.batch_lines = self.header_commands()
+        self.png_files = [] # snapshots expected from the current batch file
+
+    @property
+    def batch(self):
+        """The text of the batch script header"""
+        return("\n".join(self.batch_lines) + "\n")
+
+    def header_commands(self, review=False):
+        """The commands starting every batch script
+
+        Args:
+            review (bool, optional): a script for the local review, which loads the genome by its ID
+                rather than from the genome cache of the server. Defaults to False.
+        """
+        genome = self.refgenome if review or self.genome_file is None else self.genome_file
+        return(["new", "genome %s" % genome, "maxPanelHeight 2000"])
+
+    def track_commands(self):
+        """The track setting, as a list of commands"""
+        return(self.track_setting.splitlines())
+
+    def wide_track_commands(self):
+        """The track setting of the coverage-only windows: the alignments are not shown, so they are not sorted"""
+        return(self.wide_track_setting.splitlines())
+
+    def load_commands(self, bam_files):
+        """Commands to load the bam files and apply the track setting"""
+        # track setting has no effect before bam loadings
+        return(["load " + f for f in bam_files] + self.track_commands() + [""])
 
     def load_bams(self, bam_files, target_os=None, orig_prefix=None, new_prefix=None):
         """Add bam files
@@ -151,16 +238,18 @@ maxPanelHeight 2000
             bam_files (list): list of bam file names
 
         """
-        out = ["load " + update_dir(f, target_os=target_os, orig_prefix=orig_prefix, new_prefix=new_prefix) for f in bam_files]
+        out = [update_dir(f, target_os=target_os, orig_prefix=orig_prefix, new_prefix=new_prefix) for f in bam_files]
+        self.batch_lines.extend(self.load_commands(out))
 
-        self.batch += "\n".join(out) + "\n" 
-        self.batch += self.track_setting + "\n" # track setting has no effect before bam loadings
+    def get_snapshot_dir(self, group_name):
+        """The absolute path of the snapshot folder of a group"""
+        return(os.path.abspath(os.path.join(self.output_dir, self.fix_name(group_name))))
 
     def create_batch_file(self, group_name, name): 
-        dir_name = os.path.abspath(os.path.join(self.output_dir, self.fix_name(group_name)) )
+        dir_name = self.get_snapshot_dir(group_name)
         mkdir_p(dir_name)
 
-        # self.dir_name = dir_name
+        self.dir_name = dir_name
 
         bat_name = os.path.join(dir_name, self.fix_name(name) + ".bat" )
         self.bat = open(bat_name, "w")
@@ -178,23 +267,18 @@ maxPanelHeight 2000
     def goto(self, name, chr, start, stop, snapshot=True, ext=None, ROI_only=False):
         
         # add region of interest: region chr4 113282405 113312235 SV1
-
-        chr2=chr
-        x = re.search('^chr', chr)
-        if x is None:
-            chr2='chr'+chr # add prefix chr as region not shown otherwise
-
-        self.bat.write("region %s %s %s %s\n" % (chr2, start, stop, name))
+        self.bat.write(self.get_region(name, chr, start, stop) + "\n")
 
         if ROI_only:
             return
         
         self.bat.write(self.get_goto(chr,start, stop, ext) + "\n")
-        self.bat.write(self.track_setting)
+        self.bat.write("".join(c + "\n" for c in self.track_commands()))
 
         if snapshot:
             png_name = self.fix_name(name) + ".png"
             self.bat.write("snapshot %s\n" % (png_name))
+            self.png_files.append(os.path.join(self.dir_name, png_name))
             
 
     def set_xvfb_cmd(self, xvfb_cmd ):
@@ -207,20 +291,97 @@ maxPanelHeight 2000
         """
         self.xvfb_cmd = xvfb_cmd
 
-    def call_igv(self, bat_name):
+    def set_genome_file(self, genome_file):
+        """Load the genome from a local definition (.json or .genome), e.g. from a Genome_Cache
+
+        The snapshots are still identified by the genome ID (refgenome), and
+        the review scripts still load the genome by its ID.
+
+        Args:
+            genome_file (str): the genome definition, None to load the genome by its ID
+        """
+        self.genome_file = genome_file
+
+    def set_max_window(self, max_window, policy=None):
+        """Set the visibility limit of the snapshot windows
+
+        Args:
+            max_window (int): the largest window (bp) rendered as is, None for no limit
+            policy (str, optional): one of WIDE_POLICIES for the larger windows. Defaults to the current policy.
+        """
+        if policy is None:
+            policy = self.wide_policy
+        if policy not in WIDE_POLICIES:
+            raise ValueError("Unknown policy for the wide windows: %s" % policy)
+        self.max_window = max_window
+        self.wide_policy = policy
+
+    def set_optimizer(self, optimizer):
+        """Optimize the batch scripts rendered by IGV (not the review scripts)
+
+        Args:
+            optimizer (Script_Optimizer): drops the redundant commands, and counts them
+        """
+        self.optimizer = optimizer
+
+    def optimize_commands(self, commands):
+        """The commands of a batch script rendered by IGV, optimized if an optimizer is set"""
+        if self.optimizer is None:
+            return(commands)
+        return(self.optimizer.optimize(commands))
+
+    def set_display_pool(self, display_pool):
+        """Run IGV on the displays of a Display_Pool, rather than under xvfb-run
+
+        Args:
+            display_pool (Display_Pool): the Xvfb displays shared by the IGV workers
+        """
+        self.display_pool = display_pool
+
+    def call_igv(self, bat_name, timer=None, watchdog=None, heap=None):
         """Call IGV
 
         Call IGV using igv -v 
         Args:
             bat_name (str): Batch script file name
+            timer (Command_Timer, optional): collects the commands IGV reports in its output
+            watchdog (Watchdog, optional): kills IGV if it hangs
+            heap (int, optional): the Java heap of IGV in MB. Defaults to the heap of the igv command.
+
+        Returns:
+            int: the exit code of the IGV process
 
         """
 
+        on_line = None if timer is None else timer.on_igv_line
+        if self.display_pool is not None:
+            display = self.display_pool.acquire(batch_screen_size(bat_name))
+            try:
+                print("\nRunning the IGV command on the display %s..." % display.name)
+                env = display.env() if heap is None else java_env(heap, display.env())
+                return(subprocess_cmd("%s -b %s" % (self.igv_cmd, bat_name), on_line=on_line, watchdog=watchdog, env=env))
+            finally:
+                self.display_pool.release(display)
+
         igv_command = self.xvfb_cmd + bat_name
         print("\nRunning the IGV command...")
-        subprocess_cmd(igv_command)
+        return(subprocess_cmd(igv_command, on_line=on_line, watchdog=watchdog, env=None if heap is None else java_env(heap)))
+
+
 
+    def get_region(self, name, chr, start, stop):
+        """ region chr4 113282405 113312235 SV1
+
+        The chr prefix is added to the chromosome name, as the region is not shown otherwise.
+
+        Returns:
+            str: the region command
+        """
+        chr2 = str(chr)
+        if re.search('^chr', chr2) is None:
+            chr2 = 'chr' + chr2
 
+        return("region %s %s %s %s" % (chr2, start, stop, name))
 
     def get_goto(self, chr, start, stop, ext=None): 
         """ goto chr1:35656750-35657150
@@ -243,6 +404,20 @@ maxPanelHeight 2000
         rv = "goto %s:%d-%d" % (chr, start-ext, stop+ext)
         return(rv)
 
+    def get_multi_goto(self, loci):
+        """ goto chr1:104423683-104424184 chr8:33776073-33776574
+
+        IGV splits the window into one panel per locus, e.g. the two breakpoints of a SV.
+
+        Args:
+            loci (list): (chr, start, stop, ext) of each locus; ext may be None
+
+        Returns:
+            str: the goto command with all the loci
+        """
+        rv = [self.get_goto(chr, start, stop, ext)[len("goto "):] for chr, start, stop, ext in loci]
+        return("goto " + " ".join(rv))
+
 
     def fix_name(self, name):
         """Fix name for file or folder
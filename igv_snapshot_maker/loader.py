@@ -0,0 +1,101 @@
+"""Incremental loader for the snapshot YAML input."""
+import re
+import logging
+
+import yaml
+
+# A top-level list item starts at column 0 with "-", but "---" opens a new document
+_ITEM_START = re.compile(r'^-(\s|$)')
+# An anchor (&name) or an alias (*name) token, after a separator
+_ANCHOR_OR_ALIAS = re.compile(r'(?:^|[\s\[{,])[&*][^\s\[\]{},]+', re.M)
+
+
+def get_loader():
+    """The C-accelerated safe loader if libyaml is available, the pure Python one otherwise"""
+    return(getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+class _Item_Loader(yaml.SafeLoader):
+    """The safe loader of one top-level item, sharing its anchors with the other items"""
+
+    def __init__(self, stream, anchors):
+        yaml.SafeLoader.__init__(self, stream)
+        self.anchors = anchors
+
+    def compose_document(self):
+        self.get_event() # document start
+        node = self.compose_node(None, None)
+        self.get_event() # document end
+        # the anchors are kept for the next items
+        return(node)
+
+
+def _load_item(lines, anchors):
+    """Parse the text of one top-level item
+
+    Aliases may refer to anchors defined in earlier items (PyYAML's dumper
+    writes them for shared lists), so the items with anchor or alias tokens
+    are composed by the pure Python loader, which keeps the node of each
+    anchor in `anchors` and resolves the aliases of the next items against
+    them. The other items are parsed by the fast loader.
+    """
+    text = "".join(lines)
+    if _ANCHOR_OR_ALIAS.search(text) is None:
+        return(yaml.load(text, Loader=get_loader()))
+
+    loader = _Item_Loader(text, anchors)
+    try:
+        return(loader.get_single_data())
+    finally:
+        loader.dispose()
+
+
+def iter_groups(stream):
+    """Yield the groups of the YAML input one at a time
+
+    The input is a list of groups at the top level. Instead of parsing the
+    whole document, the text of each top-level item ("-" at column 0) is
+    collected and parsed on its own, so the first group is available as soon
+    as it has been read and only one group is kept in memory at a time.
+    Inputs in another layout (e.g. a flow sequence) fall back to loading the
+    whole document with the fast loader.
+
+    Args:
+        stream (str or file): the input file name or an open file
+
+    Yields:
+        dict: one group, with name, bam_files and snapshots
+    """
+    if isinstance(stream, str):
+        with open(stream, "r") as fin:
+            for group in iter_groups(fin):
+                yield group
+        return
+
+    head = []    # directives, comments and the document start before the first item
+    item = None  # the lines of the current top-level item
+    anchors = {} # the nodes of the anchors of the items parsed
+    for line in stream:
+        if item is None:
+            if _ITEM_START.match(line):
+                item = [line]
+            elif line.startswith("---") or line.startswith("%") or line.lstrip().startswith("#") or line.strip() == "":
+                head.append(line)
+            else:
+                logging.info("The input is not a block list of groups, load the whole document")
+                doc = yaml.load("".join(head) + line + stream.read(), Loader=get_loader())
+                for group in (doc or []):
+                    yield group
+                return
+        elif _ITEM_START.match(line):
+            for group in _load_item(item, anchors):
+                yield group
+            item = [line]
+        elif line.startswith("...") or line.startswith("---"):
+            break # end of the first document
+        else:
+            item.append(line)
+
+    if item is not None:
+        for group in _load_item(item, anchors):
+            yield group
@@ -0,0 +1,152 @@
+"""Checkpoint manifest of the rendered snapshots, to resume interrupted runs."""
+import os
+import json
+import hashlib
+import logging
+import threading
+
+
+MANIFEST_NAME = "snapshot_manifest.jsonl"
+
+
+def snapshot_digest(maker, bam_files, sp):
+    """Digest of everything that goes into the rendering of one snapshot
+
+    Args:
+        maker (IGV_Snapshot_Maker): the maker writing the master batch script
+        bam_files (list): the bam files loaded for the group
+        sp (dict): the snapshot (name, chr, start, stop and the optional ext)
+
+    Returns:
+        str: SHA-1 hex digest
+    """
+    ext = sp.get('ext')
+    if ext is None:
+        ext = maker.ext
+
+    inputs = [list(bam_files), str(sp['chr']), sp['start'], sp['stop'], ext, maker.refgenome, maker.track_setting]
+    if 'mates' in sp:
+        inputs.append([[str(m['chr']), m['start'], m['stop'], m.get('ext', ext)] for m in sp['mates']])
+    if 'policy' in sp:
+        inputs.append(sp['policy'])
+    return(hashlib.sha1(json.dumps(inputs).encode('utf-8')).hexdigest())
+
+
+def read_records(manifest_fn):
+    """The last record of each snapshot of a manifest file, by (group, name)"""
+    records = {}
+    with open(manifest_fn, "r") as fin:
+        for line in fin:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue # a truncated last line from a killed run
+            records[(rec['group'], rec['name'])] = rec
+    return(records)
+
+
+class Snapshot_Manifest:
+    """Record of the snapshots rendered in an output directory
+
+    The manifest is an append-only JSON lines file: one record per rendered
+    snapshot, the last record of a snapshot wins. Appending keeps the manifest
+    valid when a run is killed half-way through a group. The file is kept
+    open for appending until close(), and flushed once per group.
+    """
+
+    def __init__(self, output_dir):
+        """Constructor
+
+        Args:
+            output_dir (str): output directory, where the manifest is stored
+        """
+        self.fn = os.path.join(output_dir, MANIFEST_NAME)
+        self.records = {}
+        self.lock = threading.Lock()
+        self.out = None # the append handle, opened by the first record
+
+        if os.path.isfile(self.fn):
+            self.records = read_records(self.fn)
+            logging.info("Read %d snapshot records from %s" % (len(self.records), self.fn))
+
+    def is_done(self, group_name, name, digest, png_name):
+        """Whether a snapshot is rendered and up to date
+
+        A snapshot is up to date if its inputs have not changed since it was
+        rendered, and its PNG file is still the one recorded in the manifest.
+        """
+        rec = self.records.get((group_name, name))
+        if rec is None or rec['digest'] != digest or rec['png'] != png_name:
+            return(False)
+        try:
+            return(os.path.getsize(png_name) == rec['size'])
+        except OSError:
+            return(False)
+
+    def record(self, group_name, name, digest, png_name):
+        """Append a rendered snapshot to the manifest, written on the next flush()"""
+        rec = {'group': group_name, 'name': name, 'digest': digest,
+               'png': png_name, 'size': os.path.getsize(png_name)}
+        with self.lock:
+            self.records[(group_name, name)] = rec
+            if self.out is None:
+                self.out = open(self.fn, "a")
+            self.out.write(json.dumps(rec, sort_keys=True) + "\n")
+
+    def flush(self):
+        """Write the records appended so far, e.g. at the end of a group"""
+        with self.lock:
+            if self.out is not None:
+                self.out.flush()
+
+    def close(self):
+        with self.lock:
+            if self.out is not None:
+                self.out.close()
+                self.out = None
+
+    def record_group(self, group_name, snapshots, since=0):
+        """Record the snapshots of a group whose PNG files landed
+
+        Args:
+            group_name (str): name of the group
+            snapshots (list): (name, digest, png_name) of the snapshots in the master batch
+            since (float, optional): only record the PNG files modified after this time
+
+        Returns:
+            int: the number of recorded snapshots
+        """
+        n = 0
+        for name, digest, png_name in snapshots:
+            try:
+                if os.path.getmtime(png_name) < since:
+                    continue # left over from a previous run
+            except OSError:
+                continue
+            self.record(group_name, name, digest, png_name)
+            n += 1
+        self.flush()
+        return(n)
+
+    def merge(self, manifest_files):
+        """Merge the records of other manifests (e.g. of the shards), and rewrite the manifest
+
+        The records of the other manifests replace the records of the same
+        snapshots, and the other records of the manifest are kept.
+
+        Returns:
+            int: the number of records merged
+        """
+        self.close()
+        n = 0
+        with self.lock:
+            for fn in manifest_files:
+                records = read_records(fn)
+                self.records.update(records)
+                n += len(records)
+            tmp_name = self.fn + ".tmp"
+            with open(tmp_name, "w") as out:
+                for rec in self.records.values():
+                    out.write(json.dumps(rec, sort_keys=True) + "\n")
+            os.replace(tmp_name, self.fn)
+        return(n)
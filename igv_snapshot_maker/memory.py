@@ -0,0 +1,186 @@
+"""Size the Java heap of IGV for each batch script, and admit the IGV workers by free memory."""
+import os
+import re
+import time
+import logging
+import threading
+
+# Heap estimate, in MB: the IGV baseline, plus each bam track and the alignments it holds for the windows
+HEAP_BASE = 1000
+HEAP_PER_BAM = 150
+HEAP_PER_BAM_MB_WINDOW = 500 # per bam track and per Mb of window
+HEAP_STEP = 256
+MEMINFO = "/proc/meminfo"
+PROC = "/proc"
+
+_LOCUS = re.compile(r'^[^:\s]+:(-?\d+)-(-?\d+)$')
+
+
+def heap_size(bams, window, max_heap=None):
+    """The Java heap (MB) of IGV for a number of bam files and a window width
+
+    Args:
+        bams (int): the number of bam files loaded
+        window (int): the widest window of the snapshots (bp), all the panels of a split screen together
+        max_heap (int, optional): the cap (MB), e.g. --mem. Defaults to None (no cap).
+
+    Returns:
+        int: the heap in MB, rounded up to 256 MB
+    """
+    heap = HEAP_BASE + bams * (HEAP_PER_BAM + HEAP_PER_BAM_MB_WINDOW * window / 1e6)
+    heap = int(-(-heap // HEAP_STEP) * HEAP_STEP)
+    if max_heap is not None:
+        heap = min(heap, int(max_heap))
+    return(heap)
+
+
+def batch_heap_size(bat_name, max_heap=None):
+    """The Java heap (MB) of a batch script, from its load and goto commands
+
+    A session script loads the bam files once for all its groups, so only
+    the loads are counted, not the groups.
+    """
+    bams = 0
+    window = 0
+    with open(bat_name, "r") as bat:
+        for line in bat:
+            words = line.split()
+            if len(words) == 0:
+                continue
+            if words[0] == "load":
+                bams += 1
+            elif words[0] == "goto":
+                width = 0
+                for locus in words[1:]:
+                    m = _LOCUS.match(locus)
+                    if m is not None:
+                        width += int(m.group(2)) - int(m.group(1)) + 1
+                window = max(window, width)
+    return(heap_size(bams, window, max_heap=max_heap))
+
+
+def java_env(heap, env=None):
+    """The environment of an IGV process with a heap of `heap` MB
+
+    The heap is set in _JAVA_OPTIONS, which the JVM reads after the options
+    on its command line, so it also overrides the -Xmx of the igv wrapper
+    scripts.
+
+    Args:
+        heap (int): the heap in MB
+        env (dict, optional): the environment to extend. Defaults to the current one.
+    """
+    env = dict(os.environ if env is None else env)
+    env['_JAVA_OPTIONS'] = ("%s -Xmx%dm" % (env.get('_JAVA_OPTIONS', ""), heap)).strip()
+    return(env)
+
+
+def available_memory(meminfo=MEMINFO):
+    """The memory available to new processes (MB), None if it is not known (e.g. not on Linux)"""
+    try:
+        with open(meminfo, "r") as fin:
+            for line in fin:
+                if line.startswith("MemAvailable:"):
+                    return(int(line.split()[1]) // 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    return(None)
+
+
+def workers_memory(proc=PROC, root=None):
+    """The resident memory (MB) of the Java processes started by a process (the IGV workers), None if it is not known
+
+    Args:
+        proc (str, optional): the proc file system. Defaults to /proc.
+        root (int, optional): the process id. Defaults to the current process.
+    """
+    root = os.getpid() if root is None else root
+    children = {} # pid => the child pids
+    java = {} # pid => resident pages of the Java processes
+    try:
+        pids = [name for name in os.listdir(proc) if name.isdigit()]
+    except OSError:
+        return(None)
+    for pid in pids:
+        try:
+            with open(os.path.join(proc, pid, "stat"), "r") as fin:
+                stat = fin.read()
+            # the command name is in parentheses, and may contain spaces
+            comm = stat[stat.index("(") + 1:stat.rindex(")")]
+            fields = stat[stat.rindex(")") + 2:].split()
+            children.setdefault(int(fields[1]), []).append(int(pid))
+            if comm == "java":
+                java[int(pid)] = int(fields[21])
+        except (OSError, ValueError, IndexError):
+            continue # the process exited
+
+    pages = 0
+    todo = [root]
+    while len(todo) > 0:
+        for pid in children.get(todo.pop(), []):
+            pages += java.get(pid, 0)
+            todo.append(pid)
+    return(pages * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024))
+
+
+class Memory_Admission:
+    """Only start another IGV worker when the node has the memory for its heap
+
+    The heaps of the running workers are reserved, as a JVM grows up to its
+    heap over time while the free memory is measured now; the memory the
+    workers already use is not free anymore, so only the rest of their heaps
+    is reserved. A worker waits until the available memory, less the rest of
+    the reserved heaps, fits its own heap. The first worker is always
+    admitted, so a run never waits forever on a node too small for its
+    largest heap.
+    """
+
+    def __init__(self, available=available_memory, used=workers_memory, reserve=0, poll=1.0):
+        """Constructor
+
+        Args:
+            available (function, optional): returns the available memory (MB) or None. Defaults to available_memory.
+            used (function, optional): returns the memory (MB) used by the running workers or None. Defaults to workers_memory.
+            reserve (int, optional): memory (MB) always left to the rest of the node. Defaults to 0.
+            poll (float, optional): seconds between two checks of the memory. Defaults to 1.0.
+        """
+        self.available = available
+        self.used = used
+        self.reserve = reserve
+        self.poll = poll
+        self.reserved = 0
+        self.running = 0
+        self.lock = threading.Condition()
+
+    def fits(self, heap):
+        if self.running == 0:
+            return(True)
+        free = self.available()
+        if free is None:
+            return(True)
+        used = None if self.used is None else self.used()
+        # the running workers only grow by the part of their heaps they do not use yet
+        growth = self.reserved if used is None else max(self.reserved - used, 0)
+        return(free - growth - self.reserve >= heap)
+
+    def acquire(self, heap):
+        """Wait until a worker with this heap (MB) can start
+
+        Returns:
+            float: the seconds waited
+        """
+        t0 = time.time()
+        with self.lock:
+            if not self.fits(heap):
+                logging.info("Wait for %d MB of free memory to start IGV (%d MB reserved by %d workers)" % (heap, self.reserved, self.running))
+                while not self.fits(heap):
+                    self.lock.wait(self.poll)
+            self.reserved += heap
+            self.running += 1
+        return(time.time() - t0)
+
+    def release(self, heap):
+        with self.lock:
+            self.reserved -= heap
+            self.running -= 1
+            self.lock.notify_all()
@@ -0,0 +1,167 @@
+"""A mock IGV, to test and benchmark igv_snapshot_maker without Java.
+
+It can also be run as a fake IGV executable, either on a batch script like
+`igv -b` or as a batch port server like `igv --port`:
+
+    python -m igv_snapshot_maker.mock_igv -b script.bat
+    python -m igv_snapshot_maker.mock_igv --port 60151
+"""
+import os
+import sys
+import argparse
+import zlib
+import struct
+import logging
+import threading
+import socketserver
+
+
+def write_png(png_name, width=1, height=1):
+    """Write a blank (white) placeholder PNG file
+
+    Args:
+        png_name (str): output file name
+        width (int, optional): image width. Defaults to 1.
+        height (int, optional): image height. Defaults to 1.
+    """
+    def chunk(tag, data):
+        body = tag + data
+        return(struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff))
+
+    raw = (b"\x00" + b"\xff" * (3 * width)) * height # filter byte + RGB pixels per row
+    with open(png_name, "wb") as png:
+        png.write(b"\x89PNG\r\n\x1a\n")
+        png.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        png.write(chunk(b"IDAT", zlib.compress(raw)))
+        png.write(chunk(b"IEND", b""))
+
+
+class Mock_IGV:
+    """The command interpreter of the mock IGV
+
+    Only the commands written by IGV_Snapshot_Maker have side effects: the
+    snapshot directory is tracked and `snapshot` writes a placeholder PNG.
+    Every other command is accepted and recorded.
+    """
+
+    def __init__(self, fail_on=()):
+        """Constructor
+
+        Args:
+            fail_on (list, optional): command names to answer with an error message
+        """
+        self.fail_on = set(fail_on)
+        self.commands = []
+        self.snapshot_dir = os.getcwd()
+        self.lock = threading.Lock()
+
+    def execute(self, command):
+        """Execute one batch command
+
+        Args:
+            command (str): the batch command
+
+        Returns:
+            str: the reply IGV would send back
+        """
+        words = command.split()
+        with self.lock:
+            self.commands.append(command)
+        if not words:
+            return("OK")
+
+        name = words[0]
+        if name in self.fail_on:
+            return("ERROR: mock failure on %s" % name)
+        if name == "echo":
+            return("echo")
+        if name == "snapshotDirectory":
+            self.snapshot_dir = command.split(None, 1)[1]
+        elif name == "snapshot":
+            png_name = words[1] if len(words) > 1 else "snapshot.png"
+            write_png(os.path.join(self.snapshot_dir, png_name))
+        return("OK")
+
+
+class Mock_IGV_Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """A TCP server speaking the IGV batch port protocol
+
+    Use port=0 to bind a free port, which is then available as `self.port`.
+    The server runs in a daemon thread between start() and stop().
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port=0, host="127.0.0.1", fail_on=(), stop_on_exit=False):
+        socketserver.TCPServer.__init__(self, (host, port), _Mock_IGV_Handler)
+        self.igv = Mock_IGV(fail_on=fail_on)
+        self.port = self.server_address[1]
+        self.stop_on_exit = stop_on_exit
+        self.thread = None
+
+    @property
+    def commands(self):
+        return(self.igv.commands)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return(self)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Mock_IGV_Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode('utf-8').strip()
+            if command == "exit":
+                self.server.igv.execute(command)
+                if self.server.stop_on_exit:
+                    threading.Thread(target=self.server.shutdown).start()
+                break
+            reply = self.server.igv.execute(command)
+            logging.debug("Mock IGV: %s -> %s" % (command, reply))
+            self.wfile.write(reply.encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+
+def run_batch(bat_name, igv=None):
+    """Run a batch script like `igv -b`, logging each command as IGV does"""
+    if igv is None:
+        igv = Mock_IGV()
+    with open(bat_name, "r") as bat:
+        for line in bat:
+            command = line.strip()
+            if command == "" or command.startswith("#"):
+                continue
+            print("INFO [BatchRunner] Executing Command: %s" % command, flush=True)
+            if command == "exit":
+                break
+            igv.execute(command)
+    return(0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="mock_igv", description="A fake IGV executable writing placeholder snapshots")
+    parser.add_argument("-b", "--batch", help="Run the batch script and exit")
+    parser.add_argument("-p", "--port", type=int, help="Serve the batch command port until the exit command")
+    args, unknown = parser.parse_known_args(argv) # ignore the other IGV options (e.g. -m 20g)
+
+    if args.batch is not None:
+        return(run_batch(args.batch))
+    if args.port is not None:
+        server = Mock_IGV_Server(port=args.port, stop_on_exit=True)
+        server.serve_forever()
+        server.server_close()
+        return(0)
+    parser.print_help()
+    return(1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""Optimizer pass over the commands of a batch script, dropping the commands that do not change the state of IGV."""
+import csv
+import logging
+import threading
+from collections import Counter
+
+# the commands setting a state of the alignment tracks, by family: a later command of the family replaces the state
+TRACK_STATE = {'collapse': 'mode', 'expand': 'mode', 'squish': 'mode', 'viewaspairs': 'viewaspairs',
+               'group': 'group', 'colorby': 'colorby'}
+# the commands setting a state of the batch session, kept across the loads
+SESSION_STATE = {'snapshotdirectory': 'snapshotdirectory', 'maxpanelheight': 'maxpanelheight',
+                 'setsleepinterval': 'setsleepinterval', 'preference': 'preference'}
+# the commands resetting the state: the session, and the tracks of the session
+RESET_COMMANDS = ['new', 'genome']
+
+OPTIMIZER_FIELDS = ['command', 'kept', 'removed']
+
+
+def state_key(verb, args):
+    """The part of the state a state command sets: its family, and its target for the per-track commands"""
+    family = TRACK_STATE.get(verb) or SESSION_STATE.get(verb)
+    if family == 'mode':
+        return((family,) + tuple(args))
+    if family == 'viewaspairs':
+        return((family,) + tuple(a for a in args if a.lower() not in ('true', 'false')))
+    if family == 'preference':
+        return((family,) + tuple(args[:1]))
+    return((family,))
+
+
+def optimize_commands(commands):
+    """Drop the commands of a batch script that do not change the state of IGV
+
+    The pass follows the state of IGV through the script:
+
+    + the state commands (display mode, viewaspairs, group, colorBy,
+      snapshotDirectory, maxPanelHeight, ...) are only kept where they
+      change the state; the state of the tracks is reset by `load`, as the
+      new tracks start with the default setting, and all the state by `new`
+      and `genome`;
+    + `sort` sorts the alignments at the current locus, so it is kept after
+      every goto to a new locus, but dropped before the first goto and when
+      the same sort was already done at the locus;
+    + a `goto` to the current locus and a `region` already marked are dropped;
+    + the blank lines are dropped, and every other command is kept.
+
+    Args:
+        commands (list): the batch commands, one per line
+
+    Returns:
+        tuple: the commands kept, and a Counter of the commands removed by verb
+    """
+    kept = []
+    removed = Counter()
+    state = {}
+    regions = set()
+    locus = None
+    sorts = set() # the sorts done at the current locus
+
+    for command in commands:
+        words = command.split()
+        if len(words) == 0:
+            continue
+        verb = words[0].lower()
+        args = words[1:]
+        drop = False
+
+        if verb in RESET_COMMANDS:
+            state = {}
+            regions = set()
+            locus = None
+            sorts = set()
+        elif verb == 'load':
+            state = dict((k, v) for k, v in state.items() if k[0] not in TRACK_STATE.values())
+            sorts = set()
+        elif verb == 'goto':
+            if args == locus:
+                drop = True
+            else:
+                locus = args
+                sorts = set()
+        elif verb == 'sort':
+            drop = locus is None or tuple(args) in sorts
+            sorts.add(tuple(args))
+        elif verb == 'region':
+            drop = command in regions
+            regions.add(command)
+        elif verb in TRACK_STATE or verb in SESSION_STATE:
+            key = state_key(verb, args)
+            drop = state.get(key) == command
+            if not drop:
+                if key == ('mode',):
+                    # a display mode without a track name applies to all the tracks
+                    state = dict((k, v) for k, v in state.items() if k[0] != 'mode')
+                elif key[0] == 'mode':
+                    # and a display mode of one track breaks the mode of all the tracks
+                    state.pop(('mode',), None)
+                state[key] = command
+                if verb in TRACK_STATE:
+                    sorts = set() # the alignments are laid out again
+
+        if drop:
+            removed[verb] += 1
+        else:
+            kept.append(command)
+    return((kept, removed))
+
+
+class Script_Optimizer:
+    """Optimize the batch scripts of a run, and count the commands kept and removed
+
+    The counts are shared by the threads writing the batch scripts (e.g. the
+    retry scripts of the IGV workers).
+    """
+
+    def __init__(self):
+        self.kept = Counter()
+        self.removed = Counter()
+        self.scripts = 0
+        self.lock = threading.Lock()
+
+    def optimize(self, commands):
+        """The optimized commands, see optimize_commands()"""
+        rv, removed = optimize_commands(commands)
+        with self.lock:
+            self.scripts += 1
+            self.kept.update(c.split()[0].lower() for c in rv)
+            self.removed.update(removed)
+        return(rv)
+
+    def summary(self):
+        """One line telling how many commands were removed"""
+        total = sum(self.removed.values())
+        return("Removed %d of %d commands from %d batch scripts (%s)" % (
+            total, total + sum(self.kept.values()), self.scripts,
+            ", ".join("%s: %d" % (k, n) for k, n in self.removed.most_common()) or "none"))
+
+    def write_report(self, report_fn):
+        """Write the commands kept and removed by verb as a tab-delimited file"""
+        with open(report_fn, "w", newline="") as out:
+            writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+            writer.writerow(OPTIMIZER_FIELDS)
+            for verb in sorted(set(self.kept) | set(self.removed)):
+                writer.writerow([verb, self.kept[verb], self.removed[verb]])
+        logging.info(self.summary())
@@ -0,0 +1,82 @@
+"""Render the bam files of a large group in panel shards, and stitch the panels into the snapshots of the group."""
+import os
+import time
+import logging
+import threading
+
+from .postprocess import stitch_pngs
+
+
+class Panel_Join:
+    """Wait for the panel shards of a group, then stitch each snapshot from its panels
+
+    Each panel of a group (see Group_Script.panel_scripts) is rendered by its
+    own IGV worker, at every locus of the group. Once the last panel is
+    rendered, the panels of each snapshot are stitched vertically into the
+    PNG file of the group, in the order of the bam files, and the callback
+    of the group is called once, with the result of the group.
+
+    All the panels show the same locus on the same screen width, so their
+    rulers line up, and each panel keeps the labels of its tracks. The
+    header (ruler) and the feature tracks, which are the same in every
+    panel, are only kept in the first panel.
+    """
+
+    def __init__(self, script, panels, callback=None):
+        """Constructor
+
+        Args:
+            script (Group_Script): the group
+            panels (list): the Panel_Script of each panel
+            callback (function, optional): called with the result of the group once its snapshots are stitched
+        """
+        self.script = script
+        self.panels = list(panels)
+        self.callback = callback
+        self.results = []
+        self.result = None # the result of the group, as the results of IGV_Worker_Pool, once stitched
+        self.lock = threading.Lock()
+
+    def done(self, result):
+        """The callback of each panel"""
+        with self.lock:
+            self.results.append(result)
+            if len(self.results) < len(self.panels):
+                return
+        self.stitch()
+
+    def stitch(self):
+        since = min(r['started'] for r in self.results) - 1
+        t0 = time.time()
+        stitched = 0
+        rows = []
+        for locus in self.script.loci:
+            if not locus.take_snapshot:
+                continue
+            png_name = self.script.png_name(locus.snapshot)
+            panel_files = [p.png_name(locus.snapshot) for p in self.panels]
+            row = {'group': self.script.name, 'snapshot': locus.name, 'png': png_name, 'status': 'failed',
+                   'png_size': None, 'total_s': None}
+            try:
+                # the panels left over from a previous run do not count
+                if all(os.path.getmtime(f) >= since for f in panel_files):
+                    stitch_pngs(panel_files, png_name, crop_shared=True)
+                    row.update({'status': 'rendered', 'png_size': os.path.getsize(png_name)})
+                    stitched += 1
+            except (OSError, ValueError) as exc:
+                logging.error("Failed to stitch the panels of %s: %s" % (png_name, exc))
+            rows.append(row)
+        logging.info("Group %s: stitched %d snapshots from %d panels in %.1f s" % (
+            self.script.name, stitched, len(self.panels), time.time() - t0))
+
+        self.result = {
+            'group': self.script.name,
+            'status': 'success' if stitched == len(rows) else 'failed',
+            'started': since + 1,
+            'expected': len(rows),
+            'rendered': stitched,
+            'panels': len(self.panels),
+            'snapshots': rows,
+        }
+        if self.callback is not None:
+            self.callback(self.result)
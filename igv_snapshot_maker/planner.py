@@ -0,0 +1,222 @@
+"""Plan the order of the snapshots rendered in a group."""
+import re
+import logging
+
+
+def chrom_key(chr):
+    """Sort key of a chromosome name
+
+    Numbered chromosomes come first in numeric order, then X, Y and the
+    mitochondrial genome, then the other contigs by name. The "chr" prefix is
+    ignored, so "chr2" and "2" are the same chromosome.
+    """
+    name = re.sub('^chr', '', str(chr), flags=re.IGNORECASE)
+    if name.isdigit():
+        return((0, int(name), ""))
+    special = {'X': 1, 'Y': 2, 'M': 3, 'MT': 3}
+    if name.upper() in special:
+        return((special[name.upper()], 0, ""))
+    return((4, 0, name))
+
+
+def get_window(sp, default_ext):
+    """The extended window shown for a snapshot, as in IGV_Snapshot_Maker.get_goto
+
+    Args:
+        sp (dict): the snapshot (chr, start, stop and the optional ext)
+        default_ext (int): extension used when the snapshot has no ext
+
+    Returns:
+        tuple: (chr, start, stop) of the window
+    """
+    ext = sp.get('ext')
+    if ext is None:
+        ext = default_ext
+    return((str(sp['chr']), sp['start'] - ext, sp['stop'] + ext))
+
+
+BREAKPOINT_PATTERN = re.compile(r'^(.+)_BP([12])$')
+
+
+def pair_breakpoints(snapshots):
+    """Pair the two breakpoints of each SV into one split-screen snapshot
+
+    The breakpoints are paired by an explicit `mate` field, the name of the
+    other breakpoint, or else by their names: <SV>_BP1 and <SV>_BP2. A pair is
+    a snapshot named after the SV (or <BP1>_<BP2> when paired by the mate
+    field), with the window of its first breakpoint and the breakpoints in
+    `mates`; it takes the place of its first breakpoint. The snapshots
+    without a mate are kept as they are.
+
+    Args:
+        snapshots (list): the snapshots of the group, in the input order
+
+    Returns:
+        list: the snapshots and the pairs, in the input order
+    """
+    by_name = dict((sp['name'], sp) for sp in snapshots)
+
+    def mate_of(sp):
+        if sp.get('mate') is not None:
+            return(by_name.get(sp['mate']), None)
+        m = BREAKPOINT_PATTERN.match(sp['name'])
+        if m is None:
+            return(None, None)
+        sv, bp = m.groups()
+        return(by_name.get("%s_BP%s" % (sv, "2" if bp == "1" else "1")), sv)
+
+    rv = []
+    paired = set()
+    for sp in snapshots:
+        if sp['name'] in paired:
+            continue
+        mate, sv = mate_of(sp)
+        # the mate must point back, unless it was paired by name only
+        if mate is None or mate is sp or mate['name'] in paired or mate.get('mate', sp['name']) != sp['name']:
+            rv.append(sp)
+            continue
+        mates = [sp, mate]
+        if sv is not None and BREAKPOINT_PATTERN.match(sp['name']).group(2) == "2":
+            mates.reverse()
+        pair = dict((k, v) for k, v in mates[0].items() if k in ('chr', 'start', 'stop', 'ext'))
+        pair['name'] = sv if sv is not None else "%s_%s" % (sp['name'], mate['name'])
+        pair['mates'] = mates
+        paired.update([sp['name'], mate['name']])
+        rv.append(pair)
+
+    logging.debug("Paired %d breakpoints of %d snapshots" % (len(paired), len(snapshots)))
+    return(rv)
+
+
+def limit_windows(snapshots, default_ext, max_window=None, policy='coverage'):
+    """Apply the visibility limit of IGV to the snapshot windows
+
+    The windows up to max_window are rendered as they are. The policy of the
+    larger windows is recorded in their `policy` field:
+
+    + split: a split-screen snapshot of the two ends of the window, each
+      extended as the snapshot, listed in `flanks`
+    + coverage: the whole window, with the cheap track setting of the maker
+    + skip: no snapshot
+
+    The pairs of breakpoints (see pair_breakpoints) are left as they are.
+
+    Args:
+        snapshots (list): the snapshots of the group
+        default_ext (int): extension used for snapshots without ext
+        max_window (int, optional): the largest window (bp). Defaults to None (no limit).
+        policy (str, optional): split, coverage or skip. Defaults to 'coverage'.
+
+    Returns:
+        tuple: the snapshots to render, and the snapshots skipped
+    """
+    if max_window is None:
+        return((list(snapshots), []))
+
+    rv = []
+    skipped = []
+    for sp in snapshots:
+        chr, start, stop = get_window(sp, default_ext)
+        if 'mates' in sp or stop - start + 1 <= max_window:
+            rv.append(sp)
+            continue
+        wide = dict(sp, policy=policy)
+        if policy == 'skip':
+            skipped.append(wide)
+            continue
+        if policy == 'split':
+            ext = sp.get('ext')
+            wide['flanks'] = [{'chr': sp['chr'], 'start': p, 'stop': p, 'ext': ext} for p in (sp['start'], sp['stop'])]
+        rv.append(wide)
+
+    wide = len(skipped) + sum(1 for sp in rv if 'policy' in sp)
+    if wide > 0:
+        logging.debug("%d windows larger than %d bp: %s" % (wide, max_window, policy))
+    return((rv, skipped))
+
+
+class Planned_Snapshot:
+    """A snapshot to render, with all the input snapshots it stands for"""
+
+    def __init__(self, sp):
+        self.snapshot = sp
+        self.members = [sp]
+
+    @property
+    def aliases(self):
+        """The coalesced snapshots, other than the rendered one"""
+        return(self.members[1:])
+
+
+def plan_snapshots(snapshots, default_ext, sort=True, coalesce=False):
+    """Plan the snapshots of a group
+
+    With sort, the snapshots are ordered by chromosome and window position,
+    so IGV renders neighbouring loci one after the other and can reuse the
+    alignments it has already loaded. With coalesce, a snapshot whose
+    extended window is identical to, or contained in, the window of another
+    snapshot is not rendered on its own, but mapped to the PNG of the
+    containing snapshot. The pairs of breakpoints (see pair_breakpoints) are
+    placed at their first breakpoint, and neither they nor the windows over
+    the visibility limit (see limit_windows) are coalesced.
+
+    Args:
+        snapshots (list): the snapshots of the group, in the input order
+        default_ext (int): extension used for snapshots without ext
+        sort (bool, optional): order by genomic position. Defaults to True.
+        coalesce (bool, optional): merge contained windows (implies sort). Defaults to False.
+
+    Returns:
+        list: Planned_Snapshot objects, in the rendering order
+    """
+    if not (sort or coalesce):
+        return([Planned_Snapshot(sp) for sp in snapshots])
+
+    def key(k):
+        chr, start, stop = get_window(snapshots[k], default_ext)
+        # the widest window first among those starting at the same position; the input order breaks the ties
+        return((chrom_key(chr), start, -stop, k))
+
+    order = sorted(range(len(snapshots)), key=key)
+    if not coalesce:
+        return([Planned_Snapshot(snapshots[k]) for k in order])
+
+    plan = []
+    widest = None # the planned snapshot reaching furthest on the current chromosome
+    for k in order:
+        sp = snapshots[k]
+        chr, start, stop = get_window(sp, default_ext)
+        if 'mates' in sp or 'policy' in sp:
+            # a split-screen or coverage-only snapshot is never merged with another window
+            plan.append(Planned_Snapshot(sp))
+            continue
+        if widest is not None:
+            w_chr, w_start, w_stop = get_window(widest.snapshot, default_ext)
+            # all the planned windows start at or before this one, so only the furthest end matters
+            if chrom_key(w_chr) == chrom_key(chr) and stop <= w_stop:
+                widest.members.append(sp)
+                continue
+
+        p = Planned_Snapshot(sp)
+        plan.append(p)
+        widest = p
+
+    logging.debug("Planned %d of %d snapshots" % (len(plan), len(snapshots)))
+    return(plan)
+
+
+def write_snapshot_map(map_fn, plan, fix_name):
+    """Write which input snapshots map to which rendered PNG file
+
+    Args:
+        map_fn (str): output file name (tab-delimited)
+        plan (list): Planned_Snapshot objects
+        fix_name (function): converts a snapshot name into a file name
+    """
+    with open(map_fn, "w") as out:
+        out.write("snapshot\tpng\n")
+        for p in plan:
+            png_name = fix_name(p.snapshot['name']) + ".png"
+            for sp in p.members:
+                for m in sp.get('mates', [sp]):
+                    out.write("%s\t%s\n" % (m['name'], png_name))
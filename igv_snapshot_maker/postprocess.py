@@ -0,0 +1,535 @@
+"""Post-process the PNG files of the snapshots while IGV is still rendering."""
+import os
+import csv
+import time
+import zlib
+import struct
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:  # Pillow is only needed for the WebP files, the thumbnails and the contact sheets
+    Image = None
+
+HAS_PILLOW = Image is not None
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# the ancillary chunks dropped by the recompression: text and time stamps
+STRIPPED_CHUNKS = [b"tEXt", b"zTXt", b"iTXt", b"tIME"]
+
+THUMBNAIL_DIR = "thumbnails"
+CONTACT_SHEET = "contact_sheet.png"
+CONTACT_SHEET_COLUMNS = 4
+CONTACT_SHEET_WIDTH = 400 # width of a tile, without --thumbnails
+LABEL_HEIGHT = 16
+
+POSTPROCESS_FIELDS = ['group', 'png', 'size', 'recompressed_size', 'webp', 'thumbnail', 'error']
+
+
+def read_chunks(png_name):
+    """The (tag, data) chunks of a PNG file"""
+    with open(png_name, "rb") as fin:
+        content = fin.read()
+    if content[:8] != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file: %s" % png_name)
+    chunks = []
+    pos = 8
+    while pos + 8 <= len(content):
+        length, tag = struct.unpack(">I4s", content[pos:pos + 8])
+        chunks.append((tag, content[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+        if tag == b"IEND":
+            break
+    return(chunks)
+
+
+def write_chunks(png_name, chunks):
+    with open(png_name, "wb") as out:
+        out.write(PNG_SIGNATURE)
+        for tag, data in chunks:
+            out.write(struct.pack(">I", len(data)) + tag + data)
+            out.write(struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+
+def recompress_png(png_name, level=9):
+    """Recompress the image data of a PNG file, losslessly
+
+    The IDAT chunks are joined and compressed again at the given zlib level,
+    and the text and time chunks are dropped. The pixels are not decoded, so
+    no imaging library is needed. The file is only replaced when it gets
+    smaller.
+
+    Args:
+        png_name (str): the PNG file
+        level (int, optional): zlib compression level. Defaults to 9.
+
+    Returns:
+        tuple: the file size before and after
+    """
+    size = os.path.getsize(png_name)
+    chunks = read_chunks(png_name)
+    data = zlib.decompress(b"".join(d for t, d in chunks if t == b"IDAT"))
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9)
+    idat = compressor.compress(data) + compressor.flush()
+
+    rv = []
+    for tag, d in chunks:
+        if tag == b"IDAT":
+            if idat is not None:
+                rv.append((b"IDAT", idat))
+                idat = None # the first IDAT chunk takes all the data
+        elif tag not in STRIPPED_CHUNKS:
+            rv.append((tag, d))
+
+    tmp_name = png_name + ".tmp"
+    write_chunks(tmp_name, rv)
+    new_size = os.path.getsize(tmp_name)
+    if new_size < size:
+        os.replace(tmp_name, png_name)
+        return((size, new_size))
+    os.remove(tmp_name)
+    return((size, size))
+
+
+def first_row_independent(row, bpp):
+    """Filter the first row of an image so it does not depend on the row above it
+
+    The Up, Average and Paeth filters read the row above, which is zero for
+    the first row of an image; once the image is appended below another one,
+    the row above is the last row of that image. With a zero row above, Up is
+    the None filter and Paeth is the Sub filter, and Average is undone.
+    """
+    kind = row[0]
+    if kind == 2:
+        return(b"\x00" + row[1:])
+    if kind == 4:
+        return(b"\x01" + row[1:])
+    if kind == 3:
+        raw = bytearray(row[1:])
+        for i in range(bpp, len(raw)):
+            raw[i] = (raw[i] + (raw[i - bpp] >> 1)) & 0xff
+        return(b"\x00" + bytes(raw))
+    return(row)
+
+
+def unfilter_row(row, prior, bpp):
+    """The bytes of the pixels of a filtered row, given the pixels of the row above"""
+    kind = row[0]
+    raw = bytearray(row[1:])
+    if kind == 0:
+        return(bytes(raw))
+    for i in range(len(raw)):
+        a = raw[i - bpp] if i >= bpp else 0
+        b = prior[i]
+        if kind == 1:
+            raw[i] = (raw[i] + a) & 0xff
+        elif kind == 2:
+            raw[i] = (raw[i] + b) & 0xff
+        elif kind == 3:
+            raw[i] = (raw[i] + ((a + b) >> 1)) & 0xff
+        else:
+            c = prior[i - bpp] if i >= bpp else 0
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            raw[i] = (raw[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xff
+    return(bytes(raw))
+
+
+def shared_rows(ref, rows):
+    """The numbers of rows an image shares with a reference image, at the top and at the bottom
+
+    The filtered rows are compared: the same filtered rows from the top of
+    the images are the same pixels, while at the bottom they are only the
+    same pixels from a row filtered without the row above (None or Sub).
+    Nothing is shared when the shared rows would cover one of the images.
+
+    Args:
+        ref (list): the filtered rows of the reference image
+        rows (list): the filtered rows of the image
+
+    Returns:
+        tuple: the numbers of rows shared at the top and at the bottom
+    """
+    size = min(len(ref), len(rows))
+    top = 0
+    while top < size and rows[top] == ref[top]:
+        top += 1
+    bottom = 0
+    while bottom < size - top and rows[-1 - bottom] == ref[-1 - bottom]:
+        bottom += 1
+    while bottom > 0 and rows[-bottom][0] not in (0, 1):
+        bottom -= 1
+    if top + bottom >= size:
+        return((0, 0))
+    return((top, bottom))
+
+
+def crop_rows(rows, top, bottom, bpp):
+    """The filtered rows of an image without `top` rows on top and `bottom` rows at the bottom
+
+    The first row kept is filtered again without the row above it, which is
+    cropped: its pixels are decoded from the last row above it which does not
+    depend on its own row above.
+    """
+    kept = rows[top:len(rows) - bottom]
+    if top > 0 and kept[0][0] not in (0, 1):
+        start = top - 1
+        while start > 0 and rows[start][0] not in (0, 1):
+            start -= 1
+        prior = bytes(len(rows[0]) - 1)
+        for row in rows[start:top + 1]:
+            prior = unfilter_row(row, prior, bpp)
+        kept[0] = b"\x00" + prior
+    return(kept)
+
+
+def stitch_pngs(png_files, out_name, level=6, crop_shared=False):
+    """Stitch PNG images of the same width vertically, the first one on top
+
+    The filtered rows are joined without decoding the pixels, so no imaging
+    library is needed: only the first row of each image but the first is
+    filtered again (see first_row_independent). The images must share their
+    width, bit depth and color type, as the panels of a snapshot rendered on
+    the same screen do; otherwise, they are stitched with Pillow, if it is
+    installed, on a white background.
+
+    With crop_shared, the rows which the images below the first one share
+    with the first image at the top (the header and the ruler of IGV) and at
+    the bottom (the feature tracks) are cropped, so they are only shown once
+    (see shared_rows). The images stitched with Pillow are not cropped.
+
+    Args:
+        png_files (list): the PNG files, from top to bottom
+        out_name (str): the stitched PNG file, written atomically
+        level (int, optional): zlib compression level. Defaults to 6.
+        crop_shared (bool, optional): crop the rows shared with the first image. Defaults to False.
+
+    Returns:
+        tuple: the width and height of the stitched image
+    """
+    images = []
+    for png_name in png_files:
+        chunks = read_chunks(png_name)
+        ihdr = chunks[0][1]
+        width, height, depth, color, compression, method, interlace = struct.unpack(">IIBBBBB", ihdr)
+        palette = [d for t, d in chunks if t == b"PLTE"]
+        images.append((ihdr, width, height, depth, color, interlace, palette, chunks))
+
+    ihdr, width, height, depth, color, interlace, palette, chunks = images[0]
+    if any(i[1] != width or i[3:7] != (depth, color, interlace, palette) for i in images) or interlace != 0:
+        if not HAS_PILLOW:
+            raise ValueError("Cannot stitch images of different formats or widths without Pillow: %s" % ", ".join(png_files))
+        return(stitch_with_pillow(png_files, out_name))
+
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[color]
+    bpp = max(1, channels * depth // 8)
+    stride = 1 + (width * channels * depth + 7) // 8
+    rows = [] # the filtered rows of each image
+    for image in images:
+        data = zlib.decompress(b"".join(d for t, d in image[7] if t == b"IDAT"))
+        rows.append([data[pos:pos + stride] for pos in range(0, len(data), stride)])
+    if crop_shared:
+        rows[1:] = [crop_rows(r, *shared_rows(rows[0], r), bpp=bpp) for r in rows[1:]]
+
+    compressor = zlib.compressobj(level)
+    idat = []
+    for k, image_rows in enumerate(rows):
+        if k > 0:
+            image_rows = [first_row_independent(image_rows[0], bpp)] + image_rows[1:]
+        idat.append(compressor.compress(b"".join(image_rows)))
+    idat.append(compressor.flush())
+
+    total_height = sum(len(r) for r in rows)
+    out = [(b"IHDR", struct.pack(">II", width, total_height) + ihdr[8:])]
+    out.extend((t, d) for t, d in chunks if t in (b"PLTE", b"tRNS", b"gAMA", b"sRGB", b"pHYs"))
+    out.append((b"IDAT", b"".join(idat)))
+    out.append((b"IEND", b""))
+    tmp_name = out_name + ".tmp"
+    write_chunks(tmp_name, out)
+    os.replace(tmp_name, out_name)
+    return((width, total_height))
+
+
+def stitch_with_pillow(png_files, out_name):
+    tiles = []
+    for fn in png_files:
+        with Image.open(fn) as img:
+            tiles.append(img.convert("RGB"))
+    sheet = Image.new("RGB", (max(t.width for t in tiles), sum(t.height for t in tiles)), "white")
+    y = 0
+    for tile in tiles:
+        sheet.paste(tile, (0, y))
+        y += tile.height
+    tmp_name = out_name + ".tmp"
+    sheet.save(tmp_name, format="PNG")
+    os.replace(tmp_name, out_name)
+    return(sheet.size)
+
+
+def thumbnail_name(png_name):
+    return(os.path.join(os.path.dirname(png_name), THUMBNAIL_DIR, os.path.basename(png_name)))
+
+
+def process_png(png_name, recompress=True, webp=False, thumbnail_width=None):
+    """Post-process one PNG file, in a worker process
+
+    Args:
+        png_name (str): the PNG file
+        recompress (bool, optional): recompress the PNG file. Defaults to True.
+        webp (bool, optional): also write <snapshot>.webp next to the PNG file. Defaults to False.
+        thumbnail_width (int, optional): write a thumbnail of this width in the thumbnails folder. Defaults to None.
+
+    Returns:
+        dict: the POSTPROCESS_FIELDS, but the group
+    """
+    rv = {'png': png_name, 'size': None, 'recompressed_size': None, 'webp': None, 'thumbnail': None, 'error': None}
+    try:
+        rv['size'] = os.path.getsize(png_name)
+        if recompress:
+            rv['size'], rv['recompressed_size'] = recompress_png(png_name)
+        if webp or thumbnail_width:
+            with Image.open(png_name) as img:
+                if webp:
+                    rv['webp'] = os.path.splitext(png_name)[0] + ".webp"
+                    img.save(rv['webp'], "WEBP", lossless=True)
+                if thumbnail_width:
+                    rv['thumbnail'] = thumbnail_name(png_name)
+                    os.makedirs(os.path.dirname(rv['thumbnail']), exist_ok=True)
+                    height = max(1, int(img.height * thumbnail_width / float(img.width)))
+                    img.convert("RGB").resize((thumbnail_width, height), Image.LANCZOS).save(rv['thumbnail'], optimize=True)
+    except Exception as exc:  # a bad PNG file must not stop the other ones
+        rv['error'] = "%s: %s" % (type(exc).__name__, exc)
+    return(rv)
+
+
+def make_contact_sheet(png_files, sheet_name, tile_width=CONTACT_SHEET_WIDTH, columns=CONTACT_SHEET_COLUMNS):
+    """Tile the snapshots of a group into one image, with their names
+
+    The thumbnails are used when they exist, and the PNG files are scaled
+    down otherwise.
+
+    Returns:
+        str: the contact sheet file name, None if no PNG file could be read
+    """
+    tiles = []
+    for png_name in png_files:
+        fn = thumbnail_name(png_name)
+        if not os.path.isfile(fn):
+            fn = png_name
+        try:
+            with Image.open(fn) as img:
+                height = max(1, int(img.height * tile_width / float(img.width)))
+                tiles.append((os.path.splitext(os.path.basename(png_name))[0], img.convert("RGB").resize((tile_width, height), Image.LANCZOS)))
+        except Exception as exc:
+            logging.warning("Leave %s out of the contact sheet: %s" % (png_name, exc))
+    if len(tiles) == 0:
+        return(None)
+
+    rows = [tiles[k:k + columns] for k in range(0, len(tiles), columns)]
+    heights = [max(t.height for n, t in row) + LABEL_HEIGHT for row in rows]
+    sheet = Image.new("RGB", (tile_width * min(columns, len(tiles)), sum(heights)), "white")
+    draw = ImageDraw.Draw(sheet)
+    y = 0
+    for row, height in zip(rows, heights):
+        for k, (name, tile) in enumerate(row):
+            draw.text((k * tile_width + 2, y + 2), name, fill="black")
+            sheet.paste(tile, (k * tile_width, y + LABEL_HEIGHT))
+        y += height
+    os.makedirs(os.path.dirname(sheet_name), exist_ok=True)
+    sheet.save(sheet_name, optimize=True)
+    return(sheet_name)
+
+
+def _noop():
+    return(None)
+
+
+class _Watched_Group:
+    def __init__(self, name, png_files, on_done=None):
+        self.name = name
+        self.png_files = list(png_files)
+        self.started = time.time()
+        self.rendering = False
+        self.written = 0 # the PNG files written, in the order of the batch script
+        self.next = 0 # the first PNG file not submitted yet
+        self.submitted = set()
+        self.futures = []
+        self.sheet = None
+        self.rendered = False
+        self.on_done = on_done
+
+
+class PNG_Postprocessor:
+    """Post-process the snapshots in a process pool, while IGV renders the next ones
+
+    The groups are registered when they are queued (watch), and their PNG
+    files are watched once IGV starts rendering them (rendering): IGV writes
+    them in the order of the batch script, so a PNG file is complete once the
+    next one is written, and each check only looks past the last PNG file
+    written. The PNG files after a missing one, and the last ones, are
+    processed when the group is rendered (finish). Once all the PNG files of a group
+    are processed, the contact sheet of the group is made and the on_done
+    callback of the group is called.
+
+    Only the recompression works without Pillow.
+    """
+
+    def __init__(self, jobs=None, recompress=True, webp=False, thumbnail_width=None, contact_sheet=False, poll=1.0):
+        """Constructor
+
+        Args:
+            jobs (int, optional): number of worker processes. Defaults to the number of CPUs.
+            recompress (bool, optional): recompress the PNG files. Defaults to True.
+            webp (bool, optional): write a WebP copy of each PNG file. Defaults to False.
+            thumbnail_width (int, optional): write thumbnails of this width. Defaults to None (no thumbnails).
+            contact_sheet (bool, optional): write the contact sheet of each group. Defaults to False.
+            poll (float, optional): seconds between two checks of the snapshot folders. Defaults to 1.0.
+        """
+        if (webp or thumbnail_width or contact_sheet) and not HAS_PILLOW:
+            raise RuntimeError("The WebP files, thumbnails and contact sheets need Pillow (pip install Pillow)")
+        self.jobs = jobs or os.cpu_count() or 1
+        self.options = {'recompress': recompress, 'webp': webp, 'thumbnail_width': thumbnail_width}
+        self.contact_sheet = contact_sheet
+        self.poll = poll
+        self.groups = []
+        self.rows = []
+        self.lock = threading.Condition()
+        self.executor = None
+        self.thread = None
+        self.closing = False
+
+    def start(self):
+        """Start the worker processes and the watch
+
+        The worker processes are all forked here, so start() should be
+        called before the IGV worker threads.
+        """
+        self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+        for f in [self.executor.submit(_noop) for k in range(self.jobs)]:
+            f.result()
+        self.thread = threading.Thread(target=self.run, name="png-postprocess")
+        self.thread.daemon = True
+        self.thread.start()
+        return(self)
+
+    def watch(self, group_name, png_files):
+        """Register the PNG files of a group queued for rendering"""
+        with self.lock:
+            self.groups.append(_Watched_Group(group_name, png_files))
+
+    def rendering(self, group_name):
+        """IGV starts rendering the group: watch its PNG files"""
+        with self.lock:
+            for g in self.groups:
+                if g.name == group_name and not g.rendering:
+                    g.rendering = True
+                    g.started = time.time()
+                    break
+
+    def finish(self, group_name, on_done=None):
+        """The group is rendered: process its last PNG files, then call on_done()"""
+        with self.lock:
+            for g in self.groups:
+                if g.name == group_name and not g.rendered:
+                    g.rendered = True
+                    g.on_done = on_done
+                    break
+            else:
+                if on_done is not None:
+                    on_done()
+            self.lock.notify_all()
+
+    def fresh(self, g, png_name):
+        try:
+            return(os.stat(png_name).st_mtime >= g.started - 1)
+        except OSError:
+            return(False)
+
+    def check(self, g):
+        """Submit the PNG files of a group which are complete
+
+        Returns:
+            bool: whether all the work of the group is done
+        """
+        # a PNG file is complete once a later one is written, or the group is rendered
+        if g.rendered:
+            last = len(g.png_files)
+        elif not g.rendering:
+            return(False) # still queued
+        else:
+            while g.written < len(g.png_files) and self.fresh(g, g.png_files[g.written]):
+                g.written += 1
+            last = max(g.written - 1, 0)
+        for k in range(g.next, last):
+            png_name = g.png_files[k]
+            if k < g.written or self.fresh(g, png_name):
+                g.submitted.add(png_name)
+                g.futures.append(self.executor.submit(process_png, png_name, **self.options))
+        g.next = max(g.next, last)
+
+        if not g.rendered or not all(f.done() for f in g.futures):
+            return(False)
+        if self.contact_sheet and g.sheet is None:
+            done = [png_name for png_name in g.png_files if png_name in g.submitted]
+            if len(done) > 0:
+                sheet_name = os.path.join(os.path.dirname(done[0]), THUMBNAIL_DIR, CONTACT_SHEET)
+                g.sheet = self.executor.submit(make_contact_sheet, done, sheet_name, tile_width=self.options['thumbnail_width'] or CONTACT_SHEET_WIDTH)
+                return(False)
+        return(g.sheet is None or g.sheet.done())
+
+    def complete(self, g):
+        for f in g.futures:
+            row = f.result()
+            row['group'] = g.name
+            if row['error'] is not None:
+                logging.warning("Failed to post-process %s: %s" % (row['png'], row['error']))
+            self.rows.append(row)
+        if g.sheet is not None and g.sheet.exception() is not None:
+            logging.warning("Failed to make the contact sheet of %s: %s" % (g.name, g.sheet.exception()))
+        if g.on_done is not None:
+            try:
+                g.on_done()
+            except Exception as exc:
+                logging.error("Failed to process the post-processed group %s: %s" % (g.name, exc))
+
+    def run(self):
+        while True:
+            with self.lock:
+                done = [g for g in self.groups if self.check(g)]
+                for g in done:
+                    self.groups.remove(g)
+                    self.complete(g)
+                if self.closing and len(self.groups) == 0:
+                    self.lock.notify_all()
+                    return
+                self.lock.wait(self.poll)
+
+    def close(self):
+        """Wait for the post-processing of all the groups (all must be finished)
+
+        Returns:
+            list: one dictionary per PNG file, with the POSTPROCESS_FIELDS
+        """
+        with self.lock:
+            self.closing = True
+            for g in self.groups:
+                g.rendered = True
+            self.lock.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        return(self.rows)
+
+
+def write_postprocess_report(rows, report_fn):
+    """Write the post-processing report, one line per PNG file"""
+    with open(report_fn, "w", newline="") as out:
+        writer = csv.DictWriter(out, fieldnames=POSTPROCESS_FIELDS, delimiter="\t")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    saved = sum(r['size'] - r['recompressed_size'] for r in rows if r['recompressed_size'] is not None)
+    logging.info("Post-processed %d PNG files (%d bytes saved): %s" % (len(rows), saved, report_fn))
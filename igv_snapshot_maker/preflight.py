@@ -0,0 +1,357 @@
+"""Check the bam files and their indexes before launching IGV."""
+import os
+import gzip
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .planner import get_window
+
+# The pseudo-bin of the BAI format holding the number of mapped/unmapped reads
+PSEUDO_BIN = 37450
+# The 16 kb leaf bins, which are also the windows of the linear index
+LEAF_SHIFT = 14
+LEAF_OFFSET = 4681
+
+
+def reg2bins(beg, end):
+    """The BAI bins overlapping the 0-based region [beg, end)
+
+    See section 5.3 of the SAM specification.
+    """
+    end -= 1
+    bins = [0]
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+    return(bins)
+
+
+def reg2bin(beg, end):
+    """The smallest BAI bin containing the 0-based region [beg, end)
+
+    See section 5.3 of the SAM specification.
+    """
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return(offset + (beg >> shift))
+    return(0)
+
+
+def read_bam_references(bam_name):
+    """The reference sequence names in the header of a bam file
+
+    Args:
+        bam_name (str): bam file name
+
+    Returns:
+        list: the reference names, in the order of the reference ids
+    """
+    with gzip.open(bam_name, "rb") as bam:
+        if bam.read(4) != b"BAM\1":
+            raise ValueError("Not a bam file: %s" % bam_name)
+        l_text, = struct.unpack("<i", bam.read(4))
+        bam.read(l_text)
+        n_ref, = struct.unpack("<i", bam.read(4))
+        names = []
+        for k in range(n_ref):
+            l_name, = struct.unpack("<i", bam.read(4))
+            names.append(bam.read(l_name).rstrip(b"\0").decode('ascii'))
+            bam.read(4) # l_ref
+    return(names)
+
+
+class Reference_Index:
+    """The index of the alignments of one reference, from a BAI file
+
+    Only what is needed to tell whether a region may have alignments is kept:
+    the bins with at least one chunk, the linear index, and the number of
+    mapped reads from the pseudo-bin when it is present.
+    """
+
+    def __init__(self, bins, mapped=None, linear=()):
+        """Constructor
+
+        Args:
+            bins (set): the bins with at least one chunk
+            mapped (int, optional): the number of mapped reads. Defaults to None (unknown).
+            linear (tuple, optional): the offset of the first alignment overlapping each 16 kb window. Defaults to () (no linear index).
+        """
+        self.bins = bins
+        self.mapped = mapped
+        self.linear = linear
+        # the first window known to have alignments: from its leaf bin, or from a new offset in the linear index
+        leaves = [b - LEAF_OFFSET for b in bins if LEAF_OFFSET <= b < PSEUDO_BIN]
+        changes = [w for w in range(1, len(linear)) if linear[w] != linear[w - 1]]
+        self.first = min(leaves + changes[:1]) if len(leaves) + len(changes) > 0 else None
+
+    def window_has_reads(self, w):
+        """Whether the 16 kb window w may have alignments, from its leaf bin and the linear index
+
+        The linear index holds the offset of the first alignment overlapping
+        each window, and the windows without alignments repeat the offset of
+        the window before them: after the first window with alignments, a
+        window has alignments if its leaf bin has chunks or its offset is a
+        new one. The alignments starting in the window before and crossing
+        into the window are missed.
+
+        Returns:
+            bool: None if the linear index cannot tell, before the first window with alignments
+        """
+        if w >= len(self.linear):
+            return(False) # after the last alignment of the reference
+        if LEAF_OFFSET + w in self.bins:
+            return(True)
+        if self.first is None or w < self.first:
+            return(None)
+        return(w == self.first or self.linear[w] != self.linear[w - 1])
+
+    def has_reads(self, beg, end):
+        """Whether the 0-based region [beg, end) may have alignments
+
+        The 16 kb windows of the region are checked with the leaf bins and the
+        linear index (see window_has_reads). Without a linear index, and where
+        it cannot tell, the estimate falls back on all the bins overlapping
+        the region: the region is only empty if none of them has a chunk.
+        """
+        if self.mapped == 0 or len(self.bins) == 0:
+            return(False)
+        if len(self.linear) > 0:
+            found = [self.window_has_reads(w) for w in range((beg >> LEAF_SHIFT), ((end - 1) >> LEAF_SHIFT) + 1)]
+            if any(found):
+                return(True)
+            if None not in found:
+                return(False)
+        return(any(b in self.bins for b in reg2bins(beg, end)))
+
+
+def read_bai(bai_name):
+    """Read the bin and linear indexes of a BAI file
+
+    Args:
+        bai_name (str): BAI file name
+
+    Returns:
+        list: the Reference_Index of each reference
+    """
+    with open(bai_name, "rb") as bai:
+        data = bai.read()
+
+    if data[:4] != b"BAI\1":
+        raise ValueError("Not a BAI file: %s" % bai_name)
+
+    refs = []
+    n_ref, = struct.unpack_from("<i", data, 4)
+    pos = 8
+    for r in range(n_ref):
+        n_bin, = struct.unpack_from("<i", data, pos)
+        pos += 4
+        bins = set()
+        mapped = None
+        for b in range(n_bin):
+            bin, n_chunk = struct.unpack_from("<Ii", data, pos)
+            pos += 8
+            if bin == PSEUDO_BIN:
+                mapped, = struct.unpack_from("<Q", data, pos + 16)
+            elif n_chunk > 0:
+                bins.add(bin)
+            pos += 16 * n_chunk
+        n_intv, = struct.unpack_from("<i", data, pos)
+        linear = struct.unpack_from("<%dQ" % n_intv, data, pos + 4)
+        pos += 4 + 8 * n_intv
+        refs.append(Reference_Index(bins, mapped=mapped, linear=linear))
+    return(refs)
+
+
+def find_index(bam_name):
+    """The index of a bam file (x.bam.bai or x.bai), or None"""
+    for fn in (bam_name + ".bai", os.path.splitext(bam_name)[0] + ".bai"):
+        if os.path.isfile(fn):
+            return(fn)
+    return(None)
+
+
+def _chrom_aliases(chr):
+    chr = str(chr)
+    rv = [chr]
+    if chr.startswith("chr"):
+        rv.append(chr[3:])
+    else:
+        rv.append("chr" + chr)
+    if chr in ("M", "MT", "chrM", "chrMT"):
+        rv.extend(["M", "MT", "chrM", "chrMT"])
+    return(rv)
+
+
+class BAM_Check:
+    """The preflight result of one bam file"""
+
+    def __init__(self, bam_name):
+        self.bam_name = bam_name
+        self.status = "ok"
+        self.index = None
+        self.references = {} # name => Reference_Index
+
+    @property
+    def ok(self):
+        return(self.status == "ok")
+
+    @property
+    def mapped(self):
+        if not self.ok:
+            return(None)
+        counts = [r.mapped for r in self.references.values() if r.mapped is not None]
+        return(sum(counts) if len(counts) == len(self.references) else None)
+
+    def has_reads(self, chr, start, stop):
+        """Whether the window may have alignments
+
+        The estimate comes from the leaf bins and the linear index of the BAI
+        file, see Reference_Index.has_reads.
+
+        Args:
+            chr (str): chromosome, with or without the chr prefix
+            start (int): window start (1-based)
+            stop (int): window end (1-based, inclusive)
+
+        Returns:
+            bool: False if the window has no alignments, None if the chromosome is not in the bam file
+        """
+        for name in _chrom_aliases(chr):
+            if name in self.references:
+                return(self.references[name].has_reads(max(start - 1, 0), max(stop, start)))
+        return(None)
+
+
+def check_bam(bam_name):
+    """Check a bam file: it exists, is not empty, has a readable header and a BAI index
+
+    Returns:
+        BAM_Check: the result, with status ok, missing, empty, unreadable or no_index
+    """
+    rv = BAM_Check(bam_name)
+    if not os.path.isfile(bam_name):
+        rv.status = "missing"
+        return(rv)
+    if os.path.getsize(bam_name) == 0:
+        rv.status = "empty"
+        return(rv)
+
+    rv.index = find_index(bam_name)
+    if rv.index is None:
+        rv.status = "no_index"
+        return(rv)
+
+    try:
+        names = read_bam_references(bam_name)
+        refs = read_bai(rv.index)
+        if len(names) != len(refs):
+            raise ValueError("%d references in the header, %d in the index" % (len(names), len(refs)))
+        rv.references = dict(zip(names, refs))
+    except (OSError, EOFError, ValueError, struct.error) as exc:
+        logging.warning("Failed to read %s: %s" % (bam_name, exc))
+        rv.status = "unreadable"
+    return(rv)
+
+
+class BAM_Preflight:
+    """Preflight of the bam files and snapshot windows of the groups
+
+    The bam files are checked in parallel, and each bam file is checked only
+    once even if it is listed by many groups. The results are written to two
+    reports in the output directory: preflight_bams.tsv and preflight_loci.tsv.
+
+    mode:
+        report: only write the reports
+        flag: drop the bam files which are missing or not indexed, keep the empty loci (flagged in the report)
+        drop: drop the bam files which are missing or not indexed, and the loci without alignments
+
+    With flag or drop, the loci of a group left without any bam file are dropped.
+    """
+
+    MODES = ['report', 'flag', 'drop']
+
+    def __init__(self, output_dir, mode="report", jobs=8, default_ext=100):
+        if mode not in self.MODES:
+            raise ValueError("Unknown preflight mode: %s" % mode)
+        self.mode = mode
+        self.default_ext = default_ext
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.checks = {}
+        self.lock = threading.Lock()
+        self.bam_report = open(os.path.join(output_dir, "preflight_bams.tsv"), "w")
+        self.bam_report.write("bam\tstatus\tindex\tmapped\n")
+        self.loci_report = open(os.path.join(output_dir, "preflight_loci.tsv"), "w")
+        self.loci_report.write("group\tsnapshot\twindow\tstatus\tbams_with_reads\taction\n")
+        self.dropped = 0
+
+    def check_bams(self, bam_files):
+        """Check the bam files not seen before, in parallel
+
+        Returns:
+            list: BAM_Check of each bam file, in the same order
+        """
+        new = [f for f in OrderedDict.fromkeys(bam_files) if f not in self.checks]
+        for rv in self.executor.map(check_bam, new):
+            self.checks[rv.bam_name] = rv
+            self.bam_report.write("%s\t%s\t%s\t%s\n" % (rv.bam_name, rv.status, rv.index or "", "" if rv.mapped is None else rv.mapped))
+            if not rv.ok:
+                logging.warning("Preflight: %s is %s" % (rv.bam_name, rv.status))
+        self.bam_report.flush()
+        return([self.checks[f] for f in bam_files])
+
+    def check_group(self, group):
+        """Check a group and apply the preflight mode
+
+        Args:
+            group (dict): the group, with name, bam_files and snapshots
+
+        Returns:
+            dict: the group, with the bam files and snapshots to keep
+        """
+        with self.lock:
+            checks = self.check_bams(group['bam_files'])
+            good = [c for c in checks if c.ok]
+
+            snapshots = []
+            for sp in group['snapshots']:
+                chr, start, stop = get_window(sp, self.default_ext)
+                found = [c.has_reads(chr, start, stop) for c in good]
+                if len(good) == 0:
+                    status = "no_bams"
+                elif any(found):
+                    status = "reads"
+                elif None in found:
+                    status = "unknown"
+                else:
+                    status = "empty"
+
+                action = "keep"
+                if status == "empty":
+                    action = "drop" if self.mode == "drop" else "flag"
+                elif status == "no_bams" and self.mode != "report":
+                    action = "drop" # nothing left to load in IGV
+                self.loci_report.write("%s\t%s\t%s:%d-%d\t%s\t%d\t%s\n" % (
+                    group['name'], sp['name'], chr, start, stop, status, sum(1 for f in found if f), action))
+                if action == "drop":
+                    self.dropped += 1
+                else:
+                    snapshots.append(sp)
+            self.loci_report.flush()
+
+        if self.mode == "report":
+            return(group)
+
+        rv = dict(group)
+        rv['bam_files'] = [c.bam_name for c in good]
+        rv['snapshots'] = snapshots
+        return(rv)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.bam_report.close()
+        self.loci_report.close()
+        bad = sum(1 for c in self.checks.values() if not c.ok)
+        logging.info("Preflight: %d bam files checked, %d failed, %d loci dropped" % (len(self.checks), bad, self.dropped))
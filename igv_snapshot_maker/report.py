@@ -0,0 +1,190 @@
+"""Time the IGV batch commands and write the machine-readable run report."""
+import os
+import re
+import csv
+import json
+import time
+import logging
+import threading
+
+# IGV logs every batch command before running it, e.g.
+# INFO [2021-02-01 10:00:00,000]  [BatchRunner.java:63] [BatchRunner] Executing Command: goto 1:100-200
+_EXECUTING = re.compile(r'Executing Command:\s*(.*)$', re.IGNORECASE)
+
+SNAPSHOT_FIELDS = ['group', 'snapshot', 'status', 'policy', 'locus', 'goto_s', 'track_s', 'snapshot_s', 'total_s', 'png_size', 'png']
+
+
+class Command_Timer:
+    """Wall time of each batch command run by IGV
+
+    A command starts when IGV reports it (batch engine, from the IGV log) or
+    when it is sent (port engine), and ends when the next command starts or
+    when IGV finishes.
+    """
+
+    def __init__(self):
+        self.events = [] # [command, start, end]
+        self.lock = threading.Lock()
+
+    def start(self, command, t=None):
+        """Mark the start of a command (and the end of the previous one)"""
+        if t is None:
+            t = time.time()
+        with self.lock:
+            if len(self.events) > 0 and self.events[-1][2] is None:
+                self.events[-1][2] = t
+            self.events.append([command.strip(), t, None])
+
+    def finish(self, t=None):
+        """Mark the end of the last command"""
+        if t is None:
+            t = time.time()
+        with self.lock:
+            if len(self.events) > 0 and self.events[-1][2] is None:
+                self.events[-1][2] = t
+
+    def on_igv_line(self, line):
+        """Parse one line of the IGV output, for the commands it executes"""
+        m = _EXECUTING.search(line)
+        if m is not None:
+            self.start(m.group(1))
+
+    def durations(self):
+        """(command, seconds) of each command, None if it never finished"""
+        return([(c, None if end is None else round(end - start, 3)) for c, start, end in self.events])
+
+    def load_timings(self):
+        """(bam file, seconds) of each load command"""
+        return([(c.split(None, 1)[1], d) for c, d in self.durations() if c.startswith("load ")])
+
+    def snapshot_timings(self):
+        """The time spent on each snapshot, from its goto to its snapshot command
+
+        Returns:
+            dict: PNG file path => locus, goto_s, track_s (the commands between goto and snapshot), snapshot_s and total_s
+        """
+        rv = {}
+        snapshot_dir = ""
+        locus = None
+        for command, d in self.durations():
+            words = command.split()
+            if len(words) == 0:
+                continue
+            if words[0] == "snapshotDirectory":
+                snapshot_dir = command.split(None, 1)[1]
+            elif words[0] == "goto":
+                locus = {'locus': " ".join(words[1:]), 'goto_s': d, 'track_s': 0.0}
+            elif words[0] == "snapshot" and locus is not None:
+                locus['snapshot_s'] = d
+                parts = [locus[k] for k in ('goto_s', 'track_s', 'snapshot_s')]
+                locus['total_s'] = None if None in parts else round(sum(parts), 3)
+                png_name = words[1] if len(words) > 1 else ""
+                rv[os.path.join(snapshot_dir, png_name)] = locus
+                locus = None
+            elif locus is not None and words[0] != "region":
+                locus['track_s'] = None if d is None or locus['track_s'] is None else round(locus['track_s'] + d, 3)
+        return(rv)
+
+
+def snapshot_report(group_name, png_files, timer, quarantined=()):
+    """The per-snapshot rows of a group
+
+    Args:
+        group_name (str): name of the group
+        png_files (list): the PNG files expected from the group
+        timer (Command_Timer): the timings of the IGV commands
+        quarantined (list, optional): the PNG files given up after the retries
+
+    Returns:
+        list: one dictionary per snapshot, with the SNAPSHOT_FIELDS
+    """
+    timings = timer.snapshot_timings()
+    quarantined = set(quarantined)
+    rows = []
+    for png_name in png_files:
+        t = timings.get(png_name, {})
+        size = os.path.getsize(png_name) if os.path.isfile(png_name) else None
+        status = 'rendered' if size else 'failed'
+        if png_name in quarantined:
+            status = 'quarantined'
+        rows.append({
+            'group': group_name,
+            'snapshot': os.path.splitext(os.path.basename(png_name))[0],
+            'status': status,
+            'policy': 'full',
+            'locus': t.get('locus'),
+            'goto_s': t.get('goto_s'),
+            'track_s': t.get('track_s'),
+            'snapshot_s': t.get('snapshot_s'),
+            'total_s': t.get('total_s'),
+            'png_size': size,
+            'png': png_name,
+        })
+    return(rows)
+
+
+def skipped_report(skipped):
+    """The rows of the snapshots skipped as their window is over the visibility limit
+
+    Args:
+        skipped (list): (group name, snapshot) of each skipped snapshot
+
+    Returns:
+        list: one dictionary per snapshot, with the SNAPSHOT_FIELDS
+    """
+    rows = []
+    for group_name, sp in skipped:
+        row = dict((k, None) for k in SNAPSHOT_FIELDS)
+        row.update({'group': group_name, 'snapshot': sp['name'], 'status': 'skipped', 'policy': sp.get('policy', 'skip'),
+                    'locus': "%s:%s-%s" % (sp['chr'], sp['start'], sp['stop'])})
+        rows.append(row)
+    return(rows)
+
+
+def write_run_report(results, output_dir, policies=None, skipped=()):
+    """Write run_report.json (per group, with the snapshots) and run_report.csv (per snapshot)
+
+    The snapshots quarantined after the retries are also listed in quarantine.tsv.
+
+    Args:
+        results (list): result dictionaries returned by IGV_Worker_Pool.wait()
+        output_dir (str): output directory
+        policies (dict, optional): PNG file => policy of the windows over the visibility limit
+        skipped (list, optional): (group name, snapshot) of the snapshots skipped by the policy
+    """
+    policies = policies or {}
+    groups = []
+    for r in results:
+        g = dict((k, v) for k, v in r.items() if k not in ('snapshots', 'loads'))
+        g['load_s'] = round(sum(d for b, d in r.get('loads', []) if d is not None), 3)
+        g['loads'] = [{'bam': b, 'seconds': d} for b, d in r.get('loads', [])]
+        g['snapshots'] = r.get('snapshots', [])
+        for row in g['snapshots']:
+            row['policy'] = policies.get(row['png'], row.get('policy', 'full'))
+        groups.append(g)
+    skipped = skipped_report(skipped)
+
+    json_fn = os.path.join(output_dir, "run_report.json")
+    with open(json_fn, "w") as out:
+        json.dump({'groups': groups, 'skipped': skipped}, out, indent=1)
+
+    csv_fn = os.path.join(output_dir, "run_report.csv")
+    with open(csv_fn, "w", newline="") as out:
+        writer = csv.DictWriter(out, fieldnames=SNAPSHOT_FIELDS)
+        writer.writeheader()
+        for g in groups:
+            for row in g['snapshots']:
+                writer.writerow(row)
+        for row in skipped:
+            writer.writerow(row)
+
+    logging.info("Wrote the run report to %s and %s" % (json_fn, csv_fn))
+
+    quarantined = [row for g in groups for row in g['snapshots'] if row['status'] == 'quarantined']
+    if len(quarantined) > 0:
+        quarantine_fn = os.path.join(output_dir, "quarantine.tsv")
+        with open(quarantine_fn, "w") as out:
+            out.write("group\tsnapshot\tlocus\tpng\n")
+            for row in quarantined:
+                out.write("%s\t%s\t%s\t%s\n" % (row['group'], row['snapshot'], row['locus'] or "", row['png']))
+        logging.error("%d snapshots quarantined after the retries, see %s" % (len(quarantined), quarantine_fn))
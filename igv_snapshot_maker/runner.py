@@ -0,0 +1,221 @@
+"""Run the master batch scripts with a pool of IGV workers."""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .report import Command_Timer, snapshot_report
+from .watchdog import Watchdog, written_since
+from .memory import batch_heap_size
+
+
+SUMMARY_FIELDS = ['group', 'status', 'returncode', 'expected', 'rendered', 'elapsed', 'batch', 'attempts', 'killed', 'heap_mb']
+
+
+class IGV_Worker_Pool:
+    """Pool of independent IGV/Xvfb workers
+
+    Master batch scripts are queued with submit() and rendered by up to `jobs`
+    IGV processes at the same time. Each worker is a thread that blocks on its
+    own xvfb-run/IGV process, so the Python side stays idle while IGV renders.
+    The results are always reported in the submission order, regardless of
+    which worker finished first.
+
+    With a timeout or a snapshot_timeout, a watchdog kills IGV when it hangs.
+    After a kill or a crash, the snapshots which did not land are rendered
+    again by a retry script covering only them, up to `retries` times. The
+    snapshots still missing after the last retry are quarantined. A snapshot
+    only counts as rendered when its PNG file was written since the render
+    started, as the PNG files of an earlier run may still be there.
+
+    With max_heap, each IGV launch gets a Java heap sized from the bam files
+    and windows of its batch script, up to max_heap. With an admission
+    control, a worker only starts IGV when the node has the memory for it.
+    """
+
+    def __init__(self, maker, jobs=1, retries=0, timeout=None, snapshot_timeout=None, max_heap=None, admission=None, on_start=None):
+        """Constructor
+
+        Args:
+            maker (IGV_Snapshot_Maker): the maker providing call_igv()
+            jobs (int, optional): number of concurrent IGV workers. Defaults to 1.
+            retries (int, optional): number of retries of the missing snapshots. Defaults to 0.
+            timeout (float, optional): seconds allowed for each batch script. Defaults to None (no limit).
+            snapshot_timeout (float, optional): seconds allowed between two snapshots. Defaults to None (no limit).
+            max_heap (int, optional): the largest Java heap of IGV in MB. Defaults to None (the heap of the igv command).
+            admission (Memory_Admission, optional): admits the IGV launches by free memory. Defaults to None.
+            on_start (function, optional): called with the name of each group when IGV starts rendering it. Defaults to None.
+        """
+        if jobs < 1:
+            raise ValueError("The number of IGV workers must be at least 1: %s" % jobs)
+        if retries < 0:
+            raise ValueError("The number of retries must be at least 0: %s" % retries)
+
+        self.maker = maker
+        self.jobs = jobs
+        self.retries = retries
+        self.timeout = timeout
+        self.snapshot_timeout = snapshot_timeout
+        self.max_heap = max_heap
+        self.admission = admission
+        self.on_start = on_start
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.futures = []
+
+    def submit(self, group_name, bat_name, png_files=(), callback=None, retry=None):
+        """Queue one master batch script
+
+        Args:
+            group_name (str): name of the group (IGV session)
+            bat_name (str): master batch script file name
+            png_files (list, optional): the snapshots expected from the batch script
+            callback (function, optional): called with the result dictionary once the group is rendered
+            retry (function, optional): called with (missing PNG files, attempt), returns the batch script rendering them
+        """
+        return(self.submit_session(bat_name, [(group_name, png_files, callback)], retry=retry))
+
+    def submit_session(self, bat_name, groups, retry=None):
+        """Queue a batch script rendering one or several groups in the same IGV session
+
+        Args:
+            bat_name (str): batch script file name
+            groups (list): (group_name, png_files, callback) of each group rendered by the script
+            retry (function, optional): called with (missing PNG files, attempt), returns the batch script rendering them
+        """
+        groups = [(g, list(png_files), callback) for g, png_files, callback in groups]
+        logging.info("Queue the group(s) %s: %s" % (", ".join(g[0] for g in groups), bat_name))
+        future = self.executor.submit(self.render, bat_name, groups, retry)
+        self.futures.append(future)
+        return(future)
+
+    def heap(self, bat_name):
+        """The Java heap of IGV for a batch script, None without max_heap"""
+        if self.max_heap is None:
+            return(None)
+        return(batch_heap_size(bat_name, max_heap=self.max_heap))
+
+    def run_igv(self, bat_name, png_files, timer, heap=None):
+        """Run IGV once on a batch script, under the watchdog if any
+
+        Returns:
+            tuple: the return code of IGV (None if it raised) and the reason of a kill by the watchdog
+        """
+        watchdog = None
+        kwargs = {}
+        if self.timeout or self.snapshot_timeout:
+            watchdog = Watchdog(png_files, timeout=self.timeout, snapshot_timeout=self.snapshot_timeout)
+            kwargs['watchdog'] = watchdog
+        if heap is not None:
+            kwargs['heap'] = heap
+        if self.admission is not None and heap is not None:
+            self.admission.acquire(heap)
+        try:
+            returncode = self.maker.call_igv(bat_name, timer=timer, **kwargs)
+        except Exception as exc:  # keep the remaining groups going
+            logging.error("IGV failed on %s: %s" % (bat_name, exc))
+            returncode = None
+        finally:
+            if self.admission is not None and heap is not None:
+                self.admission.release(heap)
+        timer.finish()
+        return(returncode, None if watchdog is None else watchdog.reason)
+
+    def render(self, bat_name, groups, retry=None):
+        """Render one batch script and check the snapshots of each group it produced
+
+        Returns:
+            list: one result dictionary per group
+        """
+        t0 = time.time()
+        timer = Command_Timer()
+        expected = [f for g, png_files, callback in groups for f in png_files]
+        if self.on_start is not None:
+            for group_name, png_files, callback in groups:
+                self.on_start(group_name)
+
+        heap = self.heap(bat_name)
+        attempts = 1
+        returncode, killed = self.run_igv(bat_name, expected, timer, heap=heap)
+        kills = [killed] if killed else []
+        missing = [f for f in expected if not written_since(f, t0)]
+        while len(missing) > 0 and attempts <= self.retries and retry is not None:
+            retry_bat = retry(missing, attempts)
+            if retry_bat is None:
+                break
+            logging.warning("Retry %d of %s: %d snapshots missing" % (attempts, bat_name, len(missing)))
+            attempts += 1
+            if heap is not None and returncode != 0:
+                heap = min(heap * 2, self.max_heap) # IGV may have run out of memory
+            returncode, killed = self.run_igv(retry_bat, missing, timer, heap=heap)
+            if killed:
+                kills.append(killed)
+            missing = [f for f in missing if not written_since(f, t0)]
+        elapsed = round(time.time() - t0, 3)
+        # the snapshots still missing after the last attempt are given up
+        given_up = set(missing)
+
+        results = []
+        for group_name, png_files, callback in groups:
+            rendered = [f for f in png_files if f not in given_up]
+            ok = returncode == 0 and len(rendered) == len(png_files)
+            quarantined = [f for f in png_files if f in given_up]
+
+            result = {
+                'group': group_name,
+                'status': 'success' if ok else 'failed',
+                'returncode': returncode,
+                'expected': len(png_files),
+                'rendered': len(rendered),
+                'elapsed': elapsed,
+                'batch': bat_name,
+                'attempts': attempts,
+                'killed': ",".join(kills),
+                'heap_mb': heap,
+                'started': t0,
+                'snapshots': snapshot_report(group_name, png_files, timer, quarantined=quarantined),
+                'loads': timer.load_timings(),
+                'quarantined': quarantined,
+            }
+            logging.info("Group %s: %s (%d/%d snapshots, %.1f s, %d attempts)" % (
+                group_name, result['status'], result['rendered'], result['expected'], result['elapsed'], attempts))
+            if len(quarantined) > 0:
+                logging.error("Group %s: %d snapshots quarantined" % (group_name, len(quarantined)))
+
+            if callback is not None:
+                try:
+                    callback(result)
+                except Exception as exc:
+                    logging.error("Failed to process the result of the group %s: %s" % (group_name, exc))
+            results.append(result)
+        return(results)
+
+    def wait(self):
+        """Wait for all the queued groups
+
+        Returns:
+            list: one result dictionary per group, in the submission order
+        """
+        results = [r for f in self.futures for r in f.result()]
+        self.executor.shutdown(wait=True)
+        return(results)
+
+
+def write_summary(results, summary_fn):
+    """Write the per-group success/failure summary as a tab-delimited file
+
+    Args:
+        results (list): result dictionaries returned by IGV_Worker_Pool.wait()
+        summary_fn (str): output file name
+
+    Returns:
+        int: the number of failed groups
+    """
+    failed = 0
+    with open(summary_fn, 'w') as out:
+        out.write("\t".join(SUMMARY_FIELDS) + "\n")
+        for r in results:
+            out.write("\t".join(str(r[k]) for k in SUMMARY_FIELDS) + "\n")
+            if r['status'] != 'success':
+                failed += 1
+
+    logging.info("Wrote the run summary to %s: %d groups, %d failed" % (summary_fn, len(results), failed))
+    return(failed)
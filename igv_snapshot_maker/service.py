@@ -0,0 +1,461 @@
+"""Snapshot service: warm IGV sessions rendering the requests of a spool directory and of a Unix socket."""
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+
+from .batch import Group_Script, write_batch_file
+
+SOCKET_NAME = "serve.sock"
+SPOOL_DIRS = ['incoming', 'work', 'done', 'failed']
+STEAL_AFTER = 2.0 # seconds a request waits for the worker with its bam files, before another worker loads them
+MAX_BATCH = 100 # snapshots rendered by one batch of requests
+
+
+class Snapshot_Request:
+    """One request: snapshots of a set of bam files
+
+    A request is a JSON object, e.g.
+    {"id": "r1", "group": "cdRCC_1929", "bam_files": ["/data/T.bam", "/data/N.bam"],
+     "snapshots": [{"name": "SV1_BP1", "chr": "chr8", "start": 33600000, "stop": 33600100}]}
+    The id defaults to a unique name, and the group (the output folder) to the id.
+    """
+
+    _count = 0
+    _lock = threading.Lock()
+
+    def __init__(self, rec, reply=None):
+        """Constructor
+
+        Args:
+            rec (dict): the JSON request
+            reply (function, optional): called with the completion record
+
+        Raises:
+            ValueError: if the request is not valid
+        """
+        if not isinstance(rec, dict):
+            raise ValueError("A request is a JSON object")
+        with Snapshot_Request._lock:
+            Snapshot_Request._count += 1
+            count = Snapshot_Request._count
+        self.id = str(rec.get('id') or "request_%d_%d_%d" % (os.getpid(), int(time.time()), count))
+        self.group = str(rec.get('group') or self.id)
+        self.bam_files = rec.get('bam_files')
+        self.snapshots = rec.get('snapshots')
+        if not isinstance(self.bam_files, list) or len(self.bam_files) == 0:
+            raise ValueError("The request %s has no bam_files" % self.id)
+        if not isinstance(self.snapshots, list) or len(self.snapshots) == 0:
+            raise ValueError("The request %s has no snapshots" % self.id)
+        for sp in self.snapshots:
+            missing = [k for k in ('name', 'chr', 'start', 'stop') if k not in sp]
+            if len(missing) > 0:
+                raise ValueError("A snapshot of the request %s has no %s" % (self.id, ", ".join(missing)))
+            sp['start'], sp['stop'] = int(sp['start']), int(sp['stop'])
+        self.key = tuple(os.path.normpath(f) for f in self.bam_files)
+        self.reply = reply
+        self.answered = False
+        self.received = time.time()
+
+
+class Request_Queue:
+    """The pending requests, taken by the workers a bam set at a time
+
+    A worker takes the requests for the bam files it has loaded first. Else
+    it takes the oldest request whose bam files are not loaded by another
+    worker; the requests for the bam files of another worker are left to
+    it, unless they have waited more than `steal_after` seconds.
+    """
+
+    def __init__(self, steal_after=STEAL_AFTER, max_batch=MAX_BATCH):
+        self.pending = []
+        self.loaded = {} # worker => the bam files it has loaded
+        self.steal_after = steal_after
+        self.max_batch = max_batch
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, request):
+        with self.cond:
+            self.pending.append(request)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        with self.cond:
+            return(len(self.pending))
+
+    def pick(self, worker):
+        """The bam files the worker renders next, None if none is for it"""
+        if len(self.pending) == 0:
+            return(None)
+        mine = self.loaded.get(worker)
+        if any(r.key == mine for r in self.pending):
+            return(mine)
+        others = set(v for w, v in self.loaded.items() if w != worker)
+        for r in self.pending:
+            if r.key not in others or time.time() - r.received > self.steal_after:
+                return(r.key)
+        return(None)
+
+    def take(self, worker, timeout=None):
+        """Wait for the next batch of a worker: requests for the same bam files, in their arrival order
+
+        Args:
+            worker (int): the worker
+            timeout (float, optional): seconds to wait. Defaults to no limit.
+
+        Returns:
+            list: the requests, empty on timeout or once the queue is closed
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while True:
+                key = self.pick(worker)
+                if key is not None or self.closed:
+                    break
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    return([])
+                # the requests left to another worker may be stolen later
+                self.cond.wait(self.steal_after if wait is None else min(wait, self.steal_after))
+            if key is None:
+                return([])
+            batch = []
+            snapshots = 0
+            for r in list(self.pending):
+                if r.key == key and (len(batch) == 0 or snapshots + len(r.snapshots) <= self.max_batch):
+                    batch.append(r)
+                    snapshots += len(r.snapshots)
+                    self.pending.remove(r)
+            self.loaded[worker] = key
+            return(batch)
+
+    def unload(self, worker):
+        with self.cond:
+            self.loaded.pop(worker, None)
+
+
+class Snapshot_Service:
+    """Render snapshot requests on warm IGV sessions, until stopped
+
+    Each IGV session keeps its genome and bam files loaded between the
+    requests: a request for the bam files already loaded only sends the goto
+    and snapshot commands, so its snapshots land in about a second rather
+    than after the start of IGV and the loading of the bam files. The
+    requests for the same bam files are rendered together.
+
+    The requests come from the spool directory, where each JSON file dropped
+    into <spool>/incoming (written elsewhere and renamed in) is a request,
+    and from the Unix socket, one JSON request per line. The PNG files land
+    in <output>/<group>, as with igv_snapshot_maker, and the completion
+    record of each request is written to <spool>/done/<id>.json (the id made
+    a valid file name, the name of the spool file for a rejected request),
+    and sent back on the socket.
+    """
+
+    def __init__(self, maker, sessions, spool_dir, socket_name=None, poll=0.2, steal_after=STEAL_AFTER, max_batch=MAX_BATCH):
+        """Constructor
+
+        Args:
+            maker (IGV_Snapshot_Maker): provides the genome, extension, track setting and output directory
+            sessions (list): the IGV_Session of each worker, started by the service
+            spool_dir (str): the spool directory
+            socket_name (str, optional): the Unix socket, None for no socket. Defaults to None.
+            poll (float, optional): seconds between two scans of the spool directory. Defaults to 0.2.
+            steal_after (float, optional): see Request_Queue. Defaults to 2.0.
+            max_batch (int, optional): snapshots rendered by one batch of requests. Defaults to 100.
+        """
+        self.maker = maker
+        self.sessions = list(sessions)
+        self.spool_dir = os.path.abspath(spool_dir)
+        for d in SPOOL_DIRS:
+            os.makedirs(os.path.join(self.spool_dir, d), exist_ok=True)
+        self.socket_name = socket_name
+        self.poll = poll
+        self.queue = Request_Queue(steal_after=steal_after, max_batch=max_batch)
+        self.stopped = threading.Event()
+        self.threads = []
+        self.server = None
+        self.warm = [None] * len(self.sessions) # the bam files loaded by the session of each worker
+        self.batches = 0
+        self.lock = threading.Lock()
+
+    def spool_name(self, folder, name):
+        return(os.path.join(self.spool_dir, folder, name))
+
+    # Requests
+    def submit(self, rec, reply=None):
+        """Queue a request
+
+        Args:
+            rec (dict): the JSON request
+            reply (function, optional): called with the completion record
+
+        Returns:
+            Snapshot_Request: the request, None if it was rejected (the reply then has the error)
+        """
+        try:
+            request = Snapshot_Request(rec, reply=reply)
+        except (ValueError, TypeError) as exc:
+            logging.error("Rejected a request: %s" % exc)
+            if reply is not None:
+                reply({'id': rec.get('id') if isinstance(rec, dict) else None, 'status': 'rejected', 'error': str(exc)})
+            return(None)
+        logging.info("Request %s: %d snapshots of %d bam files" % (request.id, len(request.snapshots), len(request.bam_files)))
+        self.queue.put(request)
+        return(request)
+
+    def scan_spool(self):
+        """Claim the requests dropped into the spool directory
+
+        Returns:
+            int: the number of requests claimed
+        """
+        n = 0
+        incoming = os.path.join(self.spool_dir, 'incoming')
+        for name in sorted(os.listdir(incoming)):
+            if name.startswith(".") or not name.endswith(".json"):
+                continue # still being written
+            work_name = self.spool_name('work', name)
+            try:
+                os.rename(os.path.join(incoming, name), work_name)
+            except OSError:
+                continue # claimed by another service on the same spool
+            try:
+                with open(work_name, "r") as fin:
+                    rec = json.load(fin)
+            except ValueError as exc:
+                logging.error("Cannot read the request %s: %s" % (name, exc))
+                os.replace(work_name, self.spool_name('failed', name))
+                continue
+            if isinstance(rec, dict) and not rec.get('id'):
+                rec['id'] = os.path.splitext(name)[0]
+            if self.submit(rec, reply=lambda record, fn=work_name: self.spool_reply(fn, record)) is not None:
+                n += 1
+        return(n)
+
+    def spool_reply(self, work_name, record):
+        """Write the completion record of a spool request, and retire the request"""
+        name = os.path.splitext(os.path.basename(work_name))[0]
+        if record['status'] != 'rejected' and record.get('id'):
+            # the id comes from the request: no path out of the spool directory
+            name = self.maker.fix_name(str(record['id'])) or name
+        fn = self.spool_name('done', "%s.json" % name)
+        write_record(fn, record)
+        os.replace(work_name, self.spool_name('done' if record['status'] == 'rendered' else 'failed', os.path.basename(work_name) + ".request"))
+
+    # Rendering
+    def batch_commands(self, scripts, warm):
+        """The commands of a batch of requests; a warm session only gets the goto and snapshot steps"""
+        commands = [] if warm else scripts[0].header_commands(scripts[0].bam_files)
+        for script in scripts:
+            commands.extend(script.body_commands())
+        return(self.maker.optimize_commands(commands))
+
+    def render(self, worker, batch):
+        """Render a batch of requests for the same bam files on the session of a worker"""
+        session = self.sessions[worker]
+        scripts = []
+        for request in batch:
+            script = Group_Script(self.maker, request.group, request.bam_files, request.snapshots)
+            for sp in request.snapshots:
+                script.add_locus(sp)
+            os.makedirs(script.dir_name, exist_ok=True)
+            scripts.append(script)
+
+        with self.lock:
+            self.batches += 1
+            bat_name = self.spool_name('work', "worker%d_batch%d.bat" % (worker + 1, self.batches))
+        t0 = time.time()
+        warm = False
+        returncode = 1
+        for attempt in range(2):
+            try:
+                if not session.is_alive():
+                    session.stop()
+                    session.start()
+                    self.warm[worker] = None
+                warm = self.warm[worker] == batch[0].key
+                write_batch_file(bat_name, self.batch_commands(scripts, warm))
+                returncode = session.run_batch(bat_name)
+                break
+            except (OSError, ConnectionError) as exc:
+                # IGV died: it is started again, and loads the bam files again
+                logging.error("IGV session on port %d failed on %s: %s" % (session.port, bat_name, exc))
+                session.client.close()
+                self.warm[worker] = None
+        if session.is_alive():
+            self.warm[worker] = batch[0].key
+        else:
+            self.warm[worker] = None
+            self.queue.unload(worker)
+        if returncode == 0:
+            os.remove(bat_name) # kept to debug the failures
+        render_s = round(time.time() - t0, 3)
+
+        for request, script in zip(batch, scripts):
+            rendered = []
+            missing = []
+            for png_name in script.png_files:
+                try:
+                    landed = os.path.getmtime(png_name) >= t0 - 1
+                except OSError:
+                    landed = False
+                (rendered if landed else missing).append(png_name)
+            record = {
+                'id': request.id,
+                'group': request.group,
+                'status': 'rendered' if len(missing) == 0 and returncode == 0 else 'failed',
+                'png_files': rendered,
+                'missing': missing,
+                'warm': warm,
+                'worker': worker + 1,
+                'batch': len(batch),
+                'render_s': render_s,
+                'latency_s': round(time.time() - request.received, 3),
+            }
+            logging.info("Request %s: %s, %d snapshots in %.2f s (%s)" % (
+                request.id, record['status'], len(rendered), record['latency_s'], "warm" if warm else "cold"))
+            self.answer(request, record)
+
+    def answer(self, request, record):
+        """Send the completion record of a request, once"""
+        request.answered = True
+        if request.reply is not None:
+            try:
+                request.reply(record)
+            except Exception as exc:
+                logging.error("Failed to reply to the request %s: %s" % (request.id, exc))
+
+    def work(self, worker):
+        while True:
+            batch = self.queue.take(worker, timeout=1.0)
+            if len(batch) == 0:
+                if self.stopped.is_set():
+                    break
+                continue
+            try:
+                self.render(worker, batch)
+            except Exception as exc:
+                logging.error("Worker %d failed on %d requests: %s" % (worker + 1, len(batch), exc))
+                # the requests answered before the failure keep their record
+                for request in batch:
+                    if not request.answered:
+                        self.answer(request, {'id': request.id, 'group': request.group, 'status': 'failed', 'error': str(exc)})
+
+    def watch_spool(self):
+        while not self.stopped.is_set():
+            try:
+                self.scan_spool()
+            except OSError as exc:
+                logging.error("Failed to scan the spool directory %s: %s" % (self.spool_dir, exc))
+            self.stopped.wait(self.poll)
+
+    # Life cycle
+    def start(self):
+        for worker in range(len(self.sessions)):
+            t = threading.Thread(target=self.work, args=(worker,), daemon=True)
+            t.start()
+            self.threads.append(t)
+        t = threading.Thread(target=self.watch_spool, daemon=True)
+        t.start()
+        self.threads.append(t)
+        if self.socket_name is not None:
+            if os.path.exists(self.socket_name):
+                os.remove(self.socket_name) # left over by a killed service
+            self.server = _Service_Socket_Server(self.socket_name, self)
+            t = threading.Thread(target=self.server.serve_forever, daemon=True)
+            t.start()
+        logging.info("Serving %s with %d IGV workers%s" % (self.spool_dir, len(self.sessions),
+                                                          "" if self.socket_name is None else " and on %s" % self.socket_name))
+        return(self)
+
+    def stop(self):
+        """Stop taking requests, render the queued ones and stop IGV"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            os.remove(self.socket_name)
+            self.server = None
+        self.stopped.set()
+        self.queue.close()
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        for session in self.sessions:
+            session.stop()
+        logging.info("Stopped serving %s" % self.spool_dir)
+
+
+def write_record(fn, record):
+    tmp_name = fn + ".tmp"
+    with open(tmp_name, "w") as out:
+        json.dump(record, out, indent=1, sort_keys=True)
+    os.replace(tmp_name, fn)
+
+
+class _Service_Socket_Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_name, service):
+        socketserver.UnixStreamServer.__init__(self, socket_name, _Service_Handler)
+        self.service = service
+
+
+class _Service_Handler(socketserver.StreamRequestHandler):
+    """One JSON request per line, answered by its completion record"""
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b"":
+                continue
+            done = threading.Event()
+            records = []
+
+            def reply(record):
+                records.append(record)
+                done.set()
+            try:
+                rec = json.loads(line.decode('utf-8'))
+            except ValueError as exc:
+                reply({'id': None, 'status': 'rejected', 'error': "Not a JSON request: %s" % exc})
+            else:
+                self.server.service.submit(rec, reply=reply)
+            done.wait()
+            self.wfile.write(json.dumps(records[0], sort_keys=True).encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+
+def request_snapshots(socket_name, request, timeout=None):
+    """Send a request to the snapshot service and wait for its completion record
+
+    Args:
+        socket_name (str): the Unix socket of the service
+        request (dict): the JSON request, see Snapshot_Request
+        timeout (float, optional): seconds to wait. Defaults to no limit.
+
+    Returns:
+        dict: the completion record
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_name)
+        stream = sock.makefile('rwb')
+        stream.write(json.dumps(request).encode('utf-8') + b"\n")
+        stream.flush()
+        reply = stream.readline()
+        stream.close()
+    finally:
+        sock.close()
+    if not reply:
+        raise ConnectionError("The snapshot service closed the connection")
+    return(json.loads(reply.decode('utf-8')))
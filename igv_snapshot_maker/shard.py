@@ -0,0 +1,291 @@
+"""Split the groups of an input into balanced shards, for cluster job arrays."""
+import os
+import csv
+import glob
+import heapq
+import json
+import shutil
+import logging
+
+from .catalog import CATALOG_NAME, Snapshot_Catalog
+from .manifest import MANIFEST_NAME, Snapshot_Manifest
+
+# Weights of the cost model, in rough seconds of IGV time
+COST_PER_SNAPSHOT = 2.0       # goto, track setting and PNG of a snapshot
+COST_PER_SNAPSHOT_BAM = 0.5   # every bam track is redrawn for each snapshot
+COST_PER_BAM = 5.0            # opening a bam file and its index
+COST_PER_INDEX_MB = 0.2       # reading a large index
+COST_PER_BAM_GB = 0.05        # larger bam files are slower to seek
+
+PLAN_FIELDS = ['index', 'group', 'snapshots', 'bams', 'cost', 'shard']
+SHARD_DIR = "shards"
+LOG_NAME = "my_log.txt"
+LOG_SHARD_HEADER = "==> %s <==\n" # the log of a shard, in the merged log
+
+
+def parse_shard(text):
+    """Parse a shard written as i/N, with i from 1 to N
+
+    Returns:
+        tuple: (i, N)
+    """
+    try:
+        i, n = [int(x) for x in text.split("/")]
+    except ValueError:
+        raise ValueError("A shard must be written as i/N, e.g. 3/10: %s" % text)
+    if n < 1 or i < 1 or i > n:
+        raise ValueError("The shard %s is not between 1/%d and %d/%d" % (text, n, n, n))
+    return((i, n))
+
+
+def shard_dir(output_dir, shard, shards):
+    """The folder of the logs and reports of a shard"""
+    return(os.path.join(output_dir, SHARD_DIR, "shard_%04dof%04d" % (shard, shards)))
+
+
+class Cost_Model:
+    """Estimated rendering cost of a group
+
+    The cost grows with the number of snapshots, the number of bam files
+    (loaded once, redrawn at each snapshot) and the size of the bam files and
+    their indexes. The sizes are read once per bam file; a missing file
+    counts as empty.
+    """
+
+    def __init__(self):
+        self.sizes = {} # bam file => (bam size, index size) in bytes
+
+    def file_sizes(self, bam_name):
+        rv = self.sizes.get(bam_name)
+        if rv is None:
+            sizes = []
+            for fn in (bam_name, bam_name + ".bai", os.path.splitext(bam_name)[0] + ".bai"):
+                try:
+                    sizes.append(os.path.getsize(fn))
+                except OSError:
+                    sizes.append(0)
+            rv = (sizes[0], max(sizes[1:]))
+            self.sizes[bam_name] = rv
+        return(rv)
+
+    def cost(self, group):
+        bams = group.get('bam_files') or []
+        snapshots = len(group.get('snapshots') or [])
+        rv = snapshots * (COST_PER_SNAPSHOT + COST_PER_SNAPSHOT_BAM * len(bams)) + COST_PER_BAM * len(bams)
+        for f in bams:
+            bam_size, index_size = self.file_sizes(f)
+            rv += COST_PER_BAM_GB * bam_size / 1e9 + COST_PER_INDEX_MB * index_size / 1e6
+        return(round(rv, 3))
+
+
+def assign_shards(costs, shards):
+    """Assign the groups to shards, the most expensive group first
+
+    Each group goes to the shard with the lowest total cost so far (the
+    lowest shard number on ties), so the plan only depends on the costs and
+    the input order.
+
+    Args:
+        costs (list): the cost of each group, in the input order
+        shards (int): the number of shards
+
+    Returns:
+        list: the shard (1 to N) of each group
+    """
+    loads = [(0.0, s) for s in range(1, shards + 1)] # a heap of (total cost, shard)
+    rv = [None] * len(costs)
+    for k in sorted(range(len(costs)), key=lambda k: (-costs[k], k)):
+        load, s = heapq.heappop(loads)
+        heapq.heappush(loads, (load + costs[k], s))
+        rv[k] = s
+    return(rv)
+
+
+def plan_shards(groups, shards, model=None):
+    """Plan the shards of the groups
+
+    Args:
+        groups (iterable): the groups, as read by iter_groups()
+        shards (int): the number of shards
+        model (Cost_Model, optional): the cost model. Defaults to Cost_Model().
+
+    Returns:
+        list: one dictionary per group with the PLAN_FIELDS
+    """
+    if shards < 1:
+        raise ValueError("The number of shards must be at least 1: %s" % shards)
+    if model is None:
+        model = Cost_Model()
+
+    rows = []
+    for k, group in enumerate(groups):
+        rows.append({
+            'index': k,
+            'group': group['name'],
+            'snapshots': len(group.get('snapshots') or []),
+            'bams': len(group.get('bam_files') or []),
+            'cost': model.cost(group),
+        })
+    for row, shard in zip(rows, assign_shards([r['cost'] for r in rows], shards)):
+        row['shard'] = shard
+    return(rows)
+
+
+def write_plan(plan_fn, rows):
+    with open(plan_fn, "w") as out:
+        out.write("\t".join(PLAN_FIELDS) + "\n")
+        for r in rows:
+            out.write("\t".join(str(r[k]) for k in PLAN_FIELDS) + "\n")
+
+
+def read_plan(plan_fn):
+    """Read the plan written by write_plan(), as {index: (group, shard)}"""
+    rv = {}
+    with open(plan_fn, "r") as fin:
+        for r in csv.DictReader(fin, delimiter="\t"):
+            rv[int(r['index'])] = (r['group'], int(r['shard']))
+    return(rv)
+
+
+def write_job_array(manifest_fn, rows, shards, command):
+    """Write the job array manifest: one line per shard, with its command
+
+    Args:
+        manifest_fn (str): output file name
+        rows (list): the plan
+        shards (int): the number of shards
+        command (str): the command line of a shard, with {shard} for the shard number
+    """
+    with open(manifest_fn, "w") as out:
+        out.write("shard\tgroups\tsnapshots\tcost\tcommand\n")
+        for s in range(1, shards + 1):
+            mine = [r for r in rows if r['shard'] == s]
+            out.write("%d\t%d\t%d\t%.3f\t%s\n" % (s, len(mine), sum(r['snapshots'] for r in mine),
+                      sum(r['cost'] for r in mine), command.replace("{shard}", "%d/%d" % (s, shards))))
+
+
+class Shard_Filter:
+    """Keep the groups of one shard while streaming the input
+
+    The shard of each group comes from a plan file written by the plan
+    subcommand when given, or else from plan_shards() over a first pass on
+    the input.
+    """
+
+    def __init__(self, shard, shards, plan):
+        """Constructor
+
+        Args:
+            shard (int): the shard to keep (1 to N)
+            shards (int): the number of shards
+            plan (dict): {index: (group, shard)} of every group of the input
+        """
+        self.shard = shard
+        self.shards = shards
+        self.plan = plan
+
+    @classmethod
+    def from_groups(cls, shard, shards, groups):
+        rows = plan_shards(groups, shards)
+        return(cls(shard, shards, dict((r['index'], (r['group'], r['shard'])) for r in rows)))
+
+    @classmethod
+    def from_plan(cls, shard, shards, plan_fn):
+        plan = read_plan(plan_fn)
+        planned = max([s for g, s in plan.values()] or [shards])
+        if planned > shards:
+            raise ValueError("The plan %s has %d shards, not %d" % (plan_fn, planned, shards))
+        return(cls(shard, shards, plan))
+
+    def filter(self, groups):
+        """The groups of the shard, in the input order"""
+        for k, group in enumerate(groups):
+            if k not in self.plan:
+                raise ValueError("The group #%d (%s) is not in the shard plan" % (k, group['name']))
+            name, shard = self.plan[k]
+            if name != str(group['name']):
+                raise ValueError("The group #%d is %s in the input, but %s in the shard plan" % (k, group['name'], name))
+            if shard == self.shard:
+                yield group
+
+
+def merge_logs(output_dir, dirs):
+    """Append the logs of the shards to the log of the output directory
+
+    The log of a run before the shards (e.g. a run which was not sharded)
+    is kept, and the logs of the shards merged before are replaced, so the
+    shards can be merged again.
+    """
+    parts = [os.path.join(d, LOG_NAME) for d in dirs if os.path.isfile(os.path.join(d, LOG_NAME))]
+    if len(parts) == 0:
+        return
+    log_fn = os.path.join(output_dir, LOG_NAME)
+    head = []
+    if os.path.isfile(log_fn):
+        with open(log_fn, "r") as fin:
+            for line in fin:
+                if line.startswith("==> shard_"):
+                    break
+                head.append(line)
+    tmp_name = log_fn + ".tmp"
+    with open(tmp_name, "w") as out:
+        out.writelines(head)
+        for fn in parts:
+            out.write(LOG_SHARD_HEADER % os.path.basename(os.path.dirname(fn)))
+            with open(fn, "r") as fin:
+                shutil.copyfileobj(fin, out)
+    os.replace(tmp_name, log_fn)
+
+
+def merge_shards(output_dir):
+    """Merge the logs and reports of the shards of an output directory
+
+    The tables are concatenated with a single header, in the shard order;
+    the run reports are concatenated, the snapshot manifests and catalogs
+    are merged into the ones of the output directory, and the logs are
+    appended to its log (see merge_logs).
+
+    Returns:
+        int: the number of shards merged
+    """
+    dirs = sorted(d for d in glob.glob(os.path.join(output_dir, SHARD_DIR, "shard_[0-9]*")) if os.path.isdir(d))
+    tables = ["run_summary.tsv", "run_report.csv", "quarantine.tsv", "preflight_bams.tsv", "preflight_loci.tsv", "postprocess.tsv"]
+    for name in tables:
+        parts = [os.path.join(d, name) for d in dirs if os.path.isfile(os.path.join(d, name))]
+        if len(parts) == 0:
+            continue
+        with open(os.path.join(output_dir, name), "w") as out:
+            for k, fn in enumerate(parts):
+                with open(fn, "r") as fin:
+                    header = fin.readline()
+                    if k == 0:
+                        out.write(header)
+                    shutil.copyfileobj(fin, out)
+
+    groups = []
+    skipped = []
+    for d in dirs:
+        fn = os.path.join(d, "run_report.json")
+        if os.path.isfile(fn):
+            with open(fn, "r") as fin:
+                report = json.load(fin)
+            groups.extend(report['groups'])
+            skipped.extend(report.get('skipped', []))
+    if len(groups) > 0 or len(skipped) > 0:
+        with open(os.path.join(output_dir, "run_report.json"), "w") as out:
+            json.dump({'groups': groups, 'skipped': skipped}, out, indent=1)
+
+    parts = [os.path.join(d, MANIFEST_NAME) for d in dirs if os.path.isfile(os.path.join(d, MANIFEST_NAME))]
+    if len(parts) > 0:
+        Snapshot_Manifest(output_dir).merge(parts)
+    merge_logs(output_dir, dirs)
+
+    parts = [os.path.join(d, CATALOG_NAME) for d in dirs if os.path.isfile(os.path.join(d, CATALOG_NAME))]
+    if len(parts) > 0:
+        catalog = Snapshot_Catalog(output_dir)
+        for fn in parts:
+            catalog.merge(fn)
+        catalog.close()
+
+    logging.info("Merged %d shards into %s" % (len(dirs), output_dir))
+    return(len(dirs))
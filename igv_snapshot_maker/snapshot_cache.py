@@ -0,0 +1,252 @@
+"""Content-addressed cache of the rendered snapshots, shared across output directories and runs."""
+import os
+import re
+import json
+import time
+import errno
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from .display import screen_size
+
+DEFAULT_CACHE_SIZE = 10000 # MB
+INDEX_NAME = "cache_index.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+COUNTERS = ['hits', 'misses', 'stored', 'evicted', 'evicted_bytes']
+
+_SCREEN = re.compile(r'-screen\s+\d+\s+(\d+x\d+(?:x\d+)?)')
+
+
+def render_screen(maker, bam_files):
+    """The screen geometry IGV renders the snapshots of a group in, as its width sets the width of the images"""
+    if maker.display_pool is not None:
+        return(screen_size(len(bam_files)))
+    m = _SCREEN.search(maker.xvfb_cmd)
+    # IGV run directly (--no-xvfb): the screen of the desktop, only known by the command
+    return(m.group(1) if m is not None else maker.xvfb_cmd.strip())
+
+
+def link_or_copy(src, dest):
+    """Hard-link src to dest, or copy it across file systems; dest is replaced atomically"""
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return # a rename between two links of a file leaves both in place
+    tmp_name = "%s.%d.%d.tmp" % (dest, os.getpid(), threading.get_ident())
+    try:
+        os.link(src, tmp_name)
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copyfile(src, tmp_name)
+    os.replace(tmp_name, dest)
+
+
+def detach_png(png_name):
+    """Remove a PNG file hard-linked to the cache before IGV renders it again
+
+    IGV overwrites a snapshot in place, which would also change the cached
+    image sharing its inode; once removed, IGV writes a new file.
+    """
+    try:
+        if os.stat(png_name).st_nlink > 1:
+            os.remove(png_name)
+    except OSError:
+        pass
+
+
+class Snapshot_Cache:
+    """PNG files keyed on a digest of everything that goes into their rendering
+
+    The key covers the snapshot digest of the manifest (region, extension,
+    genome, track settings, mates and wide-window policy), the identity of
+    each bam file (its real path, size and modification time), the screen
+    geometry and the track setting of the wide windows. A snapshot rendered
+    once, in any output directory, is hard-linked (or copied, across file
+    systems) into the output directory of the next run rather than rendered
+    again.
+
+    The images are stored in <cache>/objects, with an SQLite index shared by
+    the runs using the cache; the least recently used images are evicted
+    once the cache is over its size.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE):
+        """Constructor
+
+        Args:
+            cache_dir (str): the cache folder
+            max_size (int, optional): the size of the cache (MB), None for no limit. Defaults to 10000.
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        os.makedirs(os.path.join(self.cache_dir, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, INDEX_NAME), timeout=60, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.bam_identities = {}
+        self.counts = dict((k, 0) for k in COUNTERS) # this run, flushed to the index on commit()
+
+    def object_name(self, key):
+        return(os.path.join(self.cache_dir, "objects", key[:2], "%s.png" % key))
+
+    def bam_identity(self, bam_file):
+        """The real path, size and modification time of a bam file (memoized), only the path for a URL"""
+        rv = self.bam_identities.get(bam_file)
+        if rv is None:
+            try:
+                st = os.stat(bam_file)
+                rv = [os.path.realpath(bam_file), st.st_size, st.st_mtime_ns]
+            except OSError:
+                rv = [bam_file]
+            self.bam_identities[bam_file] = rv
+        return(rv)
+
+    def key(self, maker, bam_files, digest):
+        """The cache key of a snapshot
+
+        Args:
+            maker (IGV_Snapshot_Maker): the maker writing the batch scripts
+            bam_files (list): the bam files loaded by IGV
+            digest (str): the snapshot_digest() of the snapshot
+
+        Returns:
+            str: SHA-256 hex digest
+        """
+        inputs = [digest, [self.bam_identity(f) for f in bam_files], render_screen(maker, bam_files), maker.wide_track_setting]
+        return(hashlib.sha256(json.dumps(inputs).encode('utf-8')).hexdigest())
+
+    def fetch(self, key, png_name):
+        """Link the cached image of a snapshot to png_name
+
+        Returns:
+            bool: whether the snapshot was in the cache
+        """
+        with self.lock:
+            row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            obj = self.object_name(key)
+            try:
+                hit = row is not None and os.path.getsize(obj) == row[0]
+            except OSError:
+                hit = False
+            if not hit:
+                if row is not None:
+                    # removed or damaged out of band
+                    self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.counts['misses'] += 1
+                return(False)
+            self.db.execute("UPDATE entries SET accessed = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self.counts['hits'] += 1
+        os.makedirs(os.path.dirname(png_name), exist_ok=True)
+        link_or_copy(obj, png_name)
+        return(True)
+
+    def store(self, key, png_name):
+        """Add a rendered snapshot to the cache"""
+        obj = self.object_name(key)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        link_or_copy(png_name, obj)
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO entries (key, size, created, accessed) VALUES (?, ?, ?, ?)",
+                            (key, os.path.getsize(obj), now, now))
+            self.counts['stored'] += 1
+
+    def store_group(self, entries, since=0):
+        """Add the snapshots of a group whose PNG files landed, then evict the least recently used ones
+
+        Args:
+            entries (list): (key, png_name) of the snapshots in the master batch
+            since (float, optional): only add the PNG files modified after this time
+
+        Returns:
+            int: the number of snapshots added
+        """
+        n = 0
+        for key, png_name in entries:
+            try:
+                if os.path.getmtime(png_name) < since:
+                    continue # left over from a previous run
+            except OSError:
+                continue
+            self.store(key, png_name)
+            n += 1
+        self.evict()
+        self.commit()
+        return(n)
+
+    def size(self):
+        with self.lock:
+            return(self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0])
+
+    def evict(self, max_size=None):
+        """Remove the least recently used images until the cache fits max_size (MB)
+
+        Returns:
+            int: the number of images removed
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return(0)
+        excess = self.size() - max_size * 1000000
+        n = 0
+        with self.lock:
+            for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+                if excess <= 0:
+                    break
+                try:
+                    os.remove(self.object_name(key))
+                except OSError:
+                    pass
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                excess -= size
+                n += 1
+                self.counts['evicted'] += 1
+                self.counts['evicted_bytes'] += size
+        if n > 0:
+            logging.info("Evicted %d snapshots from the snapshot cache %s" % (n, self.cache_dir))
+        return(n)
+
+    def commit(self):
+        """Commit the index, with the counters of this run"""
+        with self.lock:
+            for name, value in self.counts.items():
+                self.db.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", (name,))
+                self.db.execute("UPDATE counters SET value = value + ? WHERE name = ?", (value, name))
+            self.counts = dict((k, 0) for k in COUNTERS)
+            self.db.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def stats(self):
+        """The size and the counters of the cache, over all the runs
+
+        Returns:
+            dict: entries, size (bytes), max_size (MB), oldest and newest access times, and the COUNTERS
+        """
+        self.commit()
+        with self.lock:
+            entries, size, oldest, newest = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(accessed), MAX(accessed) FROM entries").fetchone()
+            rv = dict((k, 0) for k in COUNTERS)
+            rv.update(self.db.execute("SELECT name, value FROM counters").fetchall())
+        rv.update({'entries': entries, 'size': size, 'max_size': self.max_size, 'oldest': oldest, 'newest': newest})
+        return(rv)
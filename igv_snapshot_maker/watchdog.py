@@ -0,0 +1,102 @@
+"""Kill an IGV process which hangs while rendering a batch script."""
+import os
+import time
+import logging
+import threading
+
+
+def written_since(png_name, since):
+    """Whether a PNG file was written after `since`, with 1 s of slack for the file system clock"""
+    try:
+        return(os.stat(png_name).st_mtime >= since - 1)
+    except OSError:
+        return(False)
+
+
+class Watchdog:
+    """Watch the snapshots of a running batch script, and kill IGV when it hangs
+
+    Two limits are enforced, each one optional:
+
+    + timeout: seconds for the whole batch script
+    + snapshot_timeout: seconds since IGV started or wrote the last snapshot
+
+    IGV writes the snapshots one after another, in the order of the batch
+    script, so only the next expected PNG file is polled. A PNG file counts as
+    written when it is newer than the start of the watch, as the PNG files
+    of an earlier run may still be in the snapshot folder.
+    """
+
+    def __init__(self, png_files=(), timeout=None, snapshot_timeout=None, poll=1.0):
+        """Constructor
+
+        Args:
+            png_files (list, optional): the PNG files expected, in the order of the batch script
+            timeout (float, optional): limit for the whole batch script, in seconds. Defaults to None (no limit).
+            snapshot_timeout (float, optional): limit between two snapshots, in seconds. Defaults to None (no limit).
+            poll (float, optional): seconds between two checks. Defaults to 1.0.
+        """
+        self.png_files = list(png_files)
+        self.timeout = timeout
+        self.snapshot_timeout = snapshot_timeout
+        self.poll = poll
+        self.reason = None # 'timeout' or 'stalled' once IGV was killed
+        self.started = None
+        self.last_progress = None
+        self.next_png = 0
+        self.thread = None
+        self.done = threading.Event()
+
+    def written(self, png_name):
+        return(written_since(png_name, self.started))
+
+    def check(self, now=None):
+        """Check the progress of IGV
+
+        Returns:
+            str: 'timeout' or 'stalled' if IGV must be killed, None otherwise
+        """
+        if now is None:
+            now = time.time()
+        while self.next_png < len(self.png_files) and self.written(self.png_files[self.next_png]):
+            self.next_png += 1
+            self.last_progress = now
+
+        if self.timeout and now - self.started > self.timeout:
+            return('timeout')
+        if self.snapshot_timeout and self.next_png < len(self.png_files) and now - self.last_progress > self.snapshot_timeout:
+            return('stalled')
+        return(None)
+
+    def start(self, kill, now=None):
+        """Start watching, in a daemon thread
+
+        Args:
+            kill (function): called without argument to kill IGV
+        """
+        self.started = self.last_progress = time.time() if now is None else now
+        self.reason = None
+        self.done.clear()
+        self.thread = threading.Thread(target=self._watch, args=(kill,), daemon=True)
+        self.thread.start()
+        return(self)
+
+    def _watch(self, kill):
+        while not self.done.wait(self.poll):
+            reason = self.check()
+            if reason is not None:
+                self.reason = reason
+                logging.error("Kill IGV (%s): %d/%d snapshots written in %.0f s" % (
+                    reason, self.next_png, len(self.png_files), time.time() - self.started))
+                try:
+                    kill()
+                except OSError as exc:
+                    logging.error("Failed to kill IGV: %s" % exc)
+                return
+
+    def stop(self):
+        """Stop watching, once IGV exited"""
+        self.done.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
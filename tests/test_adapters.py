@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""Tests for the readers of the caller tables."""
+
+import pytest
+
+from igv_snapshot_maker.adapters import iter_input, read_tn_samples
+
+
+def write_table(fn, rows, header="header"):
+    with open(str(fn), "w") as out:
+        out.write(header + "\n")
+        for r in rows:
+            out.write("\t".join(str(x) for x in r) + "\n")
+
+
+def intra_row(chrom, start, end, calls, orig="orig"):
+    # chrom start end svaba delly manta gridss meerkat caller_count ... original caller output (col 27)
+    return([chrom, start, end] + calls + [sum(1 for c in calls if c != '0')] + ['x'] * 18 + [orig])
+
+
+def inter_row(chrom, start, end, chrom2, start2, end2, calls):
+    return([chrom, start, end, chrom2, start2, end2] + calls + [sum(1 for c in calls if c != '0'), 'orig'])
+
+
+@pytest.fixture
+def mocca(tmp_path):
+    tn = tmp_path / "pRCC_input_bam.txt"
+    tn.write_text("S1_T01 GPK1_0401.bam GPK1_0421.bam\nS1_T02 GPK1_0402.bam GPK1_0421.bam\nS2_T01 GPK2_0401.bam GPK2_0421.bam\n")
+    d = tmp_path / "compare_and_annotate"
+    d.mkdir()
+    write_table(d / "interchromosomal_SVs_S1_T01", [
+        inter_row('1', 100, 200, '8', 300, 400, ['0', '0', '0', '0', 'orig']),
+        inter_row('2', 100, 200, '9', 300, 400, ['orig', 'orig', '1', '0', '0']),
+    ])
+    write_table(d / "intrachromosomal_SVs_S1_T01", [
+        intra_row('3', 1000, 61000, ['orig', '1', 'orig', 'orig', '0']),
+        intra_row('3', 5000, 6000, ['0', '0', '0', '0', 'orig']),
+    ])
+    return(str(d), str(tn))
+
+
+def test_tn_samples(mocca):
+    assert read_tn_samples(mocca[1], "/bam") == [
+        ('S1', ['/bam/GPK1_0421.bam', '/bam/GPK1_0401.bam', '/bam/GPK1_0402.bam']),
+        ('S2', ['/bam/GPK2_0421.bam', '/bam/GPK2_0401.bam']),
+    ]
+
+
+def test_mocca_meerkat(mocca):
+    groups = list(iter_input(mocca[0], 'mocca', samples=mocca[1], bam_dir="/bam"))
+    assert [g['name'] for g in groups] == ['S1_T01'] # no output for S2
+    assert groups[0]['snapshots'] == [
+        {'name': 'S1_T01_INTER_SV00001_BP1', 'chr': '1', 'start': 100, 'stop': 200, 'ext': 200},
+        {'name': 'S1_T01_INTER_SV00001_BP2', 'chr': '8', 'start': 300, 'stop': 400, 'ext': 200},
+        {'name': 'S1_T01_INTRA_SV00002_BP1', 'chr': '3', 'start': 5000, 'stop': 5000, 'ext': 200},
+        {'name': 'S1_T01_INTRA_SV00002_BP2', 'chr': '3', 'start': 6000, 'stop': 6000, 'ext': 200},
+    ]
+
+
+def test_mocca_nonmeerkat(mocca):
+    groups = list(iter_input(mocca[0], 'mocca-nonmeerkat', samples=mocca[1], bam_dir="/bam"))
+    names = [sp['name'] for sp in groups[0]['snapshots']]
+    # INTER SV00002 is a redundant call; INTRA SV00001 is kept with its overview
+    assert names == ['S1_T01_INTRA_SV00001_BP1', 'S1_T01_INTRA_SV00001_BP2', 'S1_T01_INTRA_SV00001_overview']
+    assert groups[0]['snapshots'][2] == {'name': 'S1_T01_INTRA_SV00001_overview', 'chr': '3', 'start': 1000, 'stop': 61000, 'ext': 10000}
+
+
+def test_mie(tmp_path):
+    manifest = tmp_path / "trios.txt"
+    write_table(manifest, [['t0008c1', 'F', 'SC1'], ['t0008fa', 'M', 'SC2'], ['t0008mo', 'F', 'SC3'],
+                           ['t0010c1', 'F', 'SC4'], ['t0010fa', 'M', 'SC5'], ['t0010mo', 'F', 'SC6']],
+                header="PI_Subject_ID\tSex\tLIMSSample_ID")
+    mie = tmp_path / "mie.txt"
+    write_table(mie, [['1', 2799849, 't0008c1'], ['2', 100, 't0008c1'], ['X', 5, 't0010c1']], header="CHROM\tPOS\tFAMILY")
+
+    groups = list(iter_input(str(mie), 'mie', samples=str(manifest), bam_dir="/bam"))
+    assert [(g['name'], g['bam_files']) for g in groups] == [
+        ('t0008c1', ['/bam/SC2.bam', '/bam/SC3.bam', '/bam/SC1.bam']),
+        ('t0010c1', ['/bam/SC5.bam', '/bam/SC6.bam', '/bam/SC4.bam']),
+    ]
+    assert groups[0]['snapshots'][0] == {'name': 't0008c1_MIE_00001', 'chr': '1', 'start': 2799849, 'stop': 2799849}
+    assert groups[1]['snapshots'][0]['name'] == 't0010c1_MIE_00003'
+
+    # a family with a member missing from the manifest is skipped
+    write_table(mie, [['1', 10, 't0009c1'], ['1', 20, 't0009c1'], ['X', 5, 't0010c1']], header="CHROM\tPOS\tFAMILY")
+    groups = list(iter_input(str(mie), 'mie', samples=str(manifest), bam_dir="/bam"))
+    assert [g['name'] for g in groups] == ['t0010c1']
+    assert [sp['name'] for sp in groups[0]['snapshots']] == ['t0010c1_MIE_00003']
+
+
+def test_bed_and_vcf(tmp_path):
+    bed = tmp_path / "regions.bed"
+    bed.write_text("track name=x\nchr1\t99\t200\tgeneA\nchr2\t0\t10\n")
+    group, = iter_input(str(bed), 'bed', bam_files=['a.bam'])
+    assert group['name'] == 'regions'
+    assert group['snapshots'] == [{'name': 'geneA', 'chr': 'chr1', 'start': 100, 'stop': 200},
+                                  {'name': 'regions_00002', 'chr': 'chr2', 'start': 1, 'stop': 10}]
+
+    vcf = tmp_path / "calls.vcf"
+    vcf.write_text("##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+                   "1\t100\trs1\tACG\tA\t.\tPASS\t.\n2\t500\t.\tN\t<DEL>\t.\tPASS\tSVTYPE=DEL;END=900\n")
+    group, = iter_input(str(vcf), 'vcf', bam_files=['a.bam'], group_name='G')
+    assert group['snapshots'] == [{'name': 'rs1', 'chr': '1', 'start': 100, 'stop': 102},
+                                  {'name': 'G_00002', 'chr': '2', 'start': 500, 'stop': 900}]
+
+    with pytest.raises(ValueError):
+        iter_input(str(vcf), 'vcf')
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""Tests for the batch script IR."""
+
+import os
+
+import pytest
+
+from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.batch import Group_Script, Retry_Script, session_commands, split_bam_files
+
+snapshots = [
+    {'name': 'SV1_BP1', 'chr': '1', 'start': 1000, 'stop': 1100},
+    {'name': 'SV1_BP2', 'chr': 'chr8', 'start': 5000, 'stop': 5000, 'ext': 50},
+]
+
+
+@pytest.fixture
+def script(tmp_path):
+    maker = IGV_Snapshot_Maker(output_dir=str(tmp_path))
+    script = Group_Script(maker, 'G1', ['/data/a.bam'], snapshots, local_bam_files=['/Volumes/a.bam'])
+    for sp in snapshots:
+        script.add_locus(sp)
+    return script
+
+
+def test_master_commands(script):
+    assert script.master_commands() == [
+        'new', 'genome hg19', 'maxPanelHeight 2000',
+        'load /data/a.bam', 'sort base', 'collapse', '',
+        'snapshotDirectory %s' % script.dir_name,
+        'region chr1 1000 1100 SV1_BP1', 'goto 1:900-1200', 'sort base', 'collapse', 'snapshot SV1_BP1.png',
+        'region chr8 5000 5000 SV1_BP2', 'goto chr8:4950-5050', 'sort base', 'collapse', 'snapshot SV1_BP2.png',
+        'exit',
+    ]
+    assert script.png_files == [os.path.join(script.dir_name, 'SV1_BP1.png'), os.path.join(script.dir_name, 'SV1_BP2.png')]
+
+
+def test_pair_commands(script):
+    pair = {'name': 'SV1', 'chr': '1', 'start': 1000, 'stop': 1100, 'mates': snapshots}
+    assert script.locus_commands(script.add_locus(pair)) == [
+        'region chr1 1000 1100 SV1_BP1', 'region chr8 5000 5000 SV1_BP2',
+        'goto 1:900-1200 chr8:4950-5050', 'sort base', 'collapse', 'snapshot SV1.png',
+    ]
+    assert script.png_files[-1] == os.path.join(script.dir_name, 'SV1.png')
+
+
+def test_wide_window_commands(script):
+    split = {'name': 'DEL1', 'chr': '1', 'start': 1000, 'stop': 900000, 'policy': 'split',
+             'flanks': [{'chr': '1', 'start': 1000, 'stop': 1000}, {'chr': '1', 'start': 900000, 'stop': 900000}]}
+    assert script.goto_commands(split) == ['goto 1:900-1100 1:899900-900100', 'sort base', 'collapse']
+    coverage = {'name': 'DEL2', 'chr': '1', 'start': 1000, 'stop': 900000, 'policy': 'coverage'}
+    assert script.goto_commands(coverage) == ['goto 1:900-900100', 'collapse']
+
+    script.add_locus(coverage)
+    assert script.policies == {os.path.join(script.dir_name, 'DEL2.png'): 'coverage'}
+
+
+def test_review_commands(script):
+    assert script.roi_commands()[3] == 'load /Volumes/a.bam'
+    assert script.roi_commands()[-2:] == ['region chr1 1000 1100 SV1_BP1', 'region chr8 5000 5000 SV1_BP2']
+    assert script.snapshot_commands(snapshots[0])[-4:] == ['region chr1 1000 1100 SV1_BP1', 'goto 1:900-1200', 'sort base', 'collapse']
+
+
+def test_write(script):
+    master_bat_fn = script.write(snapshot_scripts=False)
+    assert sorted(os.listdir(script.dir_name)) == ['G1.bat', 'G1_ROIs.bat']
+    assert open(master_bat_fn).read() == "\n".join(script.master_commands()) + "\n"
+
+    script.write()
+    assert sorted(os.listdir(script.dir_name)) == ['G1.bat', 'G1_ROIs.bat', 'SV1_BP1.bat', 'SV1_BP2.bat']
+
+
+def test_session_commands(script, tmp_path):
+    other = Group_Script(script.maker, 'G2', ['/data/a.bam'], snapshots[:1])
+    other.add_locus(snapshots[0])
+    commands = session_commands([script, other])
+    assert commands.count('new') == 1
+    assert commands.count('load /data/a.bam') == 1
+    assert commands[-1] == 'exit' and commands.count('exit') == 1
+    assert commands.index('snapshotDirectory %s' % other.dir_name) > commands.index('snapshot SV1_BP2.png')
+
+    # the groups share a session on the bam files loaded, not on the local paths of the review scripts
+    assert other.session_key == script.session_key == ('/data/a.bam',)
+    assert Group_Script(script.maker, 'G3', ['/other/a.bam'], snapshots, local_bam_files=['/Volumes/a.bam']).session_key != script.session_key
+
+
+def test_retry_script(script):
+    bat_name = script.write(snapshot_scripts=False)
+    retry = Retry_Script(bat_name, [script])
+    assert retry([], 1) is None
+
+    retry_fn = retry([script.png_files[1]], 1)
+    assert retry_fn == os.path.join(script.dir_name, 'G1_retry1.bat')
+    assert open(retry_fn).read().splitlines() == script.master_commands(loci=script.loci[1:])
+
+
+def test_panel_scripts(tmp_path):
+    maker = IGV_Snapshot_Maker(output_dir=str(tmp_path))
+    bams = ['/data/%d.bam' % k for k in range(5)]
+    script = Group_Script(maker, 'G1', bams, snapshots)
+    for sp in snapshots:
+        script.add_locus(sp)
+    assert split_bam_files(bams, 2) == [(0, 3), (3, 5)]
+    assert split_bam_files(bams[:2], 3) == [(0, 1), (1, 2)]
+
+    panels = script.panel_scripts(2)
+    assert [p.bam_files for p in panels] == [bams[:3], bams[3:]]
+    assert panels[1].dir_name == os.path.join(script.dir_name, 'panels', '2')
+    assert panels[1].png_files == [os.path.join(script.dir_name, 'panels', '2', 'SV1_BP%d.png' % k) for k in (1, 2)]
+    bat_name = panels[1].write()
+    assert bat_name == os.path.join(script.dir_name, 'panels', '2', 'G1.bat')
+    commands = open(bat_name).read().splitlines()
+    assert [c for c in commands if c.startswith('load')] == ['load /data/3.bam', 'load /data/4.bam']
+    assert commands[-6:] == ['region chr8 5000 5000 SV1_BP2', 'goto chr8:4950-5050', 'sort base', 'collapse', 'snapshot SV1_BP2.png', 'exit']
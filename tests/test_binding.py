@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""Tests for the bam path rewriting."""
+
+import pytest
+
+from igv_snapshot_maker.binding import Path_Rewriter
+from igv_snapshot_maker.igv_snapshot_maker import update_dir
+
+
+@pytest.mark.parametrize("rule", [
+    ('Mac', '^/data', '/Volumes'),
+    ('Win', '^/', 'T:\\\\'),
+    ('Win', '^/(data)', 'T:\\\\\\1'),
+])
+def test_same_as_update_dir(rule):
+    rewriter = Path_Rewriter([rule])
+    for path in ['/data/DCEG_pRCC_SV/a.bam', '/DCEG/Projects/b.bam']:
+        assert rewriter.rewrite(path) == update_dir(path, *rule)
+
+
+def test_longest_prefix_wins():
+    rewriter = Path_Rewriter([
+        ('Mac', '/data', '/Volumes'),
+        ('Mac', '/data/DCEG_pRCC_SV', '/Volumes/pRCC'),
+        ('Win', '/DCEG', 'T:\\\\DCEG'),
+    ])
+    assert len(rewriter) == 3
+    assert rewriter.rewrite('/data/x/a.bam') == '/Volumes/x/a.bam'
+    assert rewriter.rewrite('/data/DCEG_pRCC_SV/a.bam') == '/Volumes/pRCC/a.bam'
+    assert rewriter.rewrite('/DCEG/Projects/a.bam') == 'T:\\DCEG\\Projects\\a.bam'
+    # literal prefixes only match at the start
+    assert rewriter.rewrite('/home/data/a.bam') == '/home/data/a.bam'
+
+
+def test_regex_opt_in():
+    assert Path_Rewriter([('Mac', '/data', '/Volumes')], regex=True).rewrite('/home/data/a.bam') == '/home/Volumes/a.bam'
+    assert Path_Rewriter([('Mac', '[a-z]+_old', 'new')]).rewrite('/x/bam_old/a.bam') == '/x/new/a.bam'
+
+
+def test_memoized():
+    rewriter = Path_Rewriter([('Mac', '^/data', '/Volumes')])
+    assert rewriter.rewrite_all(['/data/a.bam', '/data/a.bam']) == ['/Volumes/a.bam', '/Volumes/a.bam']
+    assert rewriter.cache == {'/data/a.bam': '/Volumes/a.bam'}
+
+
+def test_no_rules():
+    assert Path_Rewriter().rewrite('/data//a.bam') == '/data//a.bam'
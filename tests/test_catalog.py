@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""Tests for the snapshot catalog."""
+
+import os
+
+import pytest
+
+from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.batch import Group_Script
+from igv_snapshot_maker.catalog import Snapshot_Catalog, parse_region
+
+snapshots = [
+    {'name': 'SV1_BP1', 'chr': '1', 'start': 1000, 'stop': 1100},
+    {'name': 'SV1_BP2', 'chr': 'chr8', 'start': 33600000, 'stop': 33600000, 'ext': 50},
+    {'name': 'SV2_BP1', 'chr': '8', 'start': 33900000, 'stop': 33900100},
+]
+
+
+def test_parse_region():
+    assert parse_region("chr8:33500000-33800000") == ("chr8", 33500000, 33800000)
+    assert parse_region("8:33,500,000-33,800,000") == ("8", 33500000, 33800000)
+    assert parse_region("chr8:33.5-33.8Mb") == ("chr8", 33500000, 33800000)
+    assert parse_region("chrX:150k") == ("chrX", 150000, 150000)
+    assert parse_region("chr8") == ("chr8", None, None)
+    with pytest.raises(ValueError):
+        parse_region("chr8:200-100")
+
+
+def test_catalog(tmp_path):
+    maker = IGV_Snapshot_Maker(output_dir=str(tmp_path))
+    script = Group_Script(maker, 'G1', ['/data/a.bam'], snapshots)
+    pair = {'name': 'SV1', 'chr': '1', 'start': 1000, 'stop': 1100, 'mates': snapshots[:2]}
+    script.add_locus(pair)
+    script.add_locus(snapshots[2])
+
+    catalog = Snapshot_Catalog(str(tmp_path))
+    catalog.add_script(script)
+    rows = catalog.query("chr8", 33500000, 33800000)
+    assert [(r['snapshot'], r['window'], r['status']) for r in rows] == [('SV1', '8:33599950-33600050', 'planned')]
+    assert rows[0]['png'] == script.png_name(pair) and rows[0]['bam_files'] == ['/data/a.bam']
+    assert [r['snapshot'] for r in catalog.query("8")] == ['SV1', 'SV2_BP1']
+    assert catalog.query("1", 2000, 3000) == []
+    assert [r['snapshot'] for r in catalog.query("1", 1200)] == ['SV1']
+
+    png_name = script.png_name(snapshots[2])
+    catalog.update_results([{'snapshots': [{'png': png_name, 'status': 'rendered', 'png_size': 1234, 'total_s': 2.5}]}])
+    assert [(r['status'], r['png_size'], r['render_s']) for r in catalog.query("8", 33900000)] == [('rendered', 1234, 2.5)]
+
+    # a snapshot is replaced on the next run, and the catalogs of the shards are merged
+    catalog.add_script(script, status='planned')
+    catalog.close()
+    other = Snapshot_Catalog(str(tmp_path / "merged"), db_name=str(tmp_path / "merged.sqlite"))
+    assert other.merge(os.path.join(str(tmp_path), "snapshot_catalog.sqlite")) == 2
+    assert [r['snapshot'] for r in other.query("chr8", 33000000, 34000000)] == ['SV1', 'SV2_BP1']
+    other.close()
+
+
+def test_many_snapshots(tmp_path):
+    catalog = Snapshot_Catalog(str(tmp_path))
+    for k in range(5000):
+        sp = {'name': 'S%05d' % k, 'chr': str(k % 22 + 1), 'start': k * 10000, 'stop': k * 10000 + 100}
+        catalog.add('G', sp, [(sp['chr'], sp['start'] - 100, sp['stop'] + 100)], [], "S%05d.png" % k)
+    catalog.commit()
+    rows = catalog.query("8", 33500000, 33800000)
+    assert all(33500000 <= int(r['snapshot'][1:]) * 10000 + 200 and int(r['snapshot'][1:]) * 10000 - 100 <= 33800000 for r in rows)
+    assert len(rows) == len([k for k in range(5000) if k % 22 == 7 and 3350 <= k <= 3380])
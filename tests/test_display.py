@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Tests for the Xvfb display pool, with a fake Xvfb."""
+
+import os
+import sys
+import stat
+
+import pytest
+
+from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.display import screen_size, batch_screen_size, Display_Pool, MAX_SCREEN
+
+# Writes the next free display number to -displayfd, creates its socket and waits
+FAKE_XVFB = """#!%s
+import os, sys, time, signal
+args = sys.argv[1:]
+fd = int(args[args.index("-displayfd") + 1])
+socket_dir = os.environ["FAKE_X11_DIR"]
+n = 100
+while os.path.exists(os.path.join(socket_dir, "X%%d" %% n)):
+    n += 1
+sock = os.path.join(socket_dir, "X%%d" %% n)
+open(sock, "w").close()
+signal.signal(signal.SIGTERM, lambda *a: (os.remove(sock), sys.exit(0)))
+os.write(fd, b"%%d\\n" %% n)
+os.close(fd)
+while True:
+    time.sleep(1)
+""" % sys.executable
+
+
+@pytest.fixture
+def fake_xvfb(tmp_path, monkeypatch):
+    socket_dir = tmp_path / "x11"
+    socket_dir.mkdir()
+    monkeypatch.setenv("FAKE_X11_DIR", str(socket_dir))
+    xvfb = tmp_path / "Xvfb"
+    xvfb.write_text(FAKE_XVFB)
+    xvfb.chmod(xvfb.stat().st_mode | stat.S_IEXEC)
+    return(str(xvfb), str(socket_dir))
+
+
+def test_screen_size(tmp_path):
+    assert screen_size(1) == "3200x800x24"
+    assert screen_size(4) == "3200x1600x24"
+    assert screen_size(40) == "3200x2400x24"
+    # the snapshots are as wide as with the screen of xvfb-run
+    assert "-screen 0 %s\"" % MAX_SCREEN in IGV_Snapshot_Maker().xvfb_cmd
+    bat = tmp_path / "G.bat"
+    bat.write_text("new\ngenome hg19\nmaxPanelHeight 500\nload a\nload b\n\nsnapshotDirectory /x\nload c\n")
+    assert batch_screen_size(str(bat)) == "3200x1200x24"
+
+
+def test_display_pool(fake_xvfb):
+    xvfb_cmd, socket_dir = fake_xvfb
+    pool = Display_Pool(size=2, xvfb_cmd=xvfb_cmd, socket_dir=socket_dir).start()
+    try:
+        a = pool.acquire()
+        b = pool.acquire("3200x1600x24")
+        assert a.name != b.name
+        assert b.screen == "3200x1600x24" # restarted with the larger screen
+        assert b.env()['DISPLAY'] == b.name
+        pool.release(a)
+
+        a.process.kill() # fails the health check
+        a.process.wait()
+        c = pool.acquire()
+        assert c is a and c.is_alive()
+    finally:
+        pool.close()
+    assert all(d.process is None for d in pool.displays)
+    assert os.listdir(socket_dir) == ["X100"] # left behind by the killed server
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""Tests for the genome cache."""
+
+import os
+import json
+import threading
+
+from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.genome_cache import Genome_Cache, MANIFEST_NAME
+
+
+def write_genome(folder):
+    """A JSON genome definition with relative paths to its files"""
+    refs = folder / "refs"
+    (refs / "annotations").mkdir(parents=True)
+    (refs / "mini.fa").write_text(">chr1\nACGTACGTAC\n")
+    (refs / "mini.fa.fai").write_text("chr1\t10\t6\t10\t11\n")
+    (refs / "cytoBand.txt").write_text("chr1\t0\t10\tp11\tgneg\n")
+    (refs / "annotations" / "genes.bed").write_text("chr1\t1\t5\tGENE1\n")
+    definition = {'id': 'mini', 'name': 'Mini', 'fastaURL': 'mini.fa', 'cytobandURL': 'cytoBand.txt',
+                  'tracks': [{'name': 'Genes', 'format': 'bed', 'url': 'annotations/genes.bed'}]}
+    (refs / "mini.json").write_text(json.dumps(definition))
+    return(str(refs / "mini.json"))
+
+
+def test_stage(tmp_path):
+    source = write_genome(tmp_path)
+    cache = Genome_Cache(str(tmp_path / "cache"))
+    fn = cache.ensure('mini', source=source)
+    genome_dir = str(tmp_path / "cache" / "mini")
+    assert fn == os.path.join(genome_dir, "mini.json")
+
+    with open(fn) as fin:
+        definition = json.load(fin)
+    # the index is staged next to the FASTA file, though not named in the definition
+    assert definition['fastaURL'] == os.path.join(genome_dir, "mini.fa")
+    assert definition['indexURL'] == os.path.join(genome_dir, "mini.fa.fai")
+    assert definition['cytobandURL'] == os.path.join(genome_dir, "cytoBand.txt")
+    assert definition['tracks'][0]['url'] == os.path.join(genome_dir, "genes.bed")
+
+    manifest = cache.read_manifest('mini')
+    assert sorted(manifest['files']) == ['cytoBand.txt', 'genes.bed', 'mini.fa', 'mini.fa.fai', 'mini.json']
+    assert manifest['files']['mini.fa']['size'] == 17
+    assert [m['genome'] for m in cache.list()] == ['mini']
+    assert cache.verify('mini') == []
+    assert not any(name.startswith(".mini") for name in os.listdir(str(tmp_path / "cache")))
+
+    # the batch scripts load the cached definition, the review scripts the genome ID
+    maker = IGV_Snapshot_Maker(refgenome='mini', output_dir=str(tmp_path / "out"))
+    maker.set_genome_file(fn)
+    assert maker.header_commands()[1] == "genome %s" % fn
+    assert maker.header_commands(review=True)[1] == "genome mini"
+
+
+def test_damaged_genome(tmp_path):
+    source = write_genome(tmp_path)
+    cache = Genome_Cache(str(tmp_path / "cache"))
+    fn = cache.ensure('mini', source=source)
+    fasta = str(tmp_path / "cache" / "mini" / "mini.fa")
+
+    # same size, different content: only found by the full check
+    with open(fasta, "w") as out:
+        out.write(">chr1\nTTTTTTTTTT\n")
+    assert cache.verify('mini', full=False) == []
+    assert cache.verify('mini') == ["mini.fa does not match its SHA-256 digest"]
+
+    # truncated: staged again
+    with open(fasta, "w") as out:
+        out.write(">chr1\n")
+    assert cache.verify('mini', full=False) == ["mini.fa has 6 bytes rather than 17"]
+    assert cache.ensure('mini', source=source) == fn
+    assert cache.verify('mini') == []
+
+    os.remove(os.path.join(str(tmp_path / "cache" / "mini"), MANIFEST_NAME))
+    assert cache.verify('mini') == ["mini is not in the cache"]
+
+
+def test_concurrent_ensure(tmp_path, monkeypatch):
+    source = write_genome(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    staged = []
+    _stage = Genome_Cache._stage
+    monkeypatch.setattr(Genome_Cache, '_stage', lambda self, genome, source: staged.append(genome) or _stage(self, genome, source))
+
+    # one cache object per worker, sharing only the lock file
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(Genome_Cache(cache_dir).ensure('mini', source=source))) for k in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 5 and len(set(results)) == 1
+    assert staged == ['mini']
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""Tests for the IGV batch port engine, against the mock IGV port server."""
+
+import os
+
+import pytest
+
+from igv_snapshot_maker.igv_port import IGV_Port_Client, IGV_Session, IGV_Session_Pool, read_batch_commands
+from igv_snapshot_maker.mock_igv import Mock_IGV_Server
+
+batch = """\
+new
+genome hg19
+maxPanelHeight 2000
+load a.bam
+sort base
+collapse
+
+snapshotDirectory %s
+region chr1 100 200 SV1
+goto 1:0-300
+sort base
+collapse
+snapshot SV1.png
+exit
+"""
+
+
+@pytest.fixture
+def server():
+    srv = Mock_IGV_Server(port=0).start()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture
+def bat_name(tmp_path):
+    fn = tmp_path / "group.bat"
+    fn.write_text(batch % tmp_path)
+    return str(fn)
+
+
+def test_read_batch_commands(bat_name):
+    commands = read_batch_commands(bat_name)
+    assert commands[0] == "new"
+    assert commands[-1] == "snapshot SV1.png"
+    assert "exit" not in commands
+    assert "" not in commands
+
+
+def test_client_waits_for_reply(server):
+    client = IGV_Port_Client(port=server.port, timeout=5)
+    client.connect()
+    assert client.send("echo") == "echo"
+    assert client.send("goto 1:1-100") == "OK"
+    client.close()
+    assert server.commands == ["echo", "goto 1:1-100"]
+
+
+def test_session_runs_batch(server, bat_name, tmp_path):
+    session = IGV_Session(port=server.port, launch=False, timeout=5)
+    session.start()
+    assert session.run_batch(bat_name) == 0
+    assert (tmp_path / "SV1.png").is_file()
+
+    # the genome is loaded once for the whole session
+    assert session.run_batch(bat_name) == 0
+    assert server.commands.count("genome hg19") == 1
+    assert server.commands.count("snapshot SV1.png") == 2
+    session.stop()
+
+
+def test_session_reports_errors(bat_name):
+    srv = Mock_IGV_Server(port=0, fail_on=['load']).start()
+    session = IGV_Session(port=srv.port, launch=False, timeout=5)
+    session.start()
+    assert session.run_batch(bat_name) == 1
+    session.stop()
+    srv.stop()
+
+
+def test_session_pool(server, bat_name, tmp_path):
+    pool = IGV_Session_Pool(size=1, base_port=server.port, launch=False, timeout=5)
+    assert pool.call_igv(bat_name) == 0
+    assert pool.call_igv(bat_name) == 0
+    pool.close()
+    assert os.path.isfile(str(tmp_path / "SV1.png"))
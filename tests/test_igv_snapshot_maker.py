@@ -4,21 +4,25 @@
 
 import pytest
 import os
-from pathlib import Path
 
 from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
 
 default_batch="""\
 new
 genome hg19
+maxPanelHeight 2000
 """ 
 
 default_batch_load="""\
 new
 genome hg19
+maxPanelHeight 2000
 load a
 load b
 load c
+sort base
+collapse
+
 """ 
 
 
@@ -43,15 +47,39 @@ def test_fix_name(my_maker):
     assert my_maker.fix_name("2:1000:A:CT") == "2_1000_A_CT"
 
 def test_goto(my_maker):
-    assert my_maker.get_goto('3', 1000, 2000) == "goto 3:901-1101"
+    assert my_maker.get_goto('3', 1000, 2000) == "goto 3:900-2100"
 
-def test_generate_batch_file(my_maker):
+def test_create_batch_file(tmp_path):
+    my_maker = IGV_Snapshot_Maker(output_dir=str(tmp_path / "IGV_Snapshots"))
     my_maker.load_bams(['a', 'b','c'])
-    batch_fn = my_maker.generate_batch_file("GENE", '2:1000:A:CT', 2, 999, 1000)
+    batch_fn = my_maker.create_batch_file("GENE", '2:1000:A:CT')
+    my_maker.goto('2:1000:A:CT', 2, 999, 1000)
+    my_maker.close_batch_file()
 
-    snap_dir = Path("./IGV_Snapshots/GENE").absolute()
+    snap_dir = (tmp_path / "IGV_Snapshots" / "GENE").absolute()
 
     assert snap_dir.is_dir()
     assert str(batch_fn) == str(snap_dir/'2_1000_A_CT.bat')
     assert (snap_dir/'2_1000_A_CT.bat').is_file()
-     
\ No newline at end of file
+     
+
+def test_merge_batch_files(tmp_path):
+    from igv_snapshot_maker.igv_snapshot_maker import merge_batch_files
+
+    bat_names = []
+    for g in ['G1', 'G2']:
+        maker = IGV_Snapshot_Maker(output_dir=str(tmp_path))
+        maker.load_bams(['a', 'b'])
+        bat_names.append(maker.create_batch_file(g, g))
+        maker.goto(g + '_SV', '1', 1000, 1100)
+        maker.close_batch_file(exit=True)
+
+    merged = merge_batch_files(str(tmp_path / 'session.bat'), bat_names)
+    lines = open(merged).read().splitlines()
+    assert lines.count('new') == 1
+    assert lines.count('load a') == 1
+    assert lines.count('exit') == 1
+    assert lines[-1] == 'exit'
+    assert 'snapshotDirectory %s' % (tmp_path / 'G1') in lines
+    assert 'snapshotDirectory %s' % (tmp_path / 'G2') in lines
+    assert lines.index('snapshot G2_SV.png') > lines.index('snapshotDirectory %s' % (tmp_path / 'G2'))
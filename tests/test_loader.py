@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Tests for the incremental YAML loader."""
+
+import io
+import os
+
+import pytest
+import yaml
+
+from igv_snapshot_maker.loader import iter_groups, _load_item
+
+FILES = os.path.join(os.path.dirname(__file__), os.pardir, "files")
+
+
+@pytest.mark.parametrize("fn", [
+    os.path.join(FILES, "input.yaml"),
+    os.path.join(FILES, "pRCC_SV.yaml"),
+    os.path.join(os.path.dirname(__file__), "my.yaml"),
+])
+def test_same_as_safe_load(fn):
+    with open(fn) as stream:
+        expected = yaml.safe_load(stream)
+    assert list(iter_groups(fn)) == expected
+
+
+def test_first_group_before_the_rest_is_parsed():
+    text = """\
+---
+- name: g1
+  snapshots: []
+- name: g2
+  snapshots: [unclosed
+"""
+    groups = iter_groups(io.StringIO(text))
+    assert next(groups)['name'] == 'g1'
+    with pytest.raises(yaml.YAMLError):
+        next(groups)
+
+
+def test_flow_sequence_fallback():
+    groups = iter_groups(io.StringIO("[{name: g1}, {name: g2}]\n"))
+    assert [g['name'] for g in groups] == ['g1', 'g2']
+
+
+def test_alias_to_an_earlier_group():
+    groups = [{'name': 'g%d' % k, 'bam_files': None} for k in range(3)]
+    bams = ['a.bam', 'b.bam']
+    for g in groups:
+        g['bam_files'] = bams # written as an anchor and aliases by the dumper
+    text = yaml.safe_dump(groups)
+    assert '*' in text
+    assert list(iter_groups(io.StringIO(text))) == groups
+
+
+def test_anchor_tokens():
+    text = """\
+- name: g1
+  bam_files: &bams [/data/R&D/a.bam, /data/b*.bam]
+- name: g*2
+  bam_files: [/data/R&D/c.bam]
+- name: g3
+  bam_files: *bams
+"""
+    groups = list(iter_groups(io.StringIO(text)))
+    assert groups == yaml.safe_load(text)
+    assert groups[2]['bam_files'] == ['/data/R&D/a.bam', '/data/b*.bam']
+
+    # only the nodes of the anchors are kept
+    anchors = {}
+    assert _load_item(text.splitlines(True)[:2], anchors) == groups[:1]
+    assert list(anchors) == ['bams']
+    assert _load_item(text.splitlines(True)[4:], anchors) == groups[2:]
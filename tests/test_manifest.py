@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""Tests for the checkpoint manifest."""
+
+import os
+import time
+
+from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.manifest import Snapshot_Manifest, snapshot_digest
+
+sp = {'name': 'SV1_BP1', 'chr': '1', 'start': 1000, 'stop': 1100}
+
+
+def test_digest_tracks_the_inputs():
+    maker = IGV_Snapshot_Maker()
+    digest = snapshot_digest(maker, ['a.bam'], sp)
+    assert digest == snapshot_digest(maker, ['a.bam'], dict(sp))
+    assert digest != snapshot_digest(maker, ['a.bam', 'b.bam'], sp)
+    assert digest != snapshot_digest(maker, ['a.bam'], dict(sp, ext=200))
+    assert digest != snapshot_digest(IGV_Snapshot_Maker(refgenome='hg38'), ['a.bam'], sp)
+
+
+def test_resume_from_manifest(tmp_path):
+    png_name = str(tmp_path / 'SV1_BP1.png')
+    stale_png = str(tmp_path / 'SV2_BP1.png')
+    open(stale_png, 'w').close()
+    os.utime(stale_png, (0, 0))
+
+    manifest = Snapshot_Manifest(str(tmp_path))
+    t0 = time.time() - 1
+    open(png_name, 'w').write('png')
+    n = manifest.record_group('G', [('SV1_BP1', 'd1', png_name), ('SV2_BP1', 'd2', stale_png), ('SV3', 'd3', 'missing.png')], since=t0)
+    assert n == 1
+
+    # reload from the file
+    manifest = Snapshot_Manifest(str(tmp_path))
+    assert manifest.is_done('G', 'SV1_BP1', 'd1', png_name)
+    assert not manifest.is_done('G', 'SV1_BP1', 'changed', png_name)
+    assert not manifest.is_done('G', 'SV2_BP1', 'd2', stale_png)
+
+    open(png_name, 'w').close() # truncated by a crash
+    assert not manifest.is_done('G', 'SV1_BP1', 'd1', png_name)
+
+
+def test_one_append_handle(tmp_path):
+    manifest = Snapshot_Manifest(str(tmp_path))
+    for k in range(3):
+        png_name = str(tmp_path / ('SV%d.png' % k))
+        open(png_name, 'w').write('png')
+        manifest.record_group('G%d' % k, [('SV%d' % k, 'd', png_name)])
+        if k == 0:
+            out = manifest.out
+        assert manifest.out is out
+        # flushed at the end of each group
+        assert len(open(manifest.fn).read().splitlines()) == k + 1
+    manifest.close()
+    assert out.closed
+    assert len(Snapshot_Manifest(str(tmp_path)).records) == 3
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""Tests for the Java heap sizing and the memory admission control."""
+
+import os
+import time
+import threading
+
+from igv_snapshot_maker.memory import heap_size, batch_heap_size, java_env, available_memory, workers_memory, Memory_Admission
+from igv_snapshot_maker.runner import IGV_Worker_Pool
+
+
+def test_heap_size():
+    assert heap_size(1, 1000) == 1280
+    assert heap_size(15, 1000) == 3328
+    assert heap_size(15, 300000) == 5632
+    assert heap_size(15, 300000, max_heap=4000) == 4000
+
+
+def test_batch_heap_size(tmp_path):
+    bat = tmp_path / "G.bat"
+    bat.write_text("new\ngenome hg19\nload /a.bam\nload /b.bam\nsnapshotDirectory /out\n"
+                   "goto 1:900-1200\nsnapshot A.png\ngoto 1:900-100900 8:4950-5050\nsnapshot B.png\nexit\n")
+    assert batch_heap_size(str(bat)) == heap_size(2, 100001 + 101)
+
+
+def test_java_env():
+    assert java_env(2048, {})['_JAVA_OPTIONS'] == "-Xmx2048m"
+    assert java_env(2048, {'_JAVA_OPTIONS': "-Xmx8g -Djava.awt.headless=true"})['_JAVA_OPTIONS'] == "-Xmx8g -Djava.awt.headless=true -Xmx2048m"
+
+
+def test_available_memory(tmp_path):
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text("MemTotal:       16384000 kB\nMemFree:         1024000 kB\nMemAvailable:    8192000 kB\n")
+    assert available_memory(str(meminfo)) == 8000
+    assert available_memory(str(tmp_path / "none")) is None
+
+
+def test_admission():
+    free = [5000]
+    admission = Memory_Admission(available=lambda: free[0], poll=0.01)
+    # the first worker always starts, the second one waits for the memory
+    admission.acquire(6000)
+    started = []
+    t = threading.Thread(target=lambda: started.append(admission.acquire(3000)))
+    t.start()
+    time.sleep(0.1)
+    assert started == []
+    free[0] = 9500
+    t.join(2)
+    assert len(started) == 1 and admission.reserved == 9000
+    admission.release(6000)
+    admission.release(3000)
+    assert admission.running == 0
+
+
+
+def test_admission_used_memory():
+    # the running worker already uses 5000 MB of its 6000 MB heap, which are not available anymore
+    admission = Memory_Admission(available=lambda: 4000, used=lambda: 5000, poll=0.01)
+    admission.acquire(6000)
+    assert admission.acquire(3000) < 0.05
+    assert not admission.fits(3001)
+
+
+def test_workers_memory(tmp_path):
+    page_mb = os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024)
+    pages = int(1000 / page_mb)
+    # 1 <- 10 (xvfb-run) <- 11 (java), 1 <- 12 (java, in another process tree)
+    for pid, comm, ppid in [(10, "xvfb-run", 1), (11, "java", 10), (12, "java", 2)]:
+        os.makedirs(str(tmp_path / str(pid)))
+        (tmp_path / str(pid) / "stat").write_text("%d (%s) S %d %s %d 0\n" % (pid, comm, ppid, " ".join(["0"] * 19), pages))
+    (tmp_path / "self").mkdir()
+    assert workers_memory(proc=str(tmp_path), root=1) == int(pages * page_mb)
+    assert workers_memory(proc=str(tmp_path / "none")) is None
+
+
+class HeapMaker:
+    def __init__(self):
+        self.heaps = []
+
+    def call_igv(self, bat_name, timer=None, heap=None):
+        self.heaps.append(heap)
+        return(1) # crash, e.g. out of memory
+
+
+def test_pool_heap(tmp_path):
+    bat = tmp_path / "G.bat"
+    bat.write_text("load /a.bam\ngoto 1:900-1200\nsnapshot A.png\n")
+    retry = tmp_path / "G_retry.bat"
+    retry.write_text(bat.read_text())
+    maker = HeapMaker()
+    pool = IGV_Worker_Pool(maker, retries=2, max_heap=3000, admission=Memory_Admission(available=lambda: None))
+    pool.submit('G', str(bat), [str(tmp_path / "A.png")], retry=lambda missing, attempt: str(retry))
+    result = pool.wait()[0]
+    # the heap is raised after each crash, up to max_heap
+    assert maker.heaps == [1280, 2560, 3000]
+    assert result['heap_mb'] == 3000
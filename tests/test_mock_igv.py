@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+
+"""Tests for `igv_snapshot_maker.mock_igv`, the fake IGV executable."""
+
+from igv_snapshot_maker.mock_igv import run_batch, main
+
+
+def test_run_batch(tmp_path, capsys):
+    bat = tmp_path / "GENE.bat"
+    bat.write_text("new\ngenome hg19\n\nsnapshotDirectory %s\ngoto 1:100-200\nsnapshot A.png\nexit\nsnapshot B.png\n" % tmp_path)
+    assert run_batch(str(bat)) == 0
+
+    assert (tmp_path / "A.png").is_file()
+    assert not (tmp_path / "B.png").exists()
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].endswith("Executing Command: new")
+    assert out[-1].endswith("Executing Command: exit")
+
+
+def test_main_ignores_igv_options(tmp_path):
+    bat = tmp_path / "GENE.bat"
+    bat.write_text("snapshotDirectory %s\nsnapshot A.png\n" % tmp_path)
+    assert main(["-m", "20g", "-b", str(bat)]) == 0
+    assert (tmp_path / "A.png").is_file()
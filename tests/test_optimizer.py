@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""Tests for the batch script optimizer."""
+
+from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.batch import Group_Script, Retry_Script, session_commands
+from igv_snapshot_maker.optimizer import Script_Optimizer, optimize_commands
+
+config = {'track_setting': "viewaspairs\ncollapse\ncolorBy UNEXPECTED_PAIR\ngroup PAIR_ORIENTATION\nsort insertsize\n"}
+
+snapshots = [
+    {'name': 'SV1_BP1', 'chr': '1', 'start': 1000, 'stop': 1100},
+    {'name': 'SV1_BP2', 'chr': '8', 'start': 5000, 'stop': 5000, 'ext': 50},
+]
+
+
+def test_track_state():
+    commands, removed = optimize_commands([
+        'new', 'genome hg19', 'load a.bam', 'sort base', 'collapse', '',
+        'goto 1:900-1200', 'sort base', 'collapse', 'snapshot A.png',
+        'goto 8:4950-5050', 'sort base', 'sort base', 'collapse', 'snapshot B.png',
+        'expand', 'sort base', 'snapshot C.png',
+    ])
+    assert commands == [
+        'new', 'genome hg19', 'load a.bam', 'collapse',
+        'goto 1:900-1200', 'sort base', 'snapshot A.png',
+        'goto 8:4950-5050', 'sort base', 'snapshot B.png',
+        # a new display mode lays out the alignments again, so they are sorted again
+        'expand', 'sort base', 'snapshot C.png',
+    ]
+    assert removed == {'sort': 2, 'collapse': 2}
+
+
+def test_locus_and_regions():
+    commands, removed = optimize_commands([
+        'snapshotDirectory /out/G1', 'region chr1 1000 1100 SV1', 'goto 1:900-1200', 'sort base', 'snapshot SV1.png',
+        'snapshotDirectory /out/G1', 'region chr1 1000 1100 SV1', 'goto 1:900-1200', 'sort base', 'snapshot SV1_copy.png',
+        'sort strand', 'snapshotDirectory /out/G2', 'snapshot SV1_strand.png',
+    ])
+    assert commands == [
+        'snapshotDirectory /out/G1', 'region chr1 1000 1100 SV1', 'goto 1:900-1200', 'sort base', 'snapshot SV1.png',
+        'snapshot SV1_copy.png',
+        'sort strand', 'snapshotDirectory /out/G2', 'snapshot SV1_strand.png',
+    ]
+    assert removed == {'snapshotdirectory': 1, 'region': 1, 'goto': 1, 'sort': 1}
+
+
+def test_resets():
+    commands, removed = optimize_commands([
+        'load a.bam', 'collapse', 'viewaspairs a.bam true', 'goto 1:1-100', 'snapshot A.png',
+        # the new track starts with the default setting
+        'load b.bam', 'collapse', 'viewaspairs a.bam false', 'viewaspairs a.bam false', 'goto 1:1-100', 'snapshot B.png',
+        # a display mode of one track, then of all the tracks
+        'squish b.bam', 'collapse', 'collapse', 'snapshot C.png',
+        'squish b.bam', 'squish b.bam', 'snapshot D.png',
+        'new', 'collapse', 'region chr1 1 100', 'region chr1 1 100',
+    ])
+    assert commands == [
+        'load a.bam', 'collapse', 'viewaspairs a.bam true', 'goto 1:1-100', 'snapshot A.png',
+        'load b.bam', 'collapse', 'viewaspairs a.bam false', 'snapshot B.png',
+        'squish b.bam', 'collapse', 'snapshot C.png',
+        'squish b.bam', 'snapshot D.png',
+        'new', 'collapse', 'region chr1 1 100',
+    ]
+    assert removed == {'viewaspairs': 1, 'goto': 1, 'collapse': 1, 'squish': 1, 'region': 1}
+
+
+def test_master_script(tmp_path):
+    maker = IGV_Snapshot_Maker(output_dir=str(tmp_path), config=config)
+    optimizer = Script_Optimizer()
+    maker.set_optimizer(optimizer)
+    script = Group_Script(maker, 'G1', ['/data/a.bam', '/data/b.bam'], snapshots)
+    for sp in snapshots:
+        script.add_locus(sp)
+    bat_name = script.write(snapshot_scripts=False)
+    assert open(bat_name).read().splitlines() == [
+        'new', 'genome hg19', 'maxPanelHeight 2000',
+        'load /data/a.bam', 'load /data/b.bam',
+        'viewaspairs', 'collapse', 'colorBy UNEXPECTED_PAIR', 'group PAIR_ORIENTATION',
+        'snapshotDirectory %s' % script.dir_name,
+        'region chr1 1000 1100 SV1_BP1', 'goto 1:900-1200', 'sort insertsize', 'snapshot SV1_BP1.png',
+        'region chr8 5000 5000 SV1_BP2', 'goto 8:4950-5050', 'sort insertsize', 'snapshot SV1_BP2.png',
+        'exit',
+    ]
+    # the review scripts are left as they are
+    roi_commands = open(script.bat_name('G1_ROIs')).read().splitlines()
+    assert roi_commands.count('sort insertsize') == 1
+
+    retry_fn = Retry_Script(bat_name, [script])([script.png_files[1]], 1)
+    assert open(retry_fn).read().splitlines()[-6:] == [
+        'snapshotDirectory %s' % script.dir_name,
+        'region chr8 5000 5000 SV1_BP2', 'goto 8:4950-5050', 'sort insertsize', 'snapshot SV1_BP2.png', 'exit']
+
+    other = Group_Script(maker, 'G2', script.bam_files, snapshots[:1])
+    other.add_locus(snapshots[0])
+    commands = session_commands([script, other])
+    # the region of G2 is already marked in the session
+    assert commands[-5:] == ['snapshotDirectory %s' % other.dir_name, 'goto 1:900-1200', 'sort insertsize', 'snapshot SV1_BP1.png', 'exit']
+    assert commands.count('region chr1 1000 1100 SV1_BP1') == 1
+
+    # the 4 track settings after each of the 6 gotos, and the sort after the loads of each of the 3 scripts
+    assert optimizer.scripts == 3
+    assert optimizer.removed == {'viewaspairs': 6, 'collapse': 6, 'colorby': 6, 'group': 6, 'sort': 3, 'region': 1}
+    report_fn = str(tmp_path / "script_optimizer.tsv")
+    optimizer.write_report(report_fn)
+    lines = open(report_fn).read().splitlines()
+    assert lines[0].split("\t") == ['command', 'kept', 'removed']
+    assert "sort\t6\t3" in lines
+    assert optimizer.summary().startswith("Removed 28 of ")
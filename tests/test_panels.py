@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""Tests for the panel shards of a group."""
+
+import os
+import time
+
+from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.batch import Group_Script
+from igv_snapshot_maker.mock_igv import write_png
+from igv_snapshot_maker.panels import Panel_Join
+from igv_snapshot_maker.postprocess import read_chunks
+
+snapshots = [
+    {'name': 'SV1_BP1', 'chr': '1', 'start': 1000, 'stop': 1100},
+    {'name': 'SV1_BP2', 'chr': '8', 'start': 5000, 'stop': 5000},
+]
+
+
+def test_panel_join(tmp_path):
+    maker = IGV_Snapshot_Maker(output_dir=str(tmp_path))
+    script = Group_Script(maker, 'G1', ['/data/%d.bam' % k for k in range(6)], snapshots)
+    for sp in snapshots:
+        script.add_locus(sp)
+    panels = script.panel_scripts(3)
+    results = []
+    join = Panel_Join(script, panels, callback=results.append)
+
+    started = time.time()
+    for panel in panels:
+        os.makedirs(panel.dir_name)
+        for k, png_name in enumerate(panel.png_files):
+            # the second snapshot is missing from the last panel
+            if panel.index < 3 or k == 0:
+                write_png(png_name, width=20, height=10 * panel.index)
+        assert results == []
+        join.done({'group': '%s.panel%d' % (script.name, panel.index), 'started': started})
+
+    assert len(results) == 1 and results[0] is join.result
+    assert (join.result['status'], join.result['expected'], join.result['rendered']) == ('failed', 2, 1)
+    assert [(r['snapshot'], r['status']) for r in join.result['snapshots']] == [('SV1_BP1', 'rendered'), ('SV1_BP2', 'failed')]
+    png_name = script.png_files[0]
+    assert join.result['snapshots'][0]['png'] == png_name
+    assert read_chunks(png_name)[0][1][:8] == b"\x00\x00\x00\x14\x00\x00\x00\x3c" # 20 x 60
+    assert not os.path.exists(script.png_files[1])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""Tests for the snapshot planner."""
+
+from igv_snapshot_maker.planner import chrom_key, limit_windows, pair_breakpoints, plan_snapshots, write_snapshot_map
+
+
+def sp(name, chr, start, stop, ext=None):
+    rv = {'name': name, 'chr': chr, 'start': start, 'stop': stop}
+    if ext is not None:
+        rv['ext'] = ext
+    return rv
+
+
+snapshots = [
+    sp('SV1_BP1', '1', 1000, 1100),
+    sp('SV1_BP2', '8', 5000, 5100),
+    sp('SV2_BP1', '1', 1020, 1080),          # contained in SV1_BP1
+    sp('SV2_BP2', 'X', 100, 200),
+    sp('SV3_BP1', 'chr1', 1000, 1100),       # identical window to SV1_BP1
+    sp('SV3_BP2', '10', 50, 60),
+    sp('SV4_BP1', '1', 1050, 1200),          # overlaps only
+]
+
+
+def test_chrom_key():
+    chroms = ['X', 'chr10', 'GL000192.1', '2', 'MT', 'chr1', 'Y']
+    assert sorted(chroms, key=chrom_key) == ['chr1', '2', 'chr10', 'X', 'Y', 'MT', 'GL000192.1']
+
+
+def test_keep_input_order():
+    plan = plan_snapshots(snapshots, 100, sort=False)
+    assert [p.snapshot['name'] for p in plan] == [s['name'] for s in snapshots]
+
+
+def test_sort():
+    plan = plan_snapshots(snapshots, 100)
+    assert [p.snapshot['name'] for p in plan] == [
+        'SV1_BP1', 'SV3_BP1', 'SV2_BP1', 'SV4_BP1', 'SV1_BP2', 'SV3_BP2', 'SV2_BP2']
+
+
+def test_coalesce(tmp_path):
+    plan = plan_snapshots(snapshots, 100, coalesce=True)
+    assert [p.snapshot['name'] for p in plan] == ['SV1_BP1', 'SV4_BP1', 'SV1_BP2', 'SV3_BP2', 'SV2_BP2']
+    assert [a['name'] for a in plan[0].aliases] == ['SV3_BP1', 'SV2_BP1']
+
+    # a wider extension is not contained
+    plan = plan_snapshots([sp('A', '1', 1000, 1100), sp('B', '1', 1020, 1080, ext=500)], 100, coalesce=True)
+    assert [p.snapshot['name'] for p in plan] == ['B']
+
+    map_fn = tmp_path / 'snapshot_map.tsv'
+    write_snapshot_map(str(map_fn), plan, lambda x: x)
+    assert map_fn.read_text() == "snapshot\tpng\nB\tB.png\nA\tB.png\n"
+
+
+def test_pair_breakpoints(tmp_path):
+    pairs = pair_breakpoints(snapshots)
+    assert [p['name'] for p in pairs] == ['SV1', 'SV2', 'SV3', 'SV4_BP1']
+    assert [m['name'] for m in pairs[0]['mates']] == ['SV1_BP1', 'SV1_BP2']
+    assert (pairs[0]['chr'], pairs[0]['start'], pairs[0]['stop']) == ('1', 1000, 1100)
+
+    # explicit mates, and a BP2 before its BP1
+    mates = [dict(sp('A', '2', 10, 20), mate='B'), sp('X_BP2', '3', 5, 5), dict(sp('B', '4', 30, 40), mate='A'), sp('X_BP1', '5', 1, 1)]
+    pairs = pair_breakpoints(mates)
+    assert [p['name'] for p in pairs] == ['A_B', 'X']
+    assert [m['name'] for m in pairs[1]['mates']] == ['X_BP1', 'X_BP2']
+
+    # a pair is sorted by its first breakpoint and never coalesced
+    plan = plan_snapshots(pair_breakpoints(snapshots), 100, coalesce=True)
+    assert [p.snapshot['name'] for p in plan] == ['SV1', 'SV3', 'SV2', 'SV4_BP1']
+
+    map_fn = tmp_path / 'snapshot_map.tsv'
+    write_snapshot_map(str(map_fn), plan[:1], lambda x: x)
+    assert map_fn.read_text() == "snapshot\tpng\nSV1_BP1\tSV1.png\nSV1_BP2\tSV1.png\n"
+
+
+def test_limit_windows():
+    wide = [sp('A', '1', 1000, 1100), sp('B', '1', 10000, 500000, ext=200)]
+    assert limit_windows(wide, 100) == (wide, [])
+
+    kept, skipped = limit_windows(wide, 100, max_window=300000, policy='split')
+    assert skipped == [] and kept[0] is wide[0]
+    assert kept[1]['policy'] == 'split'
+    assert kept[1]['flanks'] == [{'chr': '1', 'start': 10000, 'stop': 10000, 'ext': 200},
+                                 {'chr': '1', 'start': 500000, 'stop': 500000, 'ext': 200}]
+
+    kept, skipped = limit_windows(wide, 100, max_window=300000, policy='skip')
+    assert kept == wide[:1] and [s['name'] for s in skipped] == ['B']
+
+    # the window includes the extension, and a coverage-only window is never coalesced
+    kept, skipped = limit_windows(wide + [sp('C', '1', 20000, 20100)], 100, max_window=490000)
+    assert kept[1]['policy'] == 'coverage'
+    assert [p.snapshot['name'] for p in plan_snapshots(kept, 100, coalesce=True)] == ['A', 'B', 'C']
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""Tests for the PNG post-processing."""
+
+import os
+import time
+import zlib
+
+import pytest
+
+from igv_snapshot_maker.mock_igv import write_png
+from igv_snapshot_maker.postprocess import (PNG_Postprocessor, read_chunks, write_chunks, recompress_png,
+                                            process_png, stitch_pngs, write_postprocess_report, HAS_PILLOW)
+
+
+def pixels(png_name):
+    return zlib.decompress(b"".join(d for t, d in read_chunks(png_name) if t == b"IDAT"))
+
+
+def test_recompress_png(tmp_path):
+    png_name = str(tmp_path / "SV1.png")
+    write_png(png_name, width=200, height=100)
+    # split the image data over several chunks, compressed at the lowest level, with a text chunk
+    data = zlib.compress(pixels(png_name), 0)
+    chunks = [c for c in read_chunks(png_name) if c[0] != b"IDAT"]
+    write_chunks(png_name, chunks[:1] + [(b"tEXt", b"Software\x00IGV"), (b"IDAT", data[:100]), (b"IDAT", data[100:])] + chunks[1:])
+    before = pixels(png_name)
+    size = os.path.getsize(png_name)
+
+    assert recompress_png(png_name) == (size, os.path.getsize(png_name))
+    new_size = os.path.getsize(png_name)
+    assert new_size < size
+    assert pixels(png_name) == before
+    assert [t for t, d in read_chunks(png_name)] == [b"IHDR", b"IDAT", b"IEND"]
+
+    # already smaller: left as it is
+    assert recompress_png(png_name) == (new_size, new_size)
+
+
+def test_process_png_errors(tmp_path):
+    bad = tmp_path / "bad.png"
+    bad.write_bytes(b"not a png")
+    row = process_png(str(bad))
+    assert row['error'].startswith("ValueError") and row['size'] == 9
+
+
+def test_postprocessor(tmp_path):
+    png_files = [str(tmp_path / ("SV%d.png" % k)) for k in range(1, 4)]
+    post = PNG_Postprocessor(jobs=1, poll=0.05).start()
+    done = []
+    post.watch('G', png_files)
+    for png_name in png_files[:2]:
+        write_png(png_name, width=50, height=50)
+    post.finish('G', on_done=lambda: done.append('G'))
+    post.finish('unknown', on_done=lambda: done.append('unknown'))
+    rows = post.close()
+
+    assert sorted(done) == ['G', 'unknown']
+    assert sorted(r['png'] for r in rows) == png_files[:2]
+    assert all(r['group'] == 'G' and r['error'] is None for r in rows)
+
+    report_fn = str(tmp_path / "postprocess.tsv")
+    write_postprocess_report(rows, report_fn)
+    assert open(report_fn).readline().split() == ['group', 'png', 'size', 'recompressed_size', 'webp', 'thumbnail', 'error']
+
+
+def test_postprocessor_watch(tmp_path):
+    png_files = [str(tmp_path / ("SV%d.png" % k)) for k in range(1, 4)]
+    post = PNG_Postprocessor(jobs=1, poll=0.05).start()
+    post.watch('G', png_files)
+    g = post.groups[0]
+    for png_name in png_files[:2]:
+        write_png(png_name, width=50, height=50)
+    time.sleep(0.2)
+    # the group is still queued
+    assert (g.written, g.submitted) == (0, set())
+
+    post.rendering('G')
+    deadline = time.time() + 5
+    while len(g.submitted) == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    # the last PNG file written may still be incomplete
+    assert (g.written, g.next, g.submitted) == (2, 1, set(png_files[:1]))
+
+    post.finish('G')
+    rows = post.close()
+    assert sorted(r['png'] for r in rows) == png_files[:2]
+
+
+@pytest.mark.skipif(not HAS_PILLOW, reason="Pillow is not installed")
+def test_thumbnails(tmp_path):
+    png_files = [str(tmp_path / ("SV%d.png" % k)) for k in range(1, 3)]
+    for png_name in png_files:
+        write_png(png_name, width=800, height=600)
+    post = PNG_Postprocessor(jobs=1, webp=True, thumbnail_width=200, contact_sheet=True, poll=0.05).start()
+    post.watch('G', png_files)
+    post.finish('G')
+    rows = post.close()
+    assert all(os.path.isfile(r['webp']) and os.path.isfile(r['thumbnail']) for r in rows)
+    assert os.path.isfile(str(tmp_path / "thumbnails" / "contact_sheet.png"))
+
+
+def unfilter(data, width, bpp=3):
+    """Reference PNG unfiltering, to check the stitched pixels"""
+    stride = width * bpp
+    rows = []
+    prior = bytearray(stride)
+    for pos in range(0, len(data), stride + 1):
+        kind, row = data[pos], bytearray(data[pos + 1:pos + 1 + stride])
+        for i in range(stride):
+            a = row[i - bpp] if i >= bpp else 0
+            b = prior[i]
+            c = prior[i - bpp] if i >= bpp else 0
+            if kind == 1:
+                row[i] = (row[i] + a) & 0xff
+            elif kind == 2:
+                row[i] = (row[i] + b) & 0xff
+            elif kind == 3:
+                row[i] = (row[i] + ((a + b) >> 1)) & 0xff
+            elif kind == 4:
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                row[i] = (row[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xff
+        rows.append(bytes(row))
+        prior = row
+    return(rows)
+
+
+def test_stitch_pngs(tmp_path):
+    width = 4
+    panel_files = []
+    expected = []
+    # one panel per filter of the first row: the rows below use the filters too
+    for kind in range(5):
+        rows = [bytes((17 * kind + 3 * i + 40 * r) & 0xff for i in range(width * 3)) for r in range(3)]
+        data = b"".join(bytes([kind]) + row for row in rows)
+        expected.extend(unfilter(data, width))
+        png_name = str(tmp_path / ("panel%d.png" % kind))
+        write_png(png_name, width=width, height=3)
+        chunks = read_chunks(png_name)
+        write_chunks(png_name, [(t, zlib.compress(data) if t == b"IDAT" else d) for t, d in chunks])
+        panel_files.append(png_name)
+
+    out_name = str(tmp_path / "SV1.png")
+    assert stitch_pngs(panel_files, out_name) == (width, 15)
+    assert unfilter(pixels(out_name), width) == expected
+    assert not os.path.exists(out_name + ".tmp")
+
+    write_png(panel_files[0], width=width + 1, height=3)
+    if not HAS_PILLOW:
+        with pytest.raises(ValueError):
+            stitch_pngs(panel_files, out_name)
+
+
+def test_stitch_shared_rows(tmp_path):
+    width = 4
+    row = lambda kind, seed: bytes([kind]) + bytes((seed * 37 + 11 * i) & 0xff for i in range(width * 3))
+    header = [row(k % 5, k) for k in range(5)]
+    # the first row of the feature track depends on the row above it, so it is kept in every panel
+    footer = [row(2, 50), row(0, 51), row(4, 52), row(1, 53)]
+    panels = [header + [row(3, 20), row(4, 21), row(2, 22)] + footer, header + [row(4, 30), row(2, 31)] + footer]
+    panel_files = []
+    for k, rows in enumerate(panels):
+        png_name = str(tmp_path / ("panel%d.png" % k))
+        write_png(png_name, width=width, height=len(rows))
+        chunks = read_chunks(png_name)
+        write_chunks(png_name, [(t, zlib.compress(b"".join(rows)) if t == b"IDAT" else d) for t, d in chunks])
+        panel_files.append(png_name)
+
+    out_name = str(tmp_path / "SV1.png")
+    assert stitch_pngs(panel_files, out_name, crop_shared=True) == (width, 12 + 3)
+    expected = unfilter(b"".join(panels[0]), width) + unfilter(b"".join(panels[1]), width)[5:8]
+    assert unfilter(pixels(out_name), width) == expected
+
+    # the panels of a blank image are stitched whole
+    write_png(panel_files[1], width=width, height=3)
+    write_png(panel_files[0], width=width, height=3)
+    assert stitch_pngs(panel_files, out_name, crop_shared=True) == (width, 6)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""Tests for the bam/bai preflight, with small synthetic bam and bai files."""
+
+import gzip
+import struct
+
+import pytest
+
+from igv_snapshot_maker.preflight import BAM_Preflight, check_bam, reg2bins, PSEUDO_BIN
+
+
+def write_bam(bam_name, references):
+    """A bam file with a header only"""
+    text = b"@HD\tVN:1.6\n"
+    data = b"BAM\1" + struct.pack("<i", len(text)) + text + struct.pack("<i", len(references))
+    for name, length in references:
+        data += struct.pack("<i", len(name) + 1) + name.encode() + b"\0" + struct.pack("<i", length)
+    with gzip.open(bam_name, "wb") as bam:
+        bam.write(data)
+
+
+def write_bai(bai_name, bins, linear=None):
+    """A bai file with one chunk in each of the given bins of each reference
+
+    Args:
+        bins (list): the list of non-empty bins of each reference
+        linear (list, optional): the linear index of each reference. Defaults to None (no linear index).
+    """
+    data = b"BAI\1" + struct.pack("<i", len(bins))
+    for k, ref_bins in enumerate(bins):
+        data += struct.pack("<i", len(ref_bins) + 1)
+        for b in ref_bins:
+            data += struct.pack("<Ii", b, 1) + struct.pack("<QQ", 0, 100)
+        data += struct.pack("<Ii", PSEUDO_BIN, 2) + struct.pack("<QQQQ", 0, 100, 10 * len(ref_bins), 0)
+        offsets = [] if linear is None else linear[k]
+        data += struct.pack("<i%dQ" % len(offsets), len(offsets), *offsets)
+    with open(bai_name, "wb") as bai:
+        bai.write(data)
+
+
+@pytest.fixture
+def bam_dir(tmp_path):
+    refs = [("chr1", 249250621), ("chr2", 243199373)]
+    # reads in the 16 kb bin of chr1:1,000,000 only; none on chr2
+    leaf = reg2bins(1000000, 1000001)[-1]
+    write_bam(str(tmp_path / "a.bam"), refs)
+    write_bai(str(tmp_path / "a.bam.bai"), [[leaf], []])
+    write_bam(str(tmp_path / "noindex.bam"), refs)
+    return tmp_path
+
+
+def test_reg2bins():
+    assert reg2bins(0, 1) == [0, 1, 9, 73, 585, 4681]
+    assert reg2bins(16384, 16385)[-1] == 4682
+    assert len(reg2bins(0, 32768)) == 7
+
+
+def test_check_bam(bam_dir):
+    check = check_bam(str(bam_dir / "a.bam"))
+    assert check.ok
+    assert check.mapped == 10
+    assert check.has_reads('1', 999900, 1000100)
+    assert check.has_reads('chr1', 999900, 1000100)
+    assert not check.has_reads('1', 5000000, 5000400)
+    assert not check.has_reads('2', 999900, 1000100)
+    assert check.has_reads('17', 100, 200) is None
+
+    assert check_bam(str(bam_dir / "missing.bam")).status == "missing"
+    assert check_bam(str(bam_dir / "noindex.bam")).status == "no_index"
+
+
+def test_linear_index(bam_dir):
+    # the coarse bins have chunks, as in a whole genome bam; the reads start in the 16 kb windows 61 and 100,
+    # and the empty windows repeat the offset of the window before them
+    coarse = [0, 1, 9, 73, 585, 585 + 61 // 8, 585 + 100 // 8]
+    linear = [1000] * 100 + [5000]
+    write_bai(str(bam_dir / "a.bam.bai"), [coarse + [4681 + 61], []], linear=[linear, []])
+    check = check_bam(str(bam_dir / "a.bam"))
+    window = lambda w: (w * 16384 + 101, w * 16384 + 300)
+
+    assert check.has_reads('1', *window(61))
+    assert not check.has_reads('1', *window(80))
+    assert check.has_reads('1', *window(100))
+    assert not check.has_reads('1', *window(101))
+    # before the first reads, only the bins tell
+    assert check.has_reads('1', *window(5))
+
+
+@pytest.mark.parametrize("mode, n_bams, n_snapshots", [("report", 3, 2), ("flag", 1, 2), ("drop", 1, 1)])
+def test_preflight_modes(bam_dir, mode, n_bams, n_snapshots):
+    group = {
+        'name': 'G',
+        'bam_files': [str(bam_dir / f) for f in ["a.bam", "noindex.bam", "missing.bam"]],
+        'snapshots': [
+            {'name': 'hit', 'chr': '1', 'start': 1000000, 'stop': 1000010},
+            {'name': 'empty', 'chr': '2', 'start': 1000000, 'stop': 1000010},
+        ],
+    }
+    preflight = BAM_Preflight(str(bam_dir), mode=mode)
+    rv = preflight.check_group(group)
+    preflight.close()
+    assert len(rv['bam_files']) == n_bams
+    assert len(rv['snapshots']) == n_snapshots
+
+    loci = (bam_dir / "preflight_loci.tsv").read_text().splitlines()
+    assert loci[1].split("\t")[3] == "reads"
+    assert loci[2].split("\t")[3] == "empty"
+    bams = (bam_dir / "preflight_bams.tsv").read_text().splitlines()
+    assert [line.split("\t")[1] for line in bams[1:]] == ["ok", "no_index", "missing"]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Tests for the command timings and the run report."""
+
+import csv
+import json
+import sys
+
+from igv_snapshot_maker.igv_snapshot_maker import subprocess_cmd
+from igv_snapshot_maker.report import Command_Timer, snapshot_report, write_run_report
+
+
+def make_timer(snapshot_dir):
+    timer = Command_Timer()
+    commands = [
+        (0, "new"), (1, "load /data/a.bam"), (4, "sort base"),
+        (5, "snapshotDirectory %s" % snapshot_dir),
+        (5, "region chr1 100 200 SV1"), (5, "goto 1:0-300"), (7, "sort base"), (7.5, "collapse"),
+        (8, "snapshot SV1.png"), (9, "goto 2:0-300"), (10, "snapshot SV2.png"),
+    ]
+    for t, c in commands:
+        timer.start(c, t=t)
+    timer.finish(t=12)
+    return timer
+
+
+def test_snapshot_timings(tmp_path):
+    timer = make_timer(str(tmp_path))
+    assert timer.load_timings() == [("/data/a.bam", 3)]
+    timings = timer.snapshot_timings()
+    sv1 = timings[str(tmp_path / "SV1.png")]
+    assert sv1 == {'locus': '1:0-300', 'goto_s': 2, 'track_s': 1, 'snapshot_s': 1, 'total_s': 4}
+    assert timings[str(tmp_path / "SV2.png")]['total_s'] == 3
+
+
+def test_igv_log_lines():
+    timer = Command_Timer()
+    timer.on_igv_line("INFO [2021-02-01 10:00:00,000]  [BatchRunner.java:63] [BatchRunner] Executing Command: goto 1:100-200")
+    timer.on_igv_line("INFO [2021-02-01 10:00:00,000]  [GenomeManager.java:200] Loading genome")
+    timer.finish()
+    assert [c for c, d in timer.durations()] == ["goto 1:100-200"]
+
+
+def test_streamed_output_is_not_ascii_only():
+    lines = []
+    returncode = subprocess_cmd("%s -c \"print('r\\u00e9gion'); print('Executing Command: new')\"" % sys.executable, on_line=lines.append)
+    assert returncode == 0
+    assert lines == ["région", "Executing Command: new"]
+
+
+def test_write_run_report(tmp_path):
+    (tmp_path / "SV1.png").write_bytes(b"png")
+    timer = make_timer(str(tmp_path))
+    result = {'group': 'G', 'status': 'failed', 'returncode': 0, 'loads': timer.load_timings(),
+              'snapshots': snapshot_report('G', [str(tmp_path / "SV1.png"), str(tmp_path / "SV2.png")], timer)}
+    write_run_report([result], str(tmp_path))
+
+    report = json.load(open(str(tmp_path / "run_report.json")))
+    assert report['groups'][0]['load_s'] == 3
+    rows = list(csv.DictReader(open(str(tmp_path / "run_report.csv"))))
+    assert [(r['snapshot'], r['status'], r['png_size']) for r in rows] == [('SV1', 'rendered', '3'), ('SV2', 'failed', '')]
+
+
+def test_window_policies(tmp_path):
+    (tmp_path / "SV1.png").write_bytes(b"png")
+    timer = make_timer(str(tmp_path))
+    png_files = [str(tmp_path / "SV1.png"), str(tmp_path / "SV2.png")]
+    result = {'group': 'G', 'status': 'failed', 'returncode': 0, 'snapshots': snapshot_report('G', png_files, timer)}
+    wide = {'name': 'SV3', 'chr': '1', 'start': 1000, 'stop': 900000, 'policy': 'skip'}
+    write_run_report([result], str(tmp_path), policies={png_files[1]: 'split'}, skipped=[('G', wide)])
+
+    rows = list(csv.DictReader(open(str(tmp_path / "run_report.csv"))))
+    assert [(r['snapshot'], r['status'], r['policy']) for r in rows] == [
+        ('SV1', 'rendered', 'full'), ('SV2', 'failed', 'split'), ('SV3', 'skipped', 'skip')]
+    assert rows[2]['locus'] == '1:1000-900000'
+    assert json.load(open(str(tmp_path / "run_report.json")))['skipped'][0]['snapshot'] == 'SV3'
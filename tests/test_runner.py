@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""Tests for the IGV worker pool."""
+
+import os
+
+import pytest
+
+from igv_snapshot_maker.runner import IGV_Worker_Pool, write_summary
+
+
+class FakeMaker:
+    """Write the expected PNG files instead of running IGV"""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.pngs = {}
+
+    def call_igv(self, bat_name, timer=None):
+        if bat_name in self.failing:
+            return(1)
+        for f in self.pngs[bat_name]:
+            open(f, 'w').close()
+        return(0)
+
+
+def test_pool_results_in_submission_order(tmp_path):
+    maker = FakeMaker(failing=['g2.bat'])
+    pool = IGV_Worker_Pool(maker, jobs=3)
+    for i in range(1, 6):
+        bat = 'g%d.bat' % i
+        maker.pngs[bat] = [str(tmp_path / ('g%d.png' % i))]
+        pool.submit('g%d' % i, bat, maker.pngs[bat])
+
+    results = pool.wait()
+    assert [r['group'] for r in results] == ['g1', 'g2', 'g3', 'g4', 'g5']
+    assert [r['status'] for r in results] == ['success', 'failed', 'success', 'success', 'success']
+
+    summary_fn = str(tmp_path / 'run_summary.tsv')
+    assert write_summary(results, summary_fn) == 1
+    lines = open(summary_fn).read().splitlines()
+    assert lines[0].split("\t")[:2] == ['group', 'status']
+    assert len(lines) == 6
+
+
+def test_missing_png_is_a_failure(tmp_path):
+    maker = FakeMaker()
+    maker.pngs['a.bat'] = []
+    pool = IGV_Worker_Pool(maker, jobs=1)
+    pool.submit('a', 'a.bat', [str(tmp_path / 'never.png')])
+    assert pool.wait()[0]['status'] == 'failed'
+
+
+def test_invalid_jobs():
+    with pytest.raises(ValueError):
+        IGV_Worker_Pool(FakeMaker(), jobs=0)
+
+
+def test_session_results_per_group(tmp_path):
+    maker = FakeMaker()
+    pngs = [str(tmp_path / 'a.png'), str(tmp_path / 'b.png')]
+    maker.pngs['s.bat'] = pngs[:1]
+    done = []
+    pool = IGV_Worker_Pool(maker, jobs=2)
+    pool.submit_session('s.bat', [('a', pngs[:1], done.append), ('b', pngs[1:], done.append)])
+    results = pool.wait()
+    assert [(r['group'], r['status']) for r in results] == [('a', 'success'), ('b', 'failed')]
+    assert len(done) == 2
+
+
+class CrashingMaker(FakeMaker):
+    """Write only the first missing PNG file of each batch script, then crash"""
+
+    def __init__(self):
+        FakeMaker.__init__(self)
+        self.calls = []
+
+    def call_igv(self, bat_name, timer=None):
+        self.calls.append(bat_name)
+        if len(self.pngs[bat_name]) > 0:
+            with open(self.pngs[bat_name][0], 'w') as png:
+                png.write('png')
+        return(1)
+
+
+def test_retry_missing_snapshots(tmp_path):
+    maker = CrashingMaker()
+    pngs = [str(tmp_path / ('%d.png' % k)) for k in range(4)]
+    maker.pngs['g.bat'] = pngs
+
+    def retry(missing, attempt):
+        bat = 'g_retry%d.bat' % attempt
+        maker.pngs[bat] = list(missing)
+        return(bat)
+
+    pool = IGV_Worker_Pool(maker, jobs=1, retries=2)
+    pool.submit('g', 'g.bat', pngs, retry=retry)
+    result = pool.wait()[0]
+    assert maker.calls == ['g.bat', 'g_retry1.bat', 'g_retry2.bat']
+    assert result['attempts'] == 3
+    assert result['rendered'] == 3
+    assert result['quarantined'] == pngs[3:]
+    assert [r['status'] for r in result['snapshots']] == ['rendered'] * 3 + ['quarantined']
+
+
+def test_stale_png_is_quarantined(tmp_path):
+    maker = FakeMaker(failing=['g.bat'])
+    pngs = [str(tmp_path / 'old.png')]
+    # left by an earlier run
+    with open(pngs[0], 'w') as png:
+        png.write('png')
+    os.utime(pngs[0], (1000000000, 1000000000))
+
+    pool = IGV_Worker_Pool(maker, jobs=1, retries=0)
+    pool.submit('g', 'g.bat', pngs, retry=lambda missing, attempt: None)
+    result = pool.wait()[0]
+    assert (result['status'], result['rendered'], result['attempts']) == ('failed', 0, 1)
+    assert result['quarantined'] == pngs
+    assert [r['status'] for r in result['snapshots']] == ['quarantined']
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""Tests for the snapshot service, against the mock IGV port server."""
+
+import os
+import json
+import time
+
+import pytest
+
+from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.igv_port import IGV_Session
+from igv_snapshot_maker.mock_igv import Mock_IGV_Server
+from igv_snapshot_maker.service import Request_Queue, Snapshot_Request, Snapshot_Service, request_snapshots
+
+
+def request(id, bams=('/data/a.bam',), name='SV1_BP1'):
+    return({'id': id, 'group': 'G1', 'bam_files': list(bams), 'snapshots': [{'name': name, 'chr': '1', 'start': 1000, 'stop': 1100}]})
+
+
+def test_request():
+    r = Snapshot_Request(request('r1', bams=['/data/./a.bam']))
+    assert (r.id, r.group, r.key) == ('r1', 'G1', ('/data/a.bam',))
+    assert Snapshot_Request({'bam_files': ['a.bam'], 'snapshots': [{'name': 'S', 'chr': '1', 'start': '5', 'stop': 9}]}).snapshots[0]['start'] == 5
+    with pytest.raises(ValueError):
+        Snapshot_Request({'id': 'r2', 'bam_files': ['a.bam'], 'snapshots': [{'name': 'S', 'chr': '1'}]})
+
+
+def test_request_queue():
+    queue = Request_Queue(steal_after=0.2, max_batch=2)
+    for r in [request('r1'), request('r2', bams=['/data/b.bam']), request('r3'), request('r4'), request('r5', bams=['/data/b.bam'])]:
+        queue.put(Snapshot_Request(r))
+
+    # the oldest request first, with the next ones for the same bam files, up to max_batch snapshots
+    assert [r.id for r in queue.take(0)] == ['r1', 'r3']
+    # worker 1 leaves the bam files of worker 0 to it
+    assert [r.id for r in queue.take(1)] == ['r2', 'r5']
+    assert queue.take(1, timeout=0.05) == []
+    assert [r.id for r in queue.take(0)] == ['r4']
+
+    # unless they waited too long
+    queue.put(Snapshot_Request(request('r6')))
+    time.sleep(0.25)
+    assert [r.id for r in queue.take(1, timeout=0.05)] == ['r6']
+    queue.close()
+    assert queue.take(0) == []
+
+
+@pytest.fixture
+def service(tmp_path):
+    servers = [Mock_IGV_Server(port=0).start() for k in range(2)]
+    maker = IGV_Snapshot_Maker(output_dir=str(tmp_path / "out"))
+    sessions = [IGV_Session(port=s.port, launch=False, timeout=5) for s in servers]
+    svc = Snapshot_Service(maker, sessions, str(tmp_path / "spool"), socket_name=str(tmp_path / "serve.sock"), poll=0.05).start()
+    svc.servers = servers
+    yield svc
+    svc.stop()
+    for s in servers:
+        s.stop()
+
+
+def test_socket_requests(service, tmp_path):
+    first = request_snapshots(service.socket_name, request('r1'), timeout=10)
+    assert (first['status'], first['warm']) == ('rendered', False)
+    assert first['png_files'] == [str(tmp_path / "out" / "G1" / "SV1_BP1.png")]
+
+    # the same bam files: the worker keeps them loaded and only takes the snapshot
+    second = request_snapshots(service.socket_name, request('r2', name='SV1_BP2'), timeout=10)
+    assert (second['status'], second['warm'], second['worker']) == ('rendered', True, first['worker'])
+    commands = service.servers[first['worker'] - 1].commands
+    assert commands.count("load /data/a.bam") == 1
+    assert commands[-1] == "snapshot SV1_BP2.png"
+
+    rejected = request_snapshots(service.socket_name, {'id': 'r3', 'bam_files': ['/data/a.bam']}, timeout=10)
+    assert rejected['status'] == 'rejected'
+
+
+def test_spool_requests(service, tmp_path):
+    spool = tmp_path / "spool"
+    (spool / "incoming" / "s1.json").write_text(json.dumps(request(None)))
+    (spool / "incoming" / "s2.json").write_text("{not json")
+    (spool / "incoming" / "s3.json").write_text(json.dumps(request('../../s3_escaped')))
+    (spool / "incoming" / "s4.json").write_text(json.dumps(["not", "an", "object"]))
+    deadline = time.time() + 10
+    expected = [spool / "done" / n for n in ("s1.json.request", "s3_escaped.json", "s4.json")]
+    while not all(fn.exists() for fn in expected) and time.time() < deadline:
+        time.sleep(0.05)
+
+    record = json.loads((spool / "done" / "s1.json").read_text())
+    assert (record['id'], record['status']) == ('s1', 'rendered')
+    assert os.path.isfile(record['png_files'][0])
+    assert (spool / "done" / "s1.json.request").exists()
+    assert (spool / "failed" / "s2.json").exists()
+    assert os.listdir(str(spool / "incoming")) == []
+
+    # the record of an id with a path stays in the spool, the one of a rejected request is named after its file
+    assert json.loads((spool / "done" / "s3_escaped.json").read_text())['status'] == 'rendered'
+    assert not (tmp_path / "s3_escaped.json").exists()
+    assert json.loads((spool / "done" / "s4.json").read_text())['status'] == 'rejected'
+    assert (spool / "failed" / "s4.json.request").exists()
+
+
+def test_failed_batch_answered_once(tmp_path):
+    svc = Snapshot_Service(IGV_Snapshot_Maker(output_dir=str(tmp_path / "out")), [], str(tmp_path / "spool"))
+    records = []
+    requests = [svc.submit(request(id), reply=records.append) for id in ('r1', 'r2')]
+
+    def render(worker, batch):
+        svc.answer(batch[0], {'id': batch[0].id, 'status': 'rendered'})
+        raise RuntimeError("IGV crashed")
+    svc.render = render
+    svc.stopped.set()
+    svc.queue.close()
+    svc.work(0)
+    assert [(r['id'], r['status']) for r in records] == [('r1', 'rendered'), ('r2', 'failed')]
+    assert all(r.answered for r in requests)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""Tests for the sharding of the groups."""
+
+import os
+import json
+
+import pytest
+
+from igv_snapshot_maker.shard import (parse_shard, assign_shards, plan_shards, write_plan,
+                                      Shard_Filter, merge_shards, shard_dir)
+
+
+def make_groups(sizes):
+    return([{'name': 'G%d' % k, 'bam_files': ['/none/a.bam'], 'snapshots': [{}] * n} for k, n in enumerate(sizes)])
+
+
+def test_parse_shard():
+    assert parse_shard("3/10") == (3, 10)
+    for text in ["0/3", "4/3", "3", "a/b"]:
+        with pytest.raises(ValueError):
+            parse_shard(text)
+
+
+def test_assign_shards_balanced_and_stable():
+    costs = [10, 1, 7, 3, 3, 6]
+    assert assign_shards(costs, 2) == [1, 2, 2, 1, 1, 2] # 16 and 14
+    assert assign_shards(costs, 2) == assign_shards(list(costs), 2)
+    assert assign_shards(costs, 1) == [1] * 6
+
+
+def test_plan_cost_uses_file_sizes(tmp_path):
+    bam = tmp_path / "a.bam"
+    bam.write_bytes(b"\0" * 1000)
+    (tmp_path / "a.bam.bai").write_bytes(b"\0" * 2000000)
+    groups = [{'name': 'big', 'bam_files': [str(bam)], 'snapshots': [{}]},
+              {'name': 'small', 'bam_files': ['/none/a.bam'], 'snapshots': [{}]}]
+    rows = plan_shards(groups, 2)
+    assert rows[0]['cost'] > rows[1]['cost']
+    assert [r['shard'] for r in rows] == [1, 2]
+
+
+def test_filter_with_plan(tmp_path):
+    groups = make_groups([5, 1, 4, 2])
+    plan_fn = str(tmp_path / "plan.tsv")
+    write_plan(plan_fn, plan_shards(groups, 2))
+
+    picked = [[g['name'] for g in Shard_Filter.from_plan(s, 2, plan_fn).filter(groups)] for s in (1, 2)]
+    assert sorted(picked[0] + picked[1]) == ['G0', 'G1', 'G2', 'G3']
+    assert picked == [[g['name'] for g in Shard_Filter.from_groups(s, 2, groups).filter(groups)] for s in (1, 2)]
+
+    groups[1]['name'] = 'renamed'
+    with pytest.raises(ValueError):
+        list(Shard_Filter.from_plan(1, 2, plan_fn).filter(groups))
+
+
+def test_merge_shards(tmp_path):
+    for s in (1, 2):
+        d = shard_dir(str(tmp_path), s, 2)
+        os.makedirs(d)
+        with open(os.path.join(d, "run_summary.tsv"), "w") as out:
+            out.write("group\tstatus\nG%d\tsuccess\n" % s)
+        with open(os.path.join(d, "run_report.json"), "w") as out:
+            out.write('{"groups": [{"group": "G%d"}]}' % s)
+    os.makedirs(str(tmp_path / "shards" / "shard_plan.tsv.d")) # not a shard folder
+
+    assert merge_shards(str(tmp_path)) == 2
+    assert (tmp_path / "run_summary.tsv").read_text() == "group\tstatus\nG1\tsuccess\nG2\tsuccess\n"
+    assert '"G2"' in (tmp_path / "run_report.json").read_text()
+
+
+def test_merge_into_an_earlier_run(tmp_path):
+    record = lambda g, size: json.dumps({'group': g, 'name': 'S', 'digest': 'd', 'png': 'S.png', 'size': size}) + "\n"
+    # the manifest and log of a run which was not sharded
+    (tmp_path / "snapshot_manifest.jsonl").write_text(record('G0', 1) + record('G1', 1))
+    (tmp_path / "my_log.txt").write_text("run\n")
+    for s in (1, 2):
+        d = shard_dir(str(tmp_path), s, 2)
+        os.makedirs(d)
+        with open(os.path.join(d, "snapshot_manifest.jsonl"), "w") as out:
+            out.write(record('G%d' % s, 2))
+        with open(os.path.join(d, "my_log.txt"), "w") as out:
+            out.write("shard %d\n" % s)
+
+    for k in range(2):
+        assert merge_shards(str(tmp_path)) == 2
+        records = [json.loads(line) for line in (tmp_path / "snapshot_manifest.jsonl").read_text().splitlines()]
+        assert sorted((r['group'], r['size']) for r in records) == [('G0', 1), ('G1', 2), ('G2', 2)]
+        assert (tmp_path / "my_log.txt").read_text() == (
+            "run\n==> shard_0001of0002 <==\nshard 1\n==> shard_0002of0002 <==\nshard 2\n")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""Tests for the snapshot cache."""
+
+import os
+import time
+
+from igv_snapshot_maker.igv_snapshot_maker import IGV_Snapshot_Maker
+from igv_snapshot_maker.manifest import snapshot_digest
+from igv_snapshot_maker.mock_igv import write_png
+from igv_snapshot_maker.snapshot_cache import Snapshot_Cache, detach_png, render_screen
+
+sp = {'name': 'SV1_BP1', 'chr': '1', 'start': 1000, 'stop': 1100}
+
+
+def test_key(tmp_path):
+    bam = tmp_path / "a.bam"
+    bam.write_bytes(b"BAM\x01")
+    bams = [str(bam)]
+    maker = IGV_Snapshot_Maker(output_dir=str(tmp_path))
+    cache = Snapshot_Cache(str(tmp_path / "cache"))
+    key = cache.key(maker, bams, snapshot_digest(maker, bams, sp))
+    assert key == Snapshot_Cache(str(tmp_path / "cache")).key(maker, bams, snapshot_digest(maker, bams, sp))
+    assert render_screen(maker, bams) == "3200x2400x24"
+
+    # the region, the settings, the screen and the bam files are all part of the key
+    assert key != cache.key(maker, bams, snapshot_digest(maker, bams, dict(sp, ext=500)))
+    maker.track_setting = "collapse\n"
+    assert key != cache.key(maker, bams, snapshot_digest(maker, bams, sp))
+    maker.track_setting = "sort base\ncollapse\n"
+    maker.set_xvfb_cmd('xvfb-run --server-args="-screen 0 1600x1200x24" igv -b ')
+    assert key != cache.key(maker, bams, snapshot_digest(maker, bams, sp))
+    maker.set_xvfb_cmd('xvfb-run --auto-servernum --server-args="-screen 0 3200x2400x24" igv -b ')
+    bam.write_bytes(b"BAM\x01 realigned")
+    assert key != Snapshot_Cache(str(tmp_path / "cache")).key(maker, bams, snapshot_digest(maker, bams, sp))
+
+
+def test_fetch_and_store(tmp_path):
+    cache = Snapshot_Cache(str(tmp_path / "cache"))
+    png_name = str(tmp_path / "run1" / "G" / "SV1_BP1.png")
+    assert not cache.fetch("ab" * 32, png_name)
+
+    os.makedirs(os.path.dirname(png_name))
+    write_png(png_name, width=50, height=50)
+    assert cache.store_group([("ab" * 32, png_name), ("cd" * 32, png_name + ".missing")]) == 1
+
+    other = str(tmp_path / "run2" / "G" / "SV1_BP1.png")
+    assert cache.fetch("ab" * 32, other)
+    assert open(other, "rb").read() == open(png_name, "rb").read()
+    assert os.stat(other).st_nlink == 3 # the object and the two snapshots
+
+    # rendered again: the snapshot is unlinked first, so the cached image is left as it is
+    detach_png(other)
+    assert not os.path.exists(other)
+
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses'], stats['stored']) == (1, 1, 1, 1)
+    assert stats['size'] == os.path.getsize(png_name)
+
+    # a damaged image is a miss
+    with open(cache.object_name("ab" * 32), "ab") as out:
+        out.write(b"garbage")
+    assert not cache.fetch("ab" * 32, other)
+    assert cache.stats()['entries'] == 0
+    cache.close()
+
+
+def test_evict(tmp_path):
+    cache = Snapshot_Cache(str(tmp_path / "cache"), max_size=None)
+    for k in range(4):
+        png_name = str(tmp_path / ("SV%d.png" % k))
+        write_png(png_name, width=50, height=50)
+        cache.store("%064d" % k, png_name)
+        time.sleep(0.01)
+    size = os.path.getsize(png_name)
+    # the first snapshot was used last
+    assert cache.fetch("%064d" % 0, str(tmp_path / "copy.png"))
+
+    assert cache.evict(max_size=2.5 * size / 1e6) == 2
+    assert not os.path.exists(cache.object_name("%064d" % 1))
+    assert [cache.fetch("%064d" % k, str(tmp_path / "copy.png")) for k in range(4)] == [True, False, False, True]
+    assert cache.stats()['evicted'] == 2
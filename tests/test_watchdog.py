@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+"""Tests for the IGV watchdog."""
+
+import os
+import sys
+
+from igv_snapshot_maker.igv_snapshot_maker import subprocess_cmd
+from igv_snapshot_maker.watchdog import Watchdog
+
+
+def test_check(tmp_path):
+    pngs = [str(tmp_path / 'a.png'), str(tmp_path / 'b.png')]
+    watchdog = Watchdog(pngs, timeout=100, snapshot_timeout=10)
+    watchdog.started = watchdog.last_progress = t0 = os.stat(str(tmp_path)).st_mtime
+
+    assert watchdog.check(now=t0 + 5) is None
+    assert watchdog.check(now=t0 + 11) == 'stalled'
+    open(pngs[0], 'w').close()
+    assert watchdog.check(now=t0 + 12) is None
+    assert watchdog.next_png == 1
+    open(pngs[1], 'w').close()
+    assert watchdog.check(now=t0 + 50) is None # nothing left to wait for
+    assert watchdog.check(now=t0 + 101) == 'timeout'
+
+
+def test_kill_hung_process(tmp_path):
+    watchdog = Watchdog([str(tmp_path / 'never.png')], snapshot_timeout=0.5, poll=0.1)
+    returncode = subprocess_cmd('%s -c "import time; time.sleep(60)"' % sys.executable, watchdog=watchdog)
+    assert watchdog.reason == 'stalled'
+    assert returncode != 0